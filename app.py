@@ -1,2 +1,4 @@
 #!/usr/bin/env python
-from slice_scanner import *
\ No newline at end of file
+from slice_scanner import run
+
+run()
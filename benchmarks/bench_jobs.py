@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""
+Distributed scrape job throughput against the number of workers. Jobs simulate a page scrape with a sleep
+
+    python benchmarks/bench_jobs.py                            # worker threads on an in process fake (mongomock)
+    python benchmarks/bench_jobs.py mongodb://localhost:27017  # worker processes on a local mongod
+"""
+import os
+import sys
+from multiprocessing import Process
+from threading import Thread, Lock
+from time import sleep, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from slice_scanner.jobs import JobQueue
+from slice_scanner.worker import Worker
+
+JOBS = 100
+JOB_SECONDS = 0.2 # Real work units take seconds
+WORKER_COUNTS = [1, 2, 4, 8]
+
+class FakeJobQueue(JobQueue):
+    # mongomock's find_one_and_update isn't atomic across threads the way mongod's is
+    claim_lock = Lock()
+
+    def claim(self, worker_id):
+        with self.claim_lock:
+            return JobQueue.claim(self, worker_id)
+
+def _scrape(job):
+    sleep(JOB_SECONDS)
+
+def _drain(jobs, worker_id):
+    worker = Worker(jobs, _scrape, worker_id)
+    while worker.work_once():
+        pass
+
+def _drain_in_process(uri, worker_id):
+    from pymongo import MongoClient
+    _drain(JobQueue(MongoClient(uri).slice_bench.jobs), worker_id)
+
+def _run(jobs, workers, uri):
+    jobs.collection.delete_many({})
+    for i in range(JOBS):
+        jobs.enqueue("Bench Pizza", "pizzas", i)
+
+    start = time()
+    if uri:
+        runners = [Process(target=_drain_in_process, args=(uri, "bench-%s" % i)) for i in range(workers)]
+    else:
+        runners = [Thread(target=_drain, args=(jobs, "bench-%s" % i)) for i in range(workers)]
+    for runner in runners:
+        runner.start()
+    for runner in runners:
+        runner.join()
+    elapsed = time() - start
+
+    done = jobs.collection.find({"state": "done"}).count()
+    print "%8s %10.2f %10.1f %8s" % (workers, elapsed, done / elapsed, done)
+
+def main(uri):
+    if uri:
+        from pymongo import MongoClient
+        jobs = JobQueue(MongoClient(uri).slice_bench.jobs)
+    else:
+        import mongomock
+        jobs = FakeJobQueue(mongomock.MongoClient().slice_bench.jobs)
+
+    print "%s jobs of %sms on %s" % (JOBS, JOB_SECONDS * 1000, uri or "mongomock")
+    print "%8s %10s %10s %8s" % ("workers", "seconds", "jobs/s", "done")
+    for workers in WORKER_COUNTS:
+        _run(jobs, workers, uri)
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+"""
+The landing /pizza and /sides queries with the parameters the UI sends (every vendor and crust active, untouched
+range sliders, no toppings), answered by the leaderboards and by Mongo. Fails if the leaderboard can't answer them or
+answers any page it takes differently, ties included
+
+    python benchmarks/bench_leaderboard.py                             # dump/ on an in process fake (mongomock)
+    python benchmarks/bench_leaderboard.py mongodb://localhost:27017   # dump/ on a local mongod
+"""
+import json
+import os
+import sys
+from time import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from slice_scanner import dump
+from slice_scanner.database import Database
+from slice_scanner.leaderboard import Leaderboard
+
+RUNS = 50
+
+def _database(uri):
+    if uri:
+        from pymongo import MongoClient
+        client = MongoClient(uri)
+        client.drop_database("slice_bench")
+        return Database(client.slice_bench)
+    import mongomock
+    return Database(mongomock.MongoClient().slice_bench)
+
+def _range(db, collection_name, key):
+    bounds = db.range(collection_name, key)
+    return json.dumps([bounds["min"], bounds["max"]])
+
+def _pizza_parameters(db):
+    # As main.js fetch_pizza_parameters sends them on the first page
+    return {
+        "vendor": json.dumps(db.distinct("pizza", "vendor")),
+        "base_style": json.dumps(db.distinct("pizza", "base_style")),
+        "toppings": "[]",
+        "diameter": _range(db, "pizza", "diameter"),
+        "slices": _range(db, "pizza", "slices"),
+        "price": _range(db, "pizza", "price"),
+        "score": _range(db, "pizza", "score"),
+        "page": 0,
+        "sort_by": "score",
+        "sort_dir": -1,
+    }
+
+def _sides_parameters(db):
+    # As main.js fetch_sides_parameters sends them
+    return {
+        "vendor": json.dumps(db.distinct("sides", "vendor")),
+        "price": _range(db, "sides", "price"),
+        "page": 0,
+        "sort_by": "price",
+        "sort_dir": 1,
+    }
+
+def _time(query, parameters):
+    start = time()
+    for i in range(RUNS):
+        result = query(**parameters)
+    return result, (time() - start) / RUNS
+
+def _pages(db, name, query, parameters):
+    # Every page the leaderboard answers, product for product against Mongo's. False on the first that differs
+    leaderboards, page = db.leaderboards, 0
+    while True:
+        paged = dict(parameters, page=page)
+        answered = leaderboards[name].answer(
+            getattr(db, "_%s_filter" % name)(**paged), paged["sort_by"], paged["sort_dir"], page * db.PAGE_SIZE,
+            db.PAGE_SIZE
+        )
+        if not answered or not answered[0]:
+            return page
+        actual = query(**paged)
+        db.leaderboards = {}
+        expected = query(**paged)
+        db.leaderboards = leaderboards
+        if [product["hash"] for product in actual[0]] != [product["hash"] for product in expected[0]]:
+            print "%8s page %d differs" % (name, page)
+            return False
+        page += 1
+
+def main():
+    db = _database(sys.argv[1] if len(sys.argv) > 1 else None)
+    dump.load(db, os.path.join(ROOT, "dump"))
+    leaderboards = [
+        Leaderboard(db, "pizza", ["vendor", "style", "base_style"]),
+        Leaderboard(db, "sides", ["vendor", "type"], sort_by="price", sort_dir=1),
+    ]
+
+    failures = []
+    print "%8s %8s %12s %12s" % ("query", "count", "mongo ms", "top-k ms")
+    for name, query, to_filter, parameters in [
+        ("pizza", db.get_pizza, db._pizza_filter, _pizza_parameters(db)),
+        ("sides", db.get_sides, db._sides_filter, _sides_parameters(db))
+    ]:
+        db.leaderboards = {}
+        expected, mongo = _time(query, parameters)
+        db.leaderboards = dict((leaderboard.collection_name, leaderboard) for leaderboard in leaderboards)
+        answered = db.leaderboards[name].answer(
+            to_filter(**parameters), parameters["sort_by"], parameters["sort_dir"], 0, db.PAGE_SIZE
+        )
+        actual, top_k = _time(query, parameters)
+        print "%8s %8d %12.2f %12.2f" % (name, expected[1], mongo * 1000, top_k * 1000)
+        if answered is None or _pages(db, name, query, parameters) is False:
+            failures.append(name)
+
+    if failures:
+        print "Not answered by the leaderboard, or answered differently: %s" % ", ".join(failures)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+"""
+Meal optimiser solve times over the catalogues in dump/
+
+    python benchmarks/bench_optimiser.py [dump_dir]
+"""
+import os
+import sys
+from time import time
+
+import bson
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from slice_scanner.optimiser import MealOptimiser
+from slice_scanner.objects.pizza import Pizza
+
+REPEATS = 20
+
+class DumpCatalogue(object):
+
+    def __init__(self, dump_dir):
+        self.collections = {}
+        for name in ["pizza", "sides"]:
+            with open(os.path.join(dump_dir, "%s.bson" % name), "rb") as f:
+                self.collections[name] = bson.decode_all(f.read())
+
+    def all(self, collection_name):
+        return [dict(document) for document in self.collections[collection_name]]
+
+def _timed(func):
+    start = time()
+    result = func()
+    return (time() - start) * 1000, result
+
+def main(dump_dir):
+    catalogue = DumpCatalogue(dump_dir)
+    print "%s: %s pizzas, %s sides" % (dump_dir, len(catalogue.all("pizza")), len(catalogue.all("sides")))
+
+    optimiser = MealOptimiser(catalogue, Pizza.SLICES_PER_PERSON)
+    elapsed, _ = _timed(optimiser._snapshot)
+    print "snapshot build: %.2fms" % elapsed
+
+    print "%8s %10s %10s %10s  %s" % ("people", "cold ms", "warm ms", "price", "vendor")
+    for people in [1, 2, 4, 8, 16, 50, 100]:
+        optimiser.on_reset("pizza")
+        optimiser._snapshot()
+        cold, meal = _timed(lambda: optimiser.optimise(people, sides=["Chicken"]))
+        warm = sum(_timed(lambda: optimiser.optimise(people, sides=["Chicken"]))[0] for _ in range(REPEATS)) / REPEATS
+        print "%8s %10.3f %10.3f %10s  %s" % (people, cold, warm, meal and meal["price"], meal and meal["vendor"])
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else os.path.join(ROOT, "dump"))
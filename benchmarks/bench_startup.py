@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""
+Cold start import time of each role, in a fresh interpreter per run. Fails if a role goes over its budget or pulls in
+a dependency it shouldn't need
+
+    python benchmarks/bench_startup.py
+"""
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RUNS = 5
+
+# Role -> (modules it imports, dependencies it must not load, budget in seconds)
+ROLES = [
+    ("package", [], ["flask", "tornado", "selenium", "pymongo", "crontab"], 0.05),
+    ("web", [
+        "pymongo", "slice_scanner.database", "slice_scanner.leaderboard", "slice_scanner.equivalence",
+        "slice_scanner.search", "slice_scanner.optimiser", "slice_scanner.objects.pizza", "slice_scanner.web",
+        "tornado.wsgi", "tornado.httpserver", "tornado.ioloop"
+    ], ["selenium"], 1.0),
+    ("scrape", [
+        "pymongo", "slice_scanner.database", "slice_scanner.collector", "slice_scanner.keeper",
+        "slice_scanner.product_queue", "slice_scanner.relay", "slice_scanner.scheduler", "slice_scanner.jobs"
+    ], ["flask", "tornado"], 1.0),
+    ("clean", ["pymongo", "slice_scanner.database", "slice_scanner.cleaner"], ["flask", "tornado", "selenium"], 0.5),
+    ("worker", [
+        "pymongo", "slice_scanner.database", "slice_scanner.collector", "slice_scanner.keeper",
+        "slice_scanner.product_queue", "slice_scanner.worker", "slice_scanner.jobs"
+    ], ["flask", "tornado"], 1.0),
+]
+
+PROBE = """
+import sys, time
+start = time.time()
+import slice_scanner
+for name in %r:
+    __import__(name)
+elapsed = time.time() - start
+print elapsed, ",".join(name for name in %r if name in sys.modules)
+"""
+
+def _cold_start(modules, forbidden):
+    output = subprocess.check_output([sys.executable, "-c", PROBE % (modules, forbidden)], cwd=ROOT)
+    elapsed, loaded = (output.strip().split(" ") + [""])[:2]
+    return float(elapsed), [name for name in loaded.split(",") if name]
+
+def main():
+    failures = []
+    print "%8s %10s %10s %8s  %s" % ("role", "median ms", "max ms", "budget", "unwanted")
+    for role, modules, forbidden, budget in ROLES:
+        timings, unwanted = [], set()
+        for i in range(RUNS):
+            elapsed, loaded = _cold_start(modules, forbidden)
+            timings.append(elapsed)
+            unwanted.update(loaded)
+        timings.sort()
+        median = timings[len(timings) / 2]
+        print "%8s %10.1f %10.1f %8s  %s" % (role, median * 1000, timings[-1] * 1000, budget, ",".join(unwanted))
+        if median > budget or unwanted:
+            failures.append(role)
+
+    if failures:
+        print "Over budget or loading too much: %s" % ", ".join(failures)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,56 +1,241 @@
+"""
+Slice Scanner. Each role imports only what it needs, and importing the package has no side effects
+
+    slice web -c slice.json     # API and frontend
+    slice scrape -c slice.json  # Collector and Keeper, or the job Scheduler in distributed mode
+    slice clean -c slice.json   # Stale data Cleaner
+    slice worker -c slice.json  # Distributed scrape worker
+    slice load [dir] -c slice.json    # Replace the catalogue with a BSON dump, dump/ by default
+    slice export [dir] -c slice.json  # Dump the catalogue
+    slice -c slice.json         # Everything slice.json enables, in one process
+"""
 import argparse
-from tornado.wsgi import WSGIContainer
-from tornado.httpserver import HTTPServer
-from tornado.ioloop import IOLoop
-from Queue import Queue
+import os
+import time
 from threading import Thread
-from vendors import dominos
-from database import Database
-from collector import Collector
-from cleaner import Cleaner
-from keeper import Keeper
-from flask_pymongo import MongoClient
-from flask import Flask
-from utils import setup_logger, read_config_file
-
-# Argument parser
-arg_parser = argparse.ArgumentParser()
-arg_parser.add_argument("-c") # Config arg
-args = arg_parser.parse_args()
-
-# Config
-cfg = read_config_file(args.c)
-
-# Logging
-if cfg["logging"]["enabled"]:
-    setup_logger(cfg["logging"]["file"], cfg["logging"]["level"])
-
-# DB
-db_client = MongoClient(cfg["database"]["host"], cfg["database"]["port"])
-db_wrapper = Database(db_client[cfg["database"]["name"]])
-
-# Cleaner
-if cfg["cleaner"]["enabled"]:
-    Thread(target=Cleaner(cfg["cleaner"]["frequency"], cfg["cleaner"]["data_expiry_hours"], db_wrapper).run).start()
 
-# Scraper
-if cfg["scraper"]["enabled"]:
+ROLES = ["all", "web", "scrape", "clean", "worker", "load", "export"]
+GENERATION_POLL_SECONDS = 10 # Well inside Database.RETIRE_SECONDS, so a replaced generation is still there
+DUMP_DIR = "dump"
+
+def run(argv=None):
+    # Argument parser
+    arg_parser = argparse.ArgumentParser(prog="slice")
+    arg_parser.add_argument("role", nargs="?", default="all", choices=ROLES)
+    arg_parser.add_argument("path", nargs="?", default=DUMP_DIR) # Dump directory for load and export
+    arg_parser.add_argument("-c") # Config arg
+    arg_parser.add_argument("-w", action="store_true") # Same as the worker role
+    args = arg_parser.parse_args(argv)
+    role = "worker" if args.w else args.role
+
+    # Config
+    from utils import setup_logger, read_config_file
+    cfg = read_config_file(args.c)
+
+    # Logging
+    if cfg["logging"]["enabled"]:
+        setup_logger(cfg["logging"]["file"], cfg["logging"]["level"])
+
+    # DB
+    db_client, db_wrapper = connect(cfg)
+
+    if role == "worker":
+        return run_worker(cfg, db_client, db_wrapper)
+    if role in ["load", "export"]:
+        import dump
+        if role == "load":
+            add_snapshot_writer(cfg, db_wrapper)
+        return getattr(dump, role)(db_wrapper, args.path)
+    if role == "clean" or (role == "all" and cfg["cleaner"]["enabled"]):
+        start_cleaner(cfg, db_wrapper)
+    if role == "scrape" or (role == "all" and cfg["scraper"]["enabled"]):
+        start_scraper(cfg, db_client, db_wrapper)
+    if role == "web" or (role == "all" and cfg["web_server"]["enabled"]):
+        run_web(cfg, db_wrapper)
+
+def connect(cfg):
+    from database import Database
+    if cfg["database"].get("backend") == "memory":
+        # Throwaway in process database for tests and benchmarks, seed it from a dump
+        from mongomock import MongoClient
+        db_client = MongoClient()
+    else:
+        from pymongo import MongoClient
+        db_client = MongoClient(cfg["database"]["host"], cfg["database"]["port"])
+    db_wrapper = Database(db_client[cfg["database"]["name"]])
+
+    # Seed an empty catalogue from a dump
+    if cfg["database"].get("seed") and not db_wrapper.count("pizza"):
+        from dump import load
+        load(db_wrapper, cfg["database"]["seed"])
+    return db_client, db_wrapper
+
+#### Roles ####
+
+def run_web(cfg, db_wrapper):
+    from leaderboard import Leaderboard
+    from equivalence import EquivalenceIndex
+    from search import SearchIndex
+    from optimiser import MealOptimiser
+    from snapshot import SnapshotReader
+    from objects.pizza import Pizza
+    from web import create_app, serve
+
+    # Columnar snapshot of the live generation, mapped rather than read from Mongo
+    if cfg["database"].get("snapshot"):
+        db_wrapper.add_snapshot(SnapshotReader(db_wrapper, cfg["database"]["snapshot"]))
+
+    # Top-K
+    db_wrapper.add_leaderboard(Leaderboard(db_wrapper, "pizza", ["vendor", "style", "base_style"]))
+    db_wrapper.add_leaderboard(Leaderboard(db_wrapper, "sides", ["vendor", "type"], sort_by="price", sort_dir=1))
+
+    # Equivalence
+    db_wrapper.add_equivalence_index(EquivalenceIndex(db_wrapper, "pizza"))
+
+    # Search
+    search_index = SearchIndex(db_wrapper, ["pizza", "sides"])
+    db_wrapper.add_listener(search_index)
+
+    # Meal Optimiser
+    meal_optimiser = MealOptimiser(db_wrapper, Pizza.SLICES_PER_PERSON)
+    db_wrapper.add_listener(meal_optimiser)
+
+    # Generations committed by a scrape running in another process
+    generation_watcher = Thread(target=watch_generations, args=(db_wrapper, GENERATION_POLL_SECONDS))
+    generation_watcher.daemon = True
+    generation_watcher.start()
+
+    # Web Server
+    app = create_app(cfg, db_wrapper, meal_optimiser, search_index)
+    serve(app, cfg["web_server"]["host"], cfg["web_server"]["port"])
+
+def start_scraper(cfg, db_client, db_wrapper):
+    from multiprocessing import Process, Queue
+    from collector import Collector, VENDORS, collect_in_process
+    from keeper import Keeper
+    from product_queue import ProductQueue
+
+    add_snapshot_writer(cfg, db_wrapper)
+    frequency, web_driver, tabs = cfg["scraper"]["frequency"], cfg["scraper"]["web_driver"], cfg["scraper"].get("tabs", 1)
+    report_dir = os.path.dirname(os.path.abspath(cfg["logging"]["file"]))
+    scraper_mode = cfg["scraper"].get("mode", "thread")
+    driver_limits = _driver_limits(cfg)
+    session_dir = cfg["scraper"].get("sessions")
+    proxy = _proxy(cfg)
+    infer_prices = cfg["scraper"].get("infer_prices", False)
+    stores = cfg["scraper"].get("stores")
+    schedule = _schedule(cfg)
+
+    if scraper_mode == "distributed":
+        # Workers do the scraping and writing, we just schedule
+        from scheduler import Scheduler
+        scrape_jobs = _job_queue(cfg, db_client)
+        Thread(target=Scheduler(frequency, scrape_jobs, [vendor.id for vendor in VENDORS], db_wrapper).run).start()
+        return
+
     # Collection
-    pizza_queue = Queue()
-    Thread(target=Collector(cfg["scraper"]["frequency"], cfg["scraper"]["web_driver"], pizza_queue).run).start()
+    pizza_queue = ProductQueue(
+        cfg["scraper"].get("queue_size", 1000),
+        journal=cfg["scraper"].get("journal"),
+        backpressure=cfg["scraper"].get("backpressure_seconds", 5)
+    )
+    if scraper_mode == "thread":
+        Thread(target=Collector(
+            frequency, web_driver, pizza_queue, tabs, report_dir, None, driver_limits, session_dir, proxy, infer_prices,
+            stores, schedule
+        ).run).start()
+    else:
+        # Scrape in other processes, one per vendor for "pool", so the browser work stays off the API's GIL
+        from relay import Relay
+        ipc_queue = Queue(cfg["scraper"].get("queue_size", 1000))
+        vendor_groups = [[vendor.id] for vendor in VENDORS] if scraper_mode == "pool" else [None]
+        for vendor_ids in vendor_groups:
+            collector_process = Process(
+                target=collect_in_process,
+                args=(
+                    frequency, web_driver, ipc_queue, tabs, report_dir, vendor_ids, driver_limits, session_dir, proxy,
+                    infer_prices, stores, schedule
+                )
+            )
+            collector_process.daemon = True
+            collector_process.start()
+        Thread(target=Relay(ipc_queue, pizza_queue).run).start()
 
     # Persistence
-    Thread(target=Keeper(db_wrapper, pizza_queue).run).start()
+    Thread(target=Keeper(db_wrapper, pizza_queue, _refinery(cfg)).run).start()
+
+def start_cleaner(cfg, db_wrapper):
+    from cleaner import Cleaner
+    Thread(target=Cleaner(cfg["cleaner"]["frequency"], cfg["cleaner"]["data_expiry_hours"], db_wrapper).run).start()
+
+def run_worker(cfg, db_client, db_wrapper):
+    from collector import Collector
+    from keeper import Keeper
+    from product_queue import ProductQueue
+    from worker import Worker
+
+    scrape_jobs = _job_queue(cfg, db_client)
+    worker_queue = ProductQueue(cfg["scraper"].get("queue_size", 1000)) # No journal, unfinished jobs get retried
+    worker_collector = Collector(
+        cfg["scraper"]["frequency"], cfg["scraper"]["web_driver"], worker_queue,
+        driver_limits=_driver_limits(cfg), session_dir=cfg["scraper"].get("sessions"), proxy=_proxy(cfg),
+        infer_prices=cfg["scraper"].get("infer_prices", False), stores=cfg["scraper"].get("stores")
+    )
+    worker_collector.supervisor.reap_orphans()
+    Thread(target=Keeper(db_wrapper, worker_queue, _refinery(cfg)).run).start()
+    Worker(scrape_jobs, lambda job: worker_collector.run_job(scrape_jobs, job)).run()
+
+#### Internal ####
+
+def add_snapshot_writer(cfg, db_wrapper):
+    # Whoever commits generations writes the snapshot for the web role
+    if cfg["database"].get("snapshot"):
+        from snapshot import SnapshotWriter
+        from utils import wrapped_execute
+        snapshot_writer = SnapshotWriter(db_wrapper, cfg["database"]["snapshot"])
+        db_wrapper.add_listener(snapshot_writer, first=True) # Written before any reader goes looking for it
+        wrapped_execute(snapshot_writer.on_reset, snapshot_writer.collection_name) # Of whatever's live now
+
+def _driver_limits(cfg):
+    # When the supervisor recycles a browser
+    return {
+        "max_pages": cfg["scraper"].get("driver_max_pages", 200),
+        "max_rss_mb": cfg["scraper"].get("driver_max_rss_mb", 1024)
+    }
+
+def _proxy(cfg):
+    # Settings for the Collector's scrape proxy, None to let browsers go direct
+    proxy = cfg["scraper"].get("proxy", {})
+    if not proxy.get("enabled"):
+        return None
+    return {
+        "cache_dir": proxy.get("cache_dir"),
+        "block_types": proxy.get("block_types", []),
+        "block_domains": proxy.get("block_domains", [])
+    }
+
+def _schedule(cfg):
+    # Per vendor adaptive scheduling instead of the cron, if enabled
+    schedule = cfg["scraper"].get("schedule", {})
+    if not schedule.get("enabled"):
+        return None
+    return {
+        "min_seconds": schedule.get("min_interval_minutes", 30) * 60,
+        "max_seconds": schedule.get("max_interval_minutes", 24 * 60) * 60,
+        "jitter": schedule.get("jitter", 0.1),
+        "max_concurrent": schedule.get("max_concurrent", 1)
+    }
 
-# Web Server
-if cfg["web_server"]["enabled"]:
-    # Create App
-    app = Flask(__name__, static_url_path='')
+def _refinery(cfg):
+    from refinery import Refinery
+    return Refinery(cfg["scraper"].get("refine_workers", 0))
 
-    # Create Views
-    from slice_scanner import views
+def _job_queue(cfg, db_client):
+    from jobs import JobQueue
+    return JobQueue(db_client[cfg["database"]["name"]].jobs)
 
-    # Run with Tornado
-    http_server = HTTPServer(WSGIContainer(app))
-    http_server.listen(cfg["web_server"]["port"], address=cfg["web_server"]["host"])
-    IOLoop.instance().start()
+def watch_generations(db_wrapper, seconds):
+    from utils import wrapped_execute
+    while True:
+        time.sleep(seconds)
+        wrapped_execute(db_wrapper.check_generation)
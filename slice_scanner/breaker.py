@@ -0,0 +1,53 @@
+import logging
+from time import time
+
+from metrics import registry
+
+UNIT_FAILURE_BUDGET = 0.5 # Share of a vendor's work units that can fail before the vendor counts as broken
+
+def over_budget(failed, total):
+    return failed > total * UNIT_FAILURE_BUDGET
+
+class CircuitBreaker(object):
+    """
+    Stops scraping a vendor after it fails FAILURE_THRESHOLD times in a row, then lets a single probe scrape through
+    after a backoff that doubles with every failed probe
+    """
+    FAILURE_THRESHOLD = 2
+    BACKOFF_SECONDS = 60 * 60
+    MAX_BACKOFF_SECONDS = 24 * 60 * 60
+
+    def __init__(self, name):
+        self.name = name
+        self.failures = 0 # In a row
+        self.backoff = self.BACKOFF_SECONDS
+        self.open_until = None
+        self._record()
+
+    @property
+    def state(self):
+        if self.open_until is None:
+            return "closed"
+        return "open" if time() < self.open_until else "half_open"
+
+    def allow(self):
+        # Closed, or open long enough to try again
+        return self.state != "open"
+
+    def success(self):
+        if self.open_until is not None:
+            logging.info("Circuit for %s closed", self.name)
+        self.failures, self.backoff, self.open_until = 0, self.BACKOFF_SECONDS, None
+        self._record()
+
+    def failure(self):
+        self.failures += 1
+        if self.failures >= self.FAILURE_THRESHOLD:
+            logging.warning("Circuit for %s open, next probe in %ss", self.name, self.backoff)
+            self.open_until = time() + self.backoff
+            self.backoff = min(self.backoff * 2, self.MAX_BACKOFF_SECONDS)
+        self._record()
+
+    def _record(self):
+        registry.set("scrape_breaker_open", int(self.open_until is not None), vendor=self.name)
+        registry.set("scrape_breaker_failures", self.failures, vendor=self.name)
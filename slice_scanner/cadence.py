@@ -0,0 +1,58 @@
+import logging
+from hashlib import md5
+from random import uniform
+from time import time
+
+from metrics import registry
+
+IDENTITY_IGNORED = ["price", "img", "menu"] # Fields that don't make a product a different product
+
+def identity(fields):
+    # Stable hash of a raw product, everything but its price
+    return md5(repr(sorted(
+        (key, value) for key, value in fields.iteritems() if key not in IDENTITY_IGNORED
+    ))).hexdigest()
+
+def change_rate(before, after):
+    # Share of products added, removed or repriced between two scrapes of a vendor, each {identity: price}
+    keys = set(before) | set(after)
+    if not keys:
+        return 0.0
+    return float(sum(1 for key in keys if before.get(key) != after.get(key))) / len(keys)
+
+class Cadence(object):
+    """
+    How often a vendor is scraped. The interval halves when a scrape finds more than CHANGE_THRESHOLD of its products
+    changed and grows by GROWTH when it doesn't, within [min_seconds, max_seconds]. Each scrape is due after the
+    interval, give or take jitter, so vendors drift apart rather than all landing at once
+    """
+    CHANGE_THRESHOLD = 0.01
+    GROWTH = 1.5
+
+    def __init__(self, vendor_id, min_seconds, max_seconds, jitter=0.1):
+        self.vendor_id = vendor_id
+        self.min_seconds = min_seconds
+        self.max_seconds = max_seconds
+        self.jitter = jitter
+        self.interval = min_seconds # Until we know better
+        self.due = time() # First scrape straight away
+        self.retry_at = None # Re-scrape of failed units, if there are any
+
+    def next_due(self):
+        return min(self.due, self.retry_at or self.due)
+
+    def observe(self, rate):
+        if rate > self.CHANGE_THRESHOLD:
+            self.interval = max(self.min_seconds, self.interval / 2)
+        else:
+            self.interval = min(self.max_seconds, self.interval * self.GROWTH)
+        logging.info("%.0f%% of %s changed, next scrape in %.0fs", rate * 100, self.vendor_id, self.interval)
+
+    def scraped(self, full, retries_pending, retry_seconds):
+        # Schedule the next full scrape after a full one, and a retry ahead of it if some units failed. A retry of just
+        # the failed units leaves the full scrape when it was due
+        now = time()
+        if full:
+            self.due = now + self.interval * uniform(1 - self.jitter, 1 + self.jitter)
+        self.retry_at = now + retry_seconds if retries_pending and now + retry_seconds < self.due else None
+        registry.set("scrape_interval_seconds", self.interval, vendor=self.vendor_id)
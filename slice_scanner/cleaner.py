@@ -17,5 +17,6 @@ class Cleaner(object):
 
     def _remove_stale_data(self):
         stale_data_cutoff = time.time() - (self.data_validity * 60 * 60)
+        self.db.check_generation() # The scrape role commits new generations, remove from whichever is live now
         self.db.remove("pizza", {"stamp": {"$lt": stale_data_cutoff}})
         self.db.remove("sides", {"stamp": {"$lt": stale_data_cutoff}})
@@ -0,0 +1,77 @@
+import json
+import sys
+from functools import wraps
+from threading import Event, Lock
+
+from metrics import registry
+
+class Flight(object):
+    # One execution, and everyone waiting on it
+
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight(object):
+    """
+    Concurrent calls with the same key share one execution and its result, e.g. the burst of identical requests
+    that follows a new generation going live. A follower waits at most the key's timeout, then runs it itself
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.flights = {} # Key -> Flight in progress
+
+    def do(self, key, timeout, func, *args, **kwargs):
+        name = key[0]
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+        if leader:
+            try:
+                flight.result = func(*args, **kwargs)
+            except Exception:
+                flight.error = sys.exc_info()
+            finally:
+                with self.lock:
+                    del self.flights[key]
+                flight.done.set()
+            registry.inc("db_flights_total", method=name)
+        else:
+            registry.inc("db_coalesced_total", method=name)
+            if not flight.done.wait(timeout):
+                registry.inc("db_coalesce_timeouts_total", method=name)
+                return func(*args, **kwargs) # Don't hold this request hostage to a slow leader
+        if flight.error:
+            raise flight.error[0], flight.error[1], flight.error[2]
+        return flight.result
+
+def normalise(value):
+    # Arguments that mean the same thing key the same: JSON in any spacing or order, unset and None
+    if type(value) in [str, unicode]:
+        try:
+            return json.dumps(json.loads(value), sort_keys=True)
+        except ValueError:
+            return value
+    if type(value) in [list, tuple]:
+        return tuple(normalise(item) for item in value)
+    if type(value) is dict:
+        return tuple(sorted((key, normalise(item)) for key, item in value.iteritems()))
+    return value
+
+def coalesced(timeout):
+    """
+    Share concurrent identical calls of a Database method, keyed on its normalised arguments
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            key = (method.__name__, normalise(args), normalise(dict(
+                (name, value) for name, value in kwargs.iteritems() if value is not None
+            )))
+            return self.flights.do(key, timeout, method, self, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -1,34 +1,269 @@
+import atexit
 import logging
+import os
 from crontab import CronTab
 import time
+from Queue import Queue, Empty
+from threading import Thread, Lock
 from vendors import dominos, pizza_hut, papa_johns, fourstar
 from selenium import webdriver
+from utils import wrapped_execute, write_json_report
+from keeper import Generation, PHASE_COLLECTIONS
+from metrics import registry, diff
+from breaker import CircuitBreaker, UNIT_FAILURE_BUDGET, over_budget
+from supervisor import DriverSupervisor
+from sessions import SessionStore
+from proxy import ScrapeProxy
+from cadence import Cadence, change_rate
+
+VENDORS = [
+    fourstar.FourStar,
+    dominos.Dominos,
+    papa_johns.PapaJohns,
+    pizza_hut.PizzaHut,
+]
+
+def collect_in_process(frequency, web_driver, queue, tabs, report_dir, vendor_ids, driver_limits, session_dir, proxy,
+                       infer_prices, stores, schedule):
+    # Entry point for a Collector running in its own process, products go back over an IPC queue
+    Collector(
+        frequency, web_driver, queue, tabs, report_dir, vendor_ids, driver_limits, session_dir, proxy, infer_prices,
+        stores, schedule
+    ).run()
 
 class Collector(object):
+    UNIT_RETRIES = 2 # Re-scrapes of a failed work unit before we leave it to the next cycle
+    RETRY_SECONDS = 10 * 60 # Between re-scrapes of failed units
+    TICK_SECONDS = 5 # Between looks for vendors that are due, on an adaptive schedule
 
-    def __init__(self, frequency, web_driver, queue):
+    def __init__(self, frequency, web_driver, queue, tabs=1, report_dir=None, vendor_ids=None, driver_limits=None,
+                 session_dir=None, proxy=None, infer_prices=False, stores=None, schedule=None):
         self.cron = CronTab(frequency)
         self.web_driver = web_driver
+        self.queue = queue
+        self.tabs = tabs # Browsers to spread each vendor's work units over
+        self.report_dir = report_dir # Where to save per run JSON reports
+        self.report_prefix = "scrape" if vendor_ids is None else "scrape-%s" % os.getpid()
+        self.sessions = SessionStore(session_dir) if session_dir else None # Saved logins, shared by every browser
         self.vendors = [
-            fourstar.FourStar(queue),
-            dominos.Dominos(queue),
-            papa_johns.PapaJohns(queue),
-            pizza_hut.PizzaHut(queue),
+            vendor(queue, self.sessions, infer_prices, (stores or {}).get(vendor.id)) # Stores to scrape, by vendor
+            for vendor in VENDORS if vendor_ids is None or vendor.id in vendor_ids
         ]
+        self.breakers = dict((vendor.id, CircuitBreaker(vendor.id)) for vendor in self.vendors)
+        self.last_seen = {} # Vendor -> {identity: price} from its last full scrape
+        schedule = dict(schedule or {})
+        self.max_concurrent = schedule.pop("max_concurrent", 1) # Vendors scraped at once, on an adaptive schedule
+        self.cadences = dict( # Vendor -> Cadence, or empty to scrape every vendor on the cron
+            (vendor.id, Cadence(vendor.id, **schedule)) for vendor in self.vendors
+        ) if schedule else {}
+        self.retries = {} # Vendor -> (phase, unit, attempts) of failed work units, to re-scrape before the next cycle
+        self.job_driver = None # Browser for distributed jobs, and the vendor it's logged in to
+        self.job_vendor = None
+        self.proxy = ScrapeProxy(**proxy).start() if proxy else None # Browser traffic goes through it, if set
+        if self.proxy and self.max_concurrent > 1:
+            logging.warning("Scraping one vendor at a time, the proxy can't tell concurrent vendors' traffic apart")
+            self.max_concurrent = 1
+        self.supervisor = DriverSupervisor(self._start_webdriver, **(driver_limits or {})) # Owns every browser
+        self.idle = [] # Browsers kept warm between cycles, still logged in to whatever they scraped last
+        self.idle_lock = Lock()
+        atexit.register(self.supervisor.shutdown)
 
     def _start_webdriver(self):
         if "chrome" in self.web_driver.lower():
-            return webdriver.Chrome(self.web_driver, service_args=['--ignore-ssl-errors=true'])
+            options = webdriver.ChromeOptions()
+            if self.proxy:
+                options.add_argument("--proxy-server=http://%s" % self.proxy.address)
+            return webdriver.Chrome(self.web_driver, service_args=['--ignore-ssl-errors=true'], options=options)
         if "fire" in self.web_driver.lower():
-            return webdriver.Firefox()
-        return webdriver.PhantomJS(self.web_driver)
+            profile = webdriver.FirefoxProfile()
+            if self.proxy:
+                host, port = self.proxy.address.split(":")
+                profile.set_preference("network.proxy.type", 1)
+                for scheme in ["http", "ssl"]:
+                    profile.set_preference("network.proxy.%s" % scheme, host)
+                    profile.set_preference("network.proxy.%s_port" % scheme, int(port))
+            return webdriver.Firefox(firefox_profile=profile)
+        service_args = ["--proxy=%s" % self.proxy.address] if self.proxy else None
+        return webdriver.PhantomJS(self.web_driver, service_args=service_args)
+
+    def _collect(self, retries=None, vendor_ids=None):
+        # One scrape generation, of every vendor (or those in vendor_ids) or just the units in retries. Vendors scraped
+        # side by side each send their own markers, and the Keeper makes one generation of them. On an adaptive
+        # schedule other vendors are scraping on this registry too, so the report only has this one's metrics
+        labels = {"vendor": vendor_ids[0]} if self.cadences and vendor_ids else {}
+        started, before = time.time(), registry.snapshot("scrape_", **labels)
+        generation, incomplete, web_driver = int(started * 1000), [], None
+        source = os.getpid() if vendor_ids is None else "%s-%s" % (os.getpid(), ",".join(vendor_ids))
+        self.queue.put(Generation(generation, "begin", source))
+        try:
+            web_driver = self._take_browser()
+            for session in self.vendors:
+                if retries is not None and session.id not in retries:
+                    continue
+                if vendor_ids is not None and session.id not in vendor_ids:
+                    continue
+                if not self.breakers[session.id].allow():
+                    logging.warning("Skipping %s, its circuit is open", session.id)
+                    registry.inc("scrape_vendor_skipped_total", vendor=session.id)
+                    continue
+                session.set_driver(web_driver)
+                self._label_traffic(session.id)
+                with registry.timer("scrape_vendor_seconds", vendor=session.id):
+                    incomplete += self._scrape_vendor(session, retries.get(session.id) if retries else None)
+        finally:
+            if web_driver:
+                self._park_browser(web_driver)
+            # Vendors we missed are carried over, as are the products of incomplete ones we didn't get this time
+            self.queue.put(Generation(generation, "commit", source, incomplete))
+        self._report(started, before, labels)
+
+    def _report(self, started, before, labels):
+        if self.report_dir:
+            path = write_json_report(self.report_dir, self.report_prefix, {
+                "started": started,
+                "seconds": time.time() - started,
+                "breakers": dict((vendor_id, breaker.state) for vendor_id, breaker in self.breakers.iteritems()),
+                "retries": dict((vendor_id, len(units)) for vendor_id, units in self.retries.iteritems()),
+                "metrics": diff(before, registry.snapshot("scrape_", **labels))
+            })
+            logging.info("Scrape report saved to %s" % path)
+
+    def _scrape_vendor(self, session, retries=None):
+        # Scrape a vendor, or retry some of its units, recording the outcome on its breaker and queueing failed units
+        # for a re-scrape. Returns the (vendor, collection) pairs this generation only has part of
+        breaker = self.breakers[session.id]
+        units = [(phase, unit) for phase, unit, attempts in retries] if retries else None
+        if units is None:
+            session.observed.clear() # Filled in by this scrape
+        try:
+            failed, total = self._scrape(session, units)
+        except Exception:
+            logging.error("Scrape failed for %s", session.id, exc_info=True) # Couldn't log in, all carried over
+            breaker.failure()
+            return []
 
-    def _collect(self):
-        web_driver = self._start_webdriver()
-        for session in self.vendors:
+        if over_budget(len(failed), total):
+            logging.warning("%s of %s units failed for %s", len(failed), total, session.id)
+            breaker.failure() # Broken rather than flaky, leave it to the breaker
+        else:
+            breaker.success()
+            if units is None and not failed:
+                self._observe(session)
+            attempts = dict(((phase, repr(unit)), attempt) for phase, unit, attempt in retries or [])
+            for phase, unit in failed:
+                attempt = attempts.get((phase, repr(unit)), 0) + 1
+                if attempt <= self.UNIT_RETRIES:
+                    self.retries.setdefault(session.id, []).append((phase, unit, attempt))
+        return sorted(set((session.id, PHASE_COLLECTIONS[phase]) for phase, unit in failed + (units or [])))
+
+    def _observe(self, session):
+        # How much of the vendor changed since its last full scrape, which sets its cadence
+        observed = dict(session.observed)
+        before, self.last_seen[session.id] = self.last_seen.get(session.id), observed
+        if before is None:
+            return
+        rate = change_rate(before, observed)
+        registry.set("scrape_change_rate", rate, vendor=session.id)
+        if session.id in self.cadences:
+            self.cadences[session.id].observe(rate)
+
+    def _scrape(self, session, units=None):
+        # Spread the vendor's work units over this session plus up to (tabs - 1) freshly logged in ones. Returns the
+        # units that failed, and how many there were
+        work, failed = Queue(), []
+        session.login()
+        units = units or session.work_units()
+        for unit in units:
+            work.put(unit)
+        budget = len(units) * UNIT_FAILURE_BUDGET
+
+        workers = [Thread(target=self._work, args=(session, work, failed, budget))]
+        for i in range(min(self.tabs, work.qsize()) - 1):
+            workers.append(Thread(target=self._work_in_tab, args=(session.spawn(), work, failed, budget)))
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return failed, len(units)
+
+    def _work_in_tab(self, session, units, failed, budget):
+        web_driver = self._take_browser()
+        try:
             session.set_driver(web_driver)
-            session.parse()
-        web_driver.quit()
+            session.login()
+            self._work(session, units, failed, budget)
+        except Exception:
+            logging.error("Tab failed for %s" % session.id, exc_info=True)
+            self.supervisor.release(web_driver) # Could be what broke
+        else:
+            self._park_browser(web_driver)
+
+    def _label_traffic(self, vendor_id):
+        # Vendors are scraped one at a time per Collector while there's a proxy (see max_concurrent), so the proxy's
+        # traffic is all theirs
+        if self.proxy:
+            self.proxy.vendor = vendor_id
+
+    def _take_browser(self):
+        with self.idle_lock:
+            if self.idle:
+                return self.idle.pop()
+        return self.supervisor.start()
+
+    def _park_browser(self, web_driver):
+        # Keep it for the next cycle rather than paying for a new browser and logins
+        with self.idle_lock:
+            if len(self.idle) < self.tabs:
+                self.idle.append(web_driver)
+                return
+        self.supervisor.release(web_driver)
+
+    def _work(self, session, units, failed, budget):
+        # A unit fails if it raises or finds nothing, e.g. a selector that no longer matches
+        while True:
+            try:
+                phase, unit = units.get_nowait()
+            except Empty:
+                return
+            if len(failed) > budget:
+                failed.append((phase, unit)) # Vendor's broken, don't burn time waiting on the rest
+                continue
+            if self.supervisor.recycle_if_due(session.web_driver):
+                session.login() # Fresh browser
+            if not wrapped_execute(session.scrape_unit, phase, unit):
+                registry.inc("scrape_unit_failures_total", vendor=session.id, phase=phase)
+                failed.append((phase, unit))
+
+    def run_job(self, jobs, job):
+        # Distributed scraping. Vendor jobs list their work units as new jobs, unit jobs scrape the unit
+        session = self._job_session(job["vendor"])
+        try:
+            if job["phase"] is None:
+                for phase, unit in session.work_units():
+                    jobs.enqueue(job["vendor"], phase, unit, cycle=job["cycle"])
+            else:
+                self.queue.put(Generation(job["cycle"], "stage")) # Begun and committed by the Scheduler
+                if not session.scrape_unit(job["phase"], job["unit"]):
+                    raise ValueError("No products from %s %s" % (job["vendor"], job["unit"]))
+                self.queue.join() # Written before the job counts as done, or the cycle could go live without them
+        except Exception:
+            self.job_vendor = None # Start the next job from a fresh login
+            raise
+
+    def _job_session(self, vendor_id):
+        # Vendor session on this worker's browser, logging in again whenever we switch vendor
+        session = [vendor for vendor in self.vendors if vendor.id == vendor_id][0]
+        self._label_traffic(vendor_id)
+        if self.job_driver is None:
+            self.job_driver = self.supervisor.start()
+        elif self.supervisor.recycle_if_due(self.job_driver):
+            self.job_vendor = None # Fresh browser
+        if self.job_vendor != vendor_id:
+            self.job_vendor = None
+            session.set_driver(self.job_driver)
+            session.login()
+            self.job_vendor = vendor_id
+        return session
 
     def vendor_info(self):
         vendor_info = {}
@@ -39,6 +274,50 @@ class Collector(object):
 
     def run(self):
         logging.info("Collector Running")
+        self.supervisor.reap_orphans() # Left by a previous run that didn't shut down cleanly
+        if self.cadences:
+            self._run_adaptive()
         while True:
+            self.retries = {} # A full scrape covers them
             self._collect()
-            time.sleep(self.cron.next())
+            next_cycle = time.time() + self.cron.next()
+            while self.retries and time.time() + self.RETRY_SECONDS < next_cycle:
+                time.sleep(self.RETRY_SECONDS)
+                retries, self.retries = self.retries, {}
+                self._collect(retries)
+            time.sleep(max(0, next_cycle - time.time()))
+
+    def _run_adaptive(self):
+        # Each vendor on its own cadence, up to max_concurrent of them at once. Vendors scraped at once join the
+        # Keeper's open generation, which only goes live when the last of them is done. So they're started in waves,
+        # the next once the last has finished, or vendors overlapping one after another would keep it from ever
+        # going live
+        running = {} # Vendor -> scraping thread
+        while True:
+            for vendor_id, thread in running.items():
+                if not thread.is_alive():
+                    del running[vendor_id]
+            now = time.time()
+            due = sorted(
+                (cadence.next_due(), vendor_id) for vendor_id, cadence in self.cadences.iteritems()
+                if cadence.next_due() <= now
+            )
+            for due_at, vendor_id in (due[:self.max_concurrent] if not running else []):
+                running[vendor_id] = Thread(target=self._scrape_due, args=(vendor_id,))
+                running[vendor_id].start()
+            registry.set("scrape_vendors_running", len(running))
+            time.sleep(self.TICK_SECONDS)
+
+    def _scrape_due(self, vendor_id):
+        # A full scrape once the vendor's due, or just its failed units if they're due first
+        cadence, retries = self.cadences[vendor_id], self.retries.pop(vendor_id, None)
+        full = cadence.due <= time.time() or not retries
+        try:
+            if full:
+                self._collect(vendor_ids=[vendor_id]) # Covers any failed units too
+            else:
+                self._collect(retries={vendor_id: retries}, vendor_ids=[vendor_id])
+        except Exception:
+            logging.error("Scrape of %s failed", vendor_id, exc_info=True)
+        finally:
+            cadence.scraped(full, bool(self.retries.get(vendor_id)), self.RETRY_SECONDS)
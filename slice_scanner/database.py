@@ -1,91 +1,316 @@
 import json
 import logging
+import re
+from time import time
 
-from utils import strip_dict
+from utils import BadArgument, strip_dict, wrapped_execute
+from scoring import profiles, profile_field, parse_weights, rank, score_columns
+from metrics import request_timings
+from coalesce import SingleFlight, coalesced
+from objects.pizza import Pizza
 
 class Database():
     """
     Wrapper for the database layer
     """
     PAGE_SIZE = 12
+    GENERATIONS = ["pizza", "sides"] # Collections written a scrape generation at a time
+    RETIRE_SECONDS = 300 # Replaced generations are kept this long, for processes that haven't seen the switch yet
+    INDEXES = {
+        "pizza": ["price", "score", "hash", "group", "stores"] + [profile_field(profile) for profile in profiles],
+        "sides": ["price", "score", "hash", "stores"],
+    }
 
     def __init__(self, db):
         self.db = db
+        self.listeners = [] # Told about every write, e.g. in memory indexes
+        self.leaderboards = {} # Collection name -> Leaderboard
+        self.equivalence = {} # Collection name -> EquivalenceIndex
+        self.snapshots = {} # Collection name -> SnapshotReader
+        self.live = {} # Collection name -> collection holding its live generation
+        self.staging = {} # Collection name -> collection the scrape in progress writes to
+        self.generation = None # Generation being written, if any
+        self.flights = SingleFlight() # Identical reads in progress, shared by whoever asks for them meanwhile
+        self._load_generation()
         self.create_indexes()
 
+    def add_listener(self, listener, first=False):
+        if first:
+            self.listeners.insert(0, listener)
+        else:
+            self.listeners.append(listener)
+
+    def add_leaderboard(self, leaderboard):
+        self.leaderboards[leaderboard.collection_name] = leaderboard
+        self.add_listener(leaderboard)
+
+    def add_equivalence_index(self, index):
+        self.equivalence[index.collection_name] = index
+        self.add_listener(index)
+
+    def add_snapshot(self, reader):
+        self.snapshots[reader.collection_name] = reader
+        self.add_listener(reader)
+
     def create_indexes(self):
-        self.db.sides.create_index("price")
-        self.db.sides.create_index("score")
-        self.db.sides.create_index("hash")
-        self.db.pizza.create_index("price")
-        self.db.pizza.create_index("score")
-        self.db.pizza.create_index("hash")
+        for collection_name in self.INDEXES:
+            self._create_indexes(collection_name, self._get_collection(collection_name))
 
     def reset_database(self):
-        self.db.pizza.drop()
+        self._get_collection("pizza").drop()
         self.db.meals.drop()
         self.db.desserts.drop()
-        self.db.sides.drop()
+        self._get_collection("sides").drop()
 
-    def insert_product(self, collection, product):
+    def insert_product(self, collection_name, product):
         json_product = product.to_dict()
         if json_product:
             print product
+            staging = self.staging.get(collection_name)
+            collection = self.db[staging] if staging else self._get_collection(collection_name)
             collection.remove({"hash": json_product["hash"]})
-            collection.insert(json_product)
+            collection.insert(dict(json_product))
+            if not staging:
+                self._notify("on_insert", collection_name, json_product) # Staged products are seen when they go live
+
+    def insert_many(self, collection_name, documents):
+        # Bulk write of already serialised products, e.g. from a dump
+        staging = self.staging.get(collection_name)
+        collection = self.db[staging] if staging else self._get_collection(collection_name)
+        collection.insert_many(documents, ordered=False)
+        if not staging:
+            for document in documents:
+                self._notify("on_insert", collection_name, document)
 
     def insert_pizza(self, pizza):
-        self.insert_product(self.db.pizza, pizza)
+        self.insert_product("pizza", pizza)
 
     def insert_side(self, side):
-        self.insert_product(self.db.sides, side)
+        self.insert_product("sides", side)
+
+    #### Generations ####
+
+    def begin_generation(self, generation, indexed=True):
+        # Start writing a scrape into fresh staging collections, readers keep seeing the live ones until commit
+        for collection_name in self.GENERATIONS:
+            staging = self._generation_name(collection_name, generation)
+            if staging == self.live_collection(collection_name):
+                raise ValueError("Generation %s is already live" % generation)
+            self.db.drop_collection(staging) # Left over from an interrupted run
+            if indexed: # Bulk loads don't look products up as they go, so they leave indexing to the commit
+                self.db[staging].create_index("hash")
+        self.stage_generation(generation)
+        logging.info("Generation %s started", generation)
+
+    def stage_generation(self, generation):
+        # Write into a generation begun elsewhere, e.g. by the Scheduler for distributed workers
+        self.staging = dict(
+            (collection_name, self._generation_name(collection_name, generation)) for collection_name in self.GENERATIONS
+        )
+        self.generation = generation
+
+    def commit_generation(self, generation, carry_over=True, incomplete=()):
+        # Index the staged collections and switch readers over to them in one write. The generation it replaces is
+        # retired, and dropped RETIRE_SECONDS later. incomplete lists (vendor, collection) pairs only partly scraped,
+        # e.g. some units failed
+        staged = {}
+        for collection_name in self.GENERATIONS:
+            staged[collection_name] = self._generation_name(collection_name, generation)
+            if carry_over:
+                partial = [vendor for vendor, name in incomplete if name == collection_name]
+                self._carry_over(collection_name, self.db[staged[collection_name]], partial)
+            self._backfill(collection_name, self.db[staged[collection_name]])
+            self._create_indexes(collection_name, self.db[staged[collection_name]])
+        retired = self._retire(staged)
+        self.db.generations.replace_one(
+            {"_id": "live"},
+            {"_id": "live", "generation": generation, "collections": staged, "retired": retired},
+            upsert=True
+        )
+        self.live = staged
+        if self.generation == generation:
+            self.staging, self.generation = {}, None
+        logging.info("Generation %s is live", generation)
+
+        for collection_name in self.GENERATIONS:
+            self._notify("on_reset", collection_name)
+        self._drop_old_generations(retired)
+
+    def check_generation(self):
+        # Pick up a generation committed by another process, e.g. a separate scrape role
+        live = self.live
+        self._load_generation()
+        if self.live != live:
+            logging.info("Generation %s picked up", self.live)
+            for collection_name in self.GENERATIONS:
+                self._notify("on_reset", collection_name)
+
+    def _carry_over(self, collection_name, staging, partial=()):
+        # Vendors missing from the new generation (not scraped this time, or failed) keep their live products, and
+        # partly scraped ones keep the live products they didn't get this time
+        complete = [vendor for vendor in staging.distinct("vendor") if vendor not in partial]
+        documents = self._get_collection(collection_name).find({"vendor": {"$nin": complete}})
+        if partial:
+            staged = set(staging.distinct("hash"))
+            documents = [document for document in documents if document["hash"] not in staged]
+        documents = list(documents)
+        if documents:
+            logging.info("Carrying %s %s over from the live generation", len(documents), collection_name)
+            staging.insert_many(documents)
+
+    def _retire(self, staged):
+        # Collection name -> when it stopped being live, for those still within RETIRE_SECONDS
+        pointer = self.db.generations.find_one({"_id": "live"}) or {}
+        now, replaced = time(), pointer.get("collections") or dict((name, name) for name in self.GENERATIONS)
+        retired = dict(
+            (name, at) for name, at in pointer.get("retired", {}).iteritems() if now - at < self.RETIRE_SECONDS
+        )
+        for name in replaced.itervalues():
+            if name not in staged.values():
+                retired.setdefault(name, now)
+        return retired
+
+    def _backfill(self, collection_name, collection):
+        # Derive fields that products written before them lack, e.g. carried over from an older generation
+        if collection_name != "pizza":
+            return
+        for document in collection.find({"group": {"$exists": False}}):
+            if all(key in document for key in ["toppings", "diameter", "base_style"]):
+                collection.update_one({"_id": document["_id"]}, {"$set": {"group": Pizza.equivalence_group(
+                    document["toppings"], document["diameter"], document["base_style"]
+                )}})
+
+    def _drop_old_generations(self, retired):
+        pattern = re.compile(r"^(%s)(_\d+)?$" % "|".join(self.GENERATIONS))
+        keep = set(self.live.values()) | set(self.staging.values()) | set(retired)
+        for name in self.db.collection_names():
+            if pattern.match(name) and name not in keep:
+                self.db.drop_collection(name)
+
+    def live_collection(self, collection_name):
+        return self.live.get(collection_name, collection_name)
+
+    def _load_generation(self):
+        pointer = self.db.generations.find_one({"_id": "live"})
+        self.live = pointer["collections"] if pointer else {}
+
+    @staticmethod
+    def _generation_name(collection_name, generation):
+        return "%s_%s" % (collection_name, generation)
 
+    @coalesced(timeout=5)
     def get_sides(self, **kwargs):
         return self.query(
             "sides",
-            {
-                "type": self._in(kwargs.get("type")),
-                "vendor": self._in(kwargs.get("vendor")),
-                "price": self._in_range(kwargs.get("price")),
-            },
+            self._sides_filter(**kwargs),
             sort_by=kwargs.get("sort_by"),
             sort_dir=kwargs.get("sort_dir"),
             page=kwargs.get("page")
         )
 
+    def _sides_filter(self, **kwargs):
+        return {
+            "type": self._in(kwargs.get("type")),
+            "vendor": self._in(kwargs.get("vendor")),
+            "stores": self._in(kwargs.get("store")),
+            "price": self._in_range(kwargs.get("price")),
+        }
+
+    @coalesced(timeout=5)
     def get_pizza(self, **kwargs):
+        sort_by, sort_dir = kwargs.get("sort_by"), kwargs.get("sort_dir")
+        score_profile = kwargs.get("score_profile")
+        if score_profile in profiles:
+            # Named profiles are precomputed and indexed, so Mongo can sort on them directly
+            sort_by = profile_field(score_profile)
+            sort_dir = -1 if sort_dir is None else sort_dir
+        elif score_profile:
+            # Custom weights are scored in memory over the filtered pizzas
+            try:
+                weights = parse_weights(json.loads(score_profile))
+            except ValueError as e:
+                raise BadArgument("score_profile is neither a profile (%s) nor valid weights: %s" % (
+                    ", ".join(sorted(profiles)), e
+                ))
+            return self.query_ranked(
+                "pizza",
+                self._pizza_filter(**kwargs),
+                weights,
+                sort_dir=sort_dir,
+                page=kwargs.get("page")
+            )
+        if kwargs.get("collapse") in ["1", "true", True]:
+            # One representative per equivalence group, with its variants attached
+            return self.query_collapsed(
+                "pizza",
+                self._pizza_filter(**kwargs),
+                sort_by=sort_by or "score",
+                sort_dir=-1 if sort_dir is None else sort_dir,
+                page=kwargs.get("page")
+            )
         return self.query(
             "pizza",
-            {
+            self._pizza_filter(**kwargs),
+            sort_by=sort_by,
+            sort_dir=sort_dir,
+            page=kwargs.get("page")
+        )
+
+    def _pizza_filter(self, **kwargs):
+        return {
                 "toppings": self._all(kwargs.get("toppings")),
                 "style": self._in(kwargs.get("style")),
                 "base_style": self._in(kwargs.get("base_style")),
                 "vendor": self._in(kwargs.get("vendor")),
+                "stores": self._in(kwargs.get("store")),
                 "diameter": self._in_range(kwargs.get("diameter")),
                 "slices": self._in_range(kwargs.get("slices")),
                 "price": self._in_range(kwargs.get("price")),
                 "score": self._in_range(kwargs.get("score"))
-            },
-            sort_by=kwargs.get("sort_by"),
-            sort_dir=kwargs.get("sort_dir"),
-            page=kwargs.get("page")
-        )
+            }
+
+    @coalesced(timeout=5)
+    def get_hits(self, collection_name, hashes, **kwargs):
+        # Search hits, in rank order, with the usual filters applied afterwards
+        query = self._pizza_filter(**kwargs) if collection_name == "pizza" else self._sides_filter(**kwargs)
+        query["hash"] = {"$in": hashes}
+        return self.query_in_order(collection_name, query, hashes, page=kwargs.get("page"))
+
+    @coalesced(timeout=5)
+    def lookup(self, collection_name, hashes):
+        # Products by hash, in the order asked for, e.g. to compare them side by side
+        return self.query_in_order(collection_name, {"hash": {"$in": hashes}}, hashes)
+
+    def refresh(self, collection_name):
+        # Tell listeners the collection changed under them, e.g. written to by another process
+        self._load_generation()
+        self._notify("on_reset", collection_name)
 
     def remove(self, collection_name, query):
-        logging.info("Rem: col=%s qry=%s" % (collection_name, query))
+        logging.info("Rem: col=%s qry=%s", collection_name, query)
 
         self._get_collection(collection_name).remove(strip_dict(query))
+        self._notify("on_reset", collection_name)
 
     def query(self, collection_name, query, sort_by=None, sort_dir=None, page=None):
-        logging.info("Qry: col=%s qry=%s srt=%s:%s pg=%s" % (collection_name, query, sort_by, sort_dir, page ) )
+        logging.info("Qry: col=%s qry=%s srt=%s:%s pg=%s", collection_name, query, sort_by, sort_dir, page)
 
-        result = self._get_collection(collection_name).find(strip_dict(query))
-        count = result.count()
+        # Best first pages come straight from the leaderboard where it can answer exactly
+        leaderboard = self.leaderboards.get(collection_name)
+        if leaderboard and page is not None:
+            answer = leaderboard.answer(query, sort_by, sort_dir, int(page) * self.PAGE_SIZE, self.PAGE_SIZE)
+            if answer is not None:
+                return answer
 
         # Sorting
+        sort = None
         if sort_by is not None:
-            sort_dir = 1 if sort_dir is None else int(sort_dir) # 1 = ascending, -1 = descending
-            result = result.sort(sort_by, sort_dir)
+            sort = [(sort_by, 1 if sort_dir is None else int(sort_dir))] # 1 = ascending, -1 = descending
+            sort.append(("hash", -1)) # Ties in a stable order across pages, the one the leaderboards rank them in
+
+        result = self._find(collection_name, query, sort)
+        with request_timings.timer("db"):
+            count = result.count()
 
         # Pagination
         if page is not None:
@@ -93,33 +318,170 @@ class Database():
 
         return self._serialise(result), count
 
+    def query_in_order(self, collection_name, query, hashes, page=None):
+        logging.info("Ord: col=%s qry=%s pg=%s", collection_name, query, page)
+
+        found = dict(
+            (document["hash"], document) for document in self._serialise(self._find(collection_name, query))
+        )
+        ordered = [found[product_hash] for product_hash in hashes if product_hash in found]
+
+        # Pagination
+        if page is not None:
+            return ordered[int(page) * self.PAGE_SIZE:(int(page) + 1) * self.PAGE_SIZE], len(ordered)
+        return ordered, len(ordered)
+
+    def query_ranked(self, collection_name, query, weights, sort_dir=None, page=None):
+        logging.info("Rnk: col=%s qry=%s wgt=%s:%s pg=%s", collection_name, query, weights, sort_dir, page)
+
+        sort_dir = -1 if sort_dir is None else int(sort_dir)
+        ranked = self._rank_snapshot(collection_name, query, weights, sort_dir)
+        from_snapshot = ranked is not None
+        if not from_snapshot:
+            ranked = rank(self._serialise(self._find(collection_name, query)), weights, sort_dir=sort_dir)
+        count = len(ranked)
+
+        # Pagination
+        if page is not None:
+            ranked = ranked[int(page) * self.PAGE_SIZE:(int(page) + 1) * self.PAGE_SIZE]
+
+        # Ranked by hash from the snapshot, so only the page's products come from Mongo
+        if from_snapshot:
+            hashes = [product_hash for score, product_hash in ranked]
+            found = dict(
+                (document["hash"], document)
+                for document in self.query_in_order(collection_name, {"hash": {"$in": hashes}}, hashes)[0]
+            )
+            ranked = [(score, found[product_hash]) for score, product_hash in ranked if product_hash in found]
+
+        for score, document in ranked:
+            document["score_custom"] = score
+        return [document for score, document in ranked], count
+
+    def query_collapsed(self, collection_name, query, sort_by, sort_dir, page=None):
+        logging.info("Grp: col=%s qry=%s srt=%s:%s pg=%s", collection_name, query, sort_by, sort_dir, page)
+
+        query, sort_dir = strip_dict(query), int(sort_dir)
+        collection = self._get_collection(collection_name)
+        group = {"$ifNull": ["$group", "$hash"]} # Products written before groups were are a group of their own
+        request_timings.note_query(collection_name, query, [(sort_by, sort_dir)])
+        with request_timings.timer("db"):
+            counted = list(collection.aggregate([
+                {"$match": query}, {"$group": {"_id": group}}, {"$group": {"_id": None, "count": {"$sum": 1}}}
+            ]))
+            count = counted[0]["count"] if counted else 0
+
+        # Groups are precomputed on write, so collapsing is just taking the best of each
+        pipeline = [
+            {"$match": query},
+            {"$sort": {sort_by: sort_dir}},
+            {"$group": {"_id": group, "product": {"$first": "$$ROOT"}}},
+            {"$sort": {"product.%s" % sort_by: sort_dir}},
+        ]
+        if page is not None:
+            pipeline += [{"$skip": int(page) * self.PAGE_SIZE}, {"$limit": self.PAGE_SIZE}]
+
+        index = self.equivalence.get(collection_name)
+        products = []
+        for product in self._serialise(result["product"] for result in collection.aggregate(pipeline)):
+            product["variants"] = index.variants(product["group"]) if index and product.get("group") else []
+            products.append(product)
+        return products, count
+
+    def stream(self, collection_name):
+        # Raw documents, _id and all, without loading them all at once
+        return self._get_collection(collection_name).find()
+
+    def indexes(self, collection_name):
+        return self._get_collection(collection_name).index_information()
+
     def all(self, collection_name):
         return self._serialise(self._get_collection(collection_name).find())
 
+    @coalesced(timeout=2)
     def count(self, collection_name):
-        return self._get_collection(collection_name).find().count()
+        with request_timings.timer("db"):
+            return self._get_collection(collection_name).find().count()
 
+    @coalesced(timeout=2)
     def distinct(self, collection_name, key):
-        return self._get_collection(collection_name).find().distinct(key)
-
+        snapshot = self._snapshot(collection_name)
+        values = snapshot.distinct(key) if snapshot else None
+        if values is not None:
+            return values
+        with request_timings.timer("db"):
+            return self._get_collection(collection_name).find().distinct(key)
+
+    @coalesced(timeout=2)
     def range(self, collection_name, key):
+        snapshot = self._snapshot(collection_name)
+        values = snapshot.range(key) if snapshot else None
+        if values is not None:
+            return values
         return {
             "max": self.max(collection_name, key),
             "min": self.min(collection_name, key),
         }
 
     def max(self, collection_name, key):
-        return self._get_collection(collection_name).find_one(sort=[(key, -1)])[key]
+        with request_timings.timer("db"):
+            return self._get_collection(collection_name).find_one(sort=[(key, -1)])[key]
 
     def min(self, collection_name, key):
-        return self._get_collection(collection_name).find_one(sort=[(key, 1)])[key]
+        with request_timings.timer("db"):
+            return self._get_collection(collection_name).find_one(sort=[(key, 1)])[key]
+
+    def explain(self, collection_name, query, sort=None):
+        # Short summary of Mongo's plan for a query, for the slow query log
+        cursor = self._get_collection(collection_name).find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explanation = cursor.explain()
+        planner, stats = explanation.get("queryPlanner", {}), explanation.get("executionStats", {})
+        plan, stages = planner.get("winningPlan", {}), []
+        while plan:
+            stages.append(plan.get("stage"))
+            plan = plan.get("inputStage")
+        return {
+            "collection": collection_name,
+            "query": query,
+            "sort": sort,
+            "stages": stages,
+            "examined": stats.get("totalDocsExamined"),
+            "returned": stats.get("nReturned"),
+            "millis": stats.get("executionTimeMillis")
+        }
 
     #### Internal ####
 
+    def _snapshot(self, collection_name):
+        reader = self.snapshots.get(collection_name)
+        return reader.current() if reader else None
+
+    def _rank_snapshot(self, collection_name, query, weights, sort_dir):
+        # (score, hash) pairs scored from the snapshot's columns, or None if it can't answer
+        snapshot = self._snapshot(collection_name)
+        rows = snapshot.select(query) if snapshot else None
+        columns = snapshot.feature_columns(rows, weights.keys()) if rows is not None else None
+        if columns is None:
+            return None
+        with request_timings.timer("db"):
+            scores = score_columns(columns, weights, len(rows))
+            return sorted(
+                zip(scores, [snapshot.hash(row) for row in rows]), key=lambda scored: scored[0], reverse=sort_dir == -1
+            )
+
+    def _notify(self, event, collection_name, *args):
+        for listener in self.listeners:
+            wrapped_execute(getattr(listener, event), collection_name, *args)
+
     @staticmethod
     def _all(arguments):
-        if arguments not in [None, []]:
-            return {"$all": json.loads(arguments)}
+        # Nothing required is no filter, where Mongo's empty $all would match nothing
+        if arguments not in [None, [], ""]:
+            values = json.loads(arguments)
+            if values:
+                return {"$all": values}
 
     @staticmethod
     def _gt(arguments):
@@ -150,7 +512,20 @@ class Database():
         return object
 
     def _serialise(self, cursor):
-        return [self._serialise_document(obj) for obj in cursor]
+        with request_timings.timer("db"):
+            documents = list(cursor)
+        with request_timings.timer("serialise"):
+            return [self._serialise_document(obj) for obj in documents]
+
+    def _find(self, collection_name, query, sort=None):
+        query = strip_dict(query)
+        request_timings.note_query(collection_name, query, sort)
+        cursor = self._get_collection(collection_name).find(query)
+        return cursor.sort(sort) if sort else cursor
+
+    def _create_indexes(self, collection_name, collection):
+        for key in self.INDEXES.get(collection_name, []):
+            collection.create_index(key)
 
     def _get_collection(self, collection_name):
-        return getattr(self.db, collection_name)
\ No newline at end of file
+        return self.db[self.live.get(collection_name, collection_name)]
\ No newline at end of file
@@ -0,0 +1,86 @@
+import json
+import logging
+import os
+from time import time
+
+import bson
+
+from objects.pizza import Pizza
+from scoring import profiles, profile_field, score_pizza
+
+BATCH_SIZE = 500
+
+def load(db_wrapper, dump_dir, batch_size=BATCH_SIZE):
+    """
+    Load a catalogue from mongodump style BSON files (pizza.bson, sides.bson) as a new generation, replacing the
+    live one. Documents are streamed in and inserted in batches, and indexes are built once at the commit
+    """
+    started, counts = time(), {}
+    generation = int(started * 1000)
+    db_wrapper.begin_generation(generation, indexed=False)
+    for collection_name in db_wrapper.GENERATIONS:
+        path = os.path.join(dump_dir, "%s.bson" % collection_name)
+        counts[collection_name] = 0
+        if not os.path.exists(path):
+            logging.warning("No %s in %s, it'll be empty", collection_name, dump_dir)
+            continue
+        with open(path, "rb") as f:
+            batch = []
+            for document in bson.decode_file_iter(f):
+                batch.append(_derive(collection_name, document))
+                if len(batch) >= batch_size:
+                    db_wrapper.insert_many(collection_name, batch)
+                    counts[collection_name] += len(batch)
+                    batch = []
+            if batch:
+                db_wrapper.insert_many(collection_name, batch)
+                counts[collection_name] += len(batch)
+    db_wrapper.commit_generation(generation, carry_over=False)
+    logging.info("Loaded %s from %s in %.2fs", counts, dump_dir, time() - started)
+    return counts
+
+def export(db_wrapper, dump_dir):
+    """
+    Write the live catalogue out in the same format, along with mongodump's metadata so mongorestore can read it too
+    """
+    if not os.path.exists(dump_dir):
+        os.makedirs(dump_dir)
+    counts = {}
+    for collection_name in db_wrapper.GENERATIONS:
+        path = os.path.join(dump_dir, "%s.bson" % collection_name)
+        counts[collection_name] = 0
+        with open(path + ".tmp", "wb") as f:
+            for document in db_wrapper.stream(collection_name):
+                f.write(bson.BSON.encode(document))
+                counts[collection_name] += 1
+        os.rename(path + ".tmp", path)
+
+        with open(os.path.join(dump_dir, "%s.metadata.json" % collection_name), "w") as f:
+            f.write(json.dumps({"options": {}, "indexes": _index_metadata(db_wrapper, collection_name)}))
+    logging.info("Exported %s to %s", counts, dump_dir)
+    return counts
+
+#### Internal ####
+
+def _derive(collection_name, document):
+    # Fill in fields added since the dump was taken
+    if collection_name == "pizza":
+        if "group" not in document:
+            document["group"] = Pizza.equivalence_group(
+                document["toppings"], document["diameter"], document["base_style"]
+            )
+        for profile, weights in profiles.iteritems():
+            if profile_field(profile) not in document:
+                document[profile_field(profile)] = score_pizza(document, weights)
+    return document
+
+def _index_metadata(db_wrapper, collection_name):
+    indexes = []
+    for name, index in sorted(db_wrapper.indexes(collection_name).iteritems()):
+        indexes.append({
+            "v": index.get("v", 1),
+            "key": dict(index["key"]),
+            "name": name,
+            "ns": "%s.%s" % (db_wrapper.db.name, collection_name)
+        })
+    return indexes
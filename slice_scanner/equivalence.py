@@ -0,0 +1,55 @@
+import logging
+from threading import Lock
+
+class EquivalenceIndex(object):
+    """
+    Groups of equivalent products (see Pizza._group), e.g. one pizza in every crust, or the same pizza from two
+    vendors. Kept up to date as the Keeper writes so collapsed queries only need to look variants up
+    """
+    VARIANT_KEYS = ["hash", "vendor", "name", "size", "base", "price", "score"]
+
+    def __init__(self, db, collection_name):
+        self.db = db
+        self.collection_name = collection_name
+        self.lock = Lock()
+        self.rebuild()
+
+    #### Listener ####
+
+    def on_insert(self, collection_name, document):
+        if collection_name == self.collection_name:
+            with self.lock:
+                self._add(document)
+
+    def on_reset(self, collection_name):
+        if collection_name == self.collection_name:
+            self.rebuild()
+
+    #### Query ####
+
+    def variants(self, group):
+        with self.lock:
+            return sorted(self.groups.get(group, {}).values(), key=lambda variant: variant["price"])
+
+    #### Internal ####
+
+    def rebuild(self):
+        logging.info("Rebuilding %s equivalence index" % self.collection_name)
+        with self.lock:
+            self.groups = {} # Group -> hash -> variant
+            self.members = {} # Hash -> group
+            for document in self.db.all(self.collection_name):
+                self._add(document)
+
+    def _add(self, document):
+        product_hash, group = document["hash"], document.get("group")
+        previous = self.members.pop(product_hash, None)
+        if previous is not None:
+            self.groups[previous].pop(product_hash, None)
+            if not self.groups[previous]:
+                del self.groups[previous]
+        if group is not None:
+            self.members[product_hash] = group
+            self.groups.setdefault(group, {})[product_hash] = dict(
+                (key, document.get(key)) for key in self.VARIANT_KEYS
+            )
@@ -0,0 +1,96 @@
+import logging
+from time import time
+from pymongo import ReturnDocument
+
+class JobQueue(object):
+    """
+    Scrape jobs kept in a Mongo collection. Workers claim a job with a lease and renew it with heartbeats. A job
+    whose lease runs out (dead worker) goes back up for grabs, until it has used up its attempts
+    """
+    LEASE_SECONDS = 120
+    MAX_ATTEMPTS = 3
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.collection.create_index([("state", 1), ("created", 1)])
+        self.collection.create_index("lease_until")
+
+    def enqueue(self, vendor_id, phase=None, unit=None, cycle=None):
+        # Vendor jobs (no phase) list their work units, which are enqueued as jobs of their own
+        return self.collection.insert_one({
+            "vendor": vendor_id,
+            "phase": phase,
+            "unit": unit,
+            "cycle": cycle,
+            "state": "pending",
+            "attempts": 0,
+            "worker": None,
+            "lease_until": 0,
+            "created": time()
+        }).inserted_id
+
+    def claim(self, worker_id):
+        now = time()
+        return self.collection.find_one_and_update(
+            {
+                "$or": [{"state": "pending"}, {"state": "running", "lease_until": {"$lt": now}}],
+                "attempts": {"$lt": self.MAX_ATTEMPTS}
+            },
+            {
+                "$set": {"state": "running", "worker": worker_id, "lease_until": now + self.LEASE_SECONDS},
+                "$inc": {"attempts": 1}
+            },
+            sort=[("created", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    def heartbeat(self, job, worker_id):
+        # False if we've lost the lease, i.e. someone else has the job now
+        return self.collection.update_one(
+            {"_id": job["_id"], "worker": worker_id, "state": "running"},
+            {"$set": {"lease_until": time() + self.LEASE_SECONDS}}
+        ).matched_count == 1
+
+    def complete(self, job, worker_id):
+        self.collection.update_one(
+            {"_id": job["_id"], "worker": worker_id},
+            {"$set": {"state": "done", "finished": time()}}
+        )
+
+    def fail(self, job, worker_id, error):
+        state = "pending" if job["attempts"] < self.MAX_ATTEMPTS else "failed"
+        logging.error("Job %s %s failed on %s, now %s", job["vendor"], job["unit"], worker_id, state)
+        self.collection.update_one(
+            {"_id": job["_id"], "worker": worker_id},
+            {"$set": {"state": state, "lease_until": 0, "error": error}}
+        )
+
+    def outstanding(self, vendor_id=None, cycle=None):
+        # Jobs not yet finished one way or another
+        self.reap()
+        query = {"state": {"$in": ["pending", "running"]}}
+        if vendor_id is not None:
+            query["vendor"] = vendor_id
+        if cycle is not None:
+            query["cycle"] = cycle
+        return self.collection.find(query).count()
+
+    def summary(self, cycle):
+        # Vendor -> how many jobs it had in a cycle, and the phases of those that failed (None for the vendor job)
+        summary = {}
+        for job in self.collection.find({"cycle": cycle}, {"vendor": 1, "phase": 1, "state": 1}):
+            outcome = summary.setdefault(job["vendor"], {"total": 0, "failed": []})
+            outcome["total"] += 1
+            if job["state"] == "failed":
+                outcome["failed"].append(job["phase"])
+        return summary
+
+    def reap(self):
+        # Jobs whose last attempt's worker died
+        self.collection.update_many(
+            {"state": "running", "lease_until": {"$lt": time()}, "attempts": {"$gte": self.MAX_ATTEMPTS}},
+            {"$set": {"state": "failed", "error": "Lease expired"}}
+        )
+
+    def purge(self, older_than_seconds):
+        self.collection.delete_many({"state": {"$in": ["done", "failed"]}, "created": {"$lt": time() - older_than_seconds}})
@@ -1,26 +1,123 @@
 from objects.pizza import Pizza
 from objects.side import Side
+from refinery import Refinery
+from Queue import Empty
+import errno
 import logging
+import os
+import time
+
+PHASE_COLLECTIONS = {"pizzas": "pizza", "sides": "sides"} # Where each scrape phase's products are kept
+
+class Generation(object):
+    """
+    Marker sent down the product queue around a scrape, so its products are written as one generation
+    """
+
+    def __init__(self, generation, event, source=None, incomplete=None):
+        self.generation = generation
+        self.event = event # begin, stage (write into a generation begun elsewhere) or commit
+        self.source = source # Collector that sent it
+        self.incomplete = incomplete or [] # (vendor, collection) pairs only partly scraped, on commit
+
+    def __repr__(self):
+        return "Generation %s %s from %s" % (self.generation, self.event, self.source)
 
 class Keeper():
+    BATCH_SIZE = 100 # Most queued items refined and written in one go
+    SOURCE_DEADLINE = 4 * 60 * 60 # Collector given up on if it hasn't committed by then, e.g. unreaped or pid reused
 
-    def __init__(self, db, queue):
+    def __init__(self, db, queue, refinery=None):
         self.db = db
         self.queue = queue
+        self.refinery = refinery or Refinery() # Makes products out of what the vendors scraped
+        self.sources = {} # Collectors still writing the open generation -> when they began
+        self.incomplete = set() # (vendor, collection) pairs they only got part of
 
     def _keep(self, product):
         if type(product) is Pizza:
             self.db.insert_pizza(product)
         elif type(product) is Side:
             self.db.insert_side(product)
+        elif type(product) is Generation:
+            self._switch(product)
+
+    def _switch(self, marker):
+        # Collectors running side by side (e.g. one process per vendor) share a generation, which goes live when
+        # the last of them is done
+        if marker.event == "begin":
+            self._drop_dead_sources()
+            if not self.sources and self.db.generation is None: # Or join the one dead collectors left open
+                self.db.begin_generation(marker.generation)
+                self.incomplete = set()
+            self.sources[marker.source] = time.time()
+        elif marker.event == "stage":
+            self.db.stage_generation(marker.generation)
+        elif marker.event == "commit":
+            self.sources.pop(marker.source, None)
+            self.incomplete.update(tuple(pair) for pair in marker.incomplete)
+            self._drop_dead_sources()
+            self._commit_if_done()
+
+    def _commit_if_done(self):
+        if not self.sources and self.db.generation is not None:
+            self.db.commit_generation(self.db.generation, incomplete=sorted(self.incomplete))
+
+    def _drop_dead_sources(self):
+        # A collector that died mid scrape never sends its commit, so the generation goes live without it, its vendors
+        # counted as incomplete so they keep their live products
+        for source, began in self.sources.items():
+            if self._alive(source) and time.time() - began < self.SOURCE_DEADLINE:
+                continue
+            logging.warning("Collector %s never committed, going on without it", source)
+            del self.sources[source]
+            vendor_ids = str(source).split("-", 1)[1].split(",") if "-" in str(source) else []
+            self.incomplete.update(
+                (vendor_id, collection) for vendor_id in vendor_ids for collection in PHASE_COLLECTIONS.values()
+            )
+
+    @staticmethod
+    def _alive(source):
+        # Sources are the collector's pid, with the vendors it scrapes after a dash if it doesn't scrape them all
+        try:
+            os.kill(int(str(source).split("-")[0]), 0)
+        except ValueError:
+            return True # Not one of ours to check
+        except OSError as e:
+            return e.errno == errno.EPERM # Someone else's, but running
+        return True
+
+    def _next_batch(self):
+        # Whatever's queued up to BATCH_SIZE, only waiting for the first
+        batch = [self.queue.get()]
+        while len(batch) < self.BATCH_SIZE:
+            try:
+                batch.append(self.queue.get_nowait())
+            except Empty:
+                break
+        return batch
+
+    def _refine(self, item):
+        # Markers get through whatever happens to the products around them
+        try:
+            return self.refinery.refine([item])[0]
+        except Exception:
+            logging.error("Error refining [%s]" % item, exc_info=True)
+            return item if type(item) is Generation else None
 
     def run(self):
         logging.info("Keeper Running")
         while True:
+            batch = self._next_batch()
             try:
-                product = self.queue.get()
-                self._keep(product)
+                products = self.refinery.refine(batch)
             except Exception:
-                logging.error("Error saving object [%s]" % product, exc_info=True)
-            finally:
-                self.queue.task_done()
\ No newline at end of file
+                logging.error("Error refining %s objects, refining them one at a time" % len(batch), exc_info=True)
+                products = [self._refine(item) for item in batch]
+            for product in products:
+                try:
+                    self._keep(product)
+                except Exception:
+                    logging.error("Error saving object [%s]" % product, exc_info=True)
+            for item in batch:
+                self.queue.task_done()
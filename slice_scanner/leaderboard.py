@@ -0,0 +1,163 @@
+import heapq
+import logging
+from collections import defaultdict
+from threading import Lock
+
+from utils import strip_dict
+
+RANGE = set(["$gte", "$lte"])
+NUMBERS = [int, long, float]
+
+class Leaderboard(object):
+    """
+    Best products by sort_by in sort_dir (-1 highest first, 1 lowest first) for each combination of the common
+    filter keys (vendor, style etc), kept up to date as the Keeper writes. Answers "best first" pages by merging
+    heaps, with exact counts from in memory counters. Range filters are only answered when they take in every
+    product, as the UI's untouched sliders do
+    """
+    DEPTH = 60 # Products kept per heap, enough for the first few pages of any slice
+
+    def __init__(self, db, collection_name, keys, sort_by="score", sort_dir=-1):
+        self.db = db
+        self.collection_name = collection_name
+        self.keys = keys
+        self.sort_by = sort_by
+        self.sort_dir = sort_dir
+        self.lock = Lock()
+        self.rebuild()
+
+    #### Listener ####
+
+    def on_insert(self, collection_name, document):
+        if collection_name == self.collection_name:
+            with self.lock:
+                self._add(document)
+
+    def on_reset(self, collection_name):
+        if collection_name == self.collection_name:
+            self.rebuild()
+
+    #### Query ####
+
+    def answer(self, query, sort_by, sort_dir, skip, limit):
+        # Returns (documents, count), or None if the query isn't one we can answer exactly
+        if sort_by != self.sort_by or sort_dir is None or int(sort_dir) != self.sort_dir:
+            return None
+
+        with self.lock:
+            allowed = self._allowed_values(strip_dict(query))
+            if allowed is None:
+                return None
+            matching = [key for key in self.counts if self._matches(key, allowed)]
+            if any(self.unranked[key] for key in matching):
+                return None # Mongo would place products without sort_by, we can't
+            count = sum(self.counts[key] for key in matching)
+            floor = max([self.floors[key] for key in matching] or [None])
+            best = heapq.nlargest(skip + limit, (entry for key in matching for entry in self.heaps[key]))
+
+            # Anything outside the heaps ranks at most the floor, so only rank products above it
+            if len(best) < min(skip + limit, count) or (best and floor is not None and best[-1] < floor):
+                return None
+
+            return [dict(self.documents[product_hash]) for rank, product_hash in best[skip:]], count
+
+    #### Internal ####
+
+    def rebuild(self):
+        logging.info("Rebuilding %s leaderboard" % self.collection_name)
+        with self.lock:
+            self.heaps = defaultdict(list) # Slice -> min heap of (rank, hash), rank is sort_by flipped to sort_dir
+            self.floors = defaultdict(lambda: None) # Slice -> best (rank, hash) evicted from its heap
+            self.counts = defaultdict(int) # Slice -> product count
+            self.unranked = defaultdict(int) # Slice -> products without sort_by
+            self.bounds = None # Numeric field -> (min, max) of every product added since, None if some lack it
+            self.slices = {} # Hash -> slice
+            self.documents = {} # Hash -> document, for products held in a heap
+            for document in self.db.all(self.collection_name):
+                self._add(document)
+
+    def _add(self, document):
+        product_hash = document["hash"]
+        self._discard(product_hash)
+
+        key = tuple(document.get(name) for name in self.keys)
+        self.slices[product_hash] = key
+        self.counts[key] += 1
+        self._widen(document)
+
+        value = document.get(self.sort_by)
+        if value is None:
+            self.unranked[key] += 1
+            self.documents[product_hash] = None # Only to know to uncount it
+            return
+        heap, entry = self.heaps[key], (-self.sort_dir * value, product_hash)
+        if len(heap) < self.DEPTH:
+            heapq.heappush(heap, entry)
+        elif entry > heap[0]:
+            evicted = heapq.heapreplace(heap, entry)
+            del self.documents[evicted[1]]
+            self.floors[key] = max(self.floors[key], evicted)
+        else:
+            self.floors[key] = max(self.floors[key], entry)
+            return
+        self.documents[product_hash] = document
+
+    def _discard(self, product_hash):
+        key = self.slices.pop(product_hash, None)
+        if key is None:
+            return
+        self.counts[key] -= 1
+        if not self.counts[key]:
+            del self.counts[key]
+        if product_hash not in self.documents:
+            return
+        if self.documents.pop(product_hash) is None:
+            self.unranked[key] -= 1
+        else:
+            heap = self.heaps[key]
+            heap[:] = [entry for entry in heap if entry[1] != product_hash]
+            heapq.heapify(heap)
+
+    def _widen(self, document):
+        # Bounds only grow until the next rebuild, so a range taking them in takes in every product
+        if self.bounds is None:
+            self.bounds = dict(
+                (field, (value, value)) for field, value in document.iteritems() if type(value) in NUMBERS
+            )
+            return
+        for field, bounds in self.bounds.items():
+            value = document.get(field)
+            if bounds is None:
+                continue
+            if type(value) in NUMBERS:
+                self.bounds[field] = (min(bounds[0], value), max(bounds[1], value))
+            else:
+                self.bounds[field] = None # Mongo's ranges leave it out
+
+    def _covers(self, field, condition):
+        bounds = (self.bounds or {}).get(field)
+        return bounds is not None and condition.get("$gte", bounds[0]) <= bounds[0] and (
+            condition.get("$lte", bounds[1]) >= bounds[1]
+        )
+
+    def _allowed_values(self, query):
+        # Filter key -> set of allowed values. None if the query filters on anything else, other than ranges that
+        # take in every product
+        allowed = {}
+        for name, condition in query.iteritems():
+            if type(condition) is not dict:
+                return None
+            if set(condition) <= RANGE and name not in self.keys:
+                if not self._covers(name, condition):
+                    return None
+                continue
+            if name not in self.keys or condition.keys() != ["$in"] or type(condition["$in"]) is not list:
+                return None
+            allowed[name] = set(condition["$in"])
+        return allowed
+
+    def _matches(self, key, allowed):
+        for name, value in zip(self.keys, key):
+            if name in allowed and value not in allowed[name]:
+                return False
+        return True
@@ -0,0 +1,146 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from threading import Lock, local
+from time import time
+
+class Registry(object):
+    """
+    Counters, gauges and latency histograms, labelled and rendered in Prometheus text format
+    """
+    BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30] # Seconds
+
+    def __init__(self):
+        self.lock = Lock()
+        self.types = {} # Name -> counter, gauge or histogram
+        self.values = {} # (name, labels) -> value, or [bucket counts, sum, count] for histograms
+
+    def inc(self, name, value=1, **labels):
+        key = self._key("counter", name, labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        key = self._key("gauge", name, labels)
+        with self.lock:
+            self.values[key] = value
+
+    def observe(self, name, value, **labels):
+        key = self._key("histogram", name, labels)
+        with self.lock:
+            histogram = self.values.setdefault(key, [[0] * len(self.BUCKETS), 0.0, 0])
+            index = bisect_left(self.BUCKETS, value)
+            if index < len(self.BUCKETS):
+                histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def get(self, name, **labels):
+        with self.lock:
+            return self.values.get((name, self._labels(labels)))
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time()
+        try:
+            yield
+        finally:
+            self.observe(name, time() - start, **labels)
+
+    def snapshot(self, prefix="", **labels):
+        # Plain dict of every series, or those with all of labels, e.g. for a JSON report
+        wanted = set(self._labels(labels))
+        with self.lock:
+            series = {}
+            for (name, labels), value in self.values.iteritems():
+                if name.startswith(prefix) and wanted <= set(labels):
+                    if self.types[name] == "histogram":
+                        value = {"count": value[2], "sum": value[1]}
+                    series["%s%s" % (name, self._render_labels(labels))] = value
+            return series
+
+    def render(self):
+        with self.lock:
+            lines = []
+            for name in sorted(self.types):
+                lines.append("# TYPE %s %s" % (name, self.types[name]))
+                for (series_name, labels), value in sorted(self.values.iteritems()):
+                    if series_name != name:
+                        continue
+                    if self.types[name] != "histogram":
+                        lines.append("%s%s %s" % (name, self._render_labels(labels), value))
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(self.BUCKETS, value[0]):
+                        cumulative += count
+                        lines.append("%s_bucket%s %s" % (name, self._render_labels(labels + (("le", bound),)), cumulative))
+                    lines.append("%s_bucket%s %s" % (name, self._render_labels(labels + (("le", "+Inf"),)), value[2]))
+                    lines.append("%s_sum%s %s" % (name, self._render_labels(labels), value[1]))
+                    lines.append("%s_count%s %s" % (name, self._render_labels(labels), value[2]))
+            return "\n".join(lines) + "\n"
+
+    def _key(self, metric_type, name, labels):
+        self.types.setdefault(name, metric_type)
+        return name, self._labels(labels)
+
+    @staticmethod
+    def _labels(labels):
+        return tuple(sorted((key, value) for key, value in labels.iteritems() if value is not None))
+
+    @staticmethod
+    def _render_labels(labels):
+        if not labels:
+            return ""
+        return "{%s}" % ",".join('%s="%s"' % (key, str(value).replace('"', '\\"')) for key, value in labels)
+
+class RequestTimings(local):
+    """
+    Time spent in each stage (db, serialise) of the current thread's request, and the queries it ran
+    """
+
+    def __init__(self):
+        self.start()
+
+    def start(self):
+        self.started = time()
+        self.stages = {}
+        self.queries = []
+
+    @contextmanager
+    def timer(self, stage):
+        start = time()
+        try:
+            yield
+        finally:
+            self.stages[stage] = self.stages.get(stage, 0.0) + time() - start
+
+    def note_query(self, collection_name, query, sort=None):
+        self.queries.append((collection_name, query, sort))
+
+    def total(self):
+        return time() - self.started
+
+registry = Registry()
+request_timings = RequestTimings()
+
+def scrape_instrumented(method):
+    # Time a Parser method, labelled with the vendor and phase of the session calling it
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with registry.timer("scrape_call_seconds", vendor=self.id, phase=self.phase, call=method.__name__):
+            return method(self, *args, **kwargs)
+    return wrapper
+
+def diff(before, after):
+    # Change in each series between two snapshots
+    changes = {}
+    for series, value in after.iteritems():
+        previous = before.get(series)
+        if type(value) is dict:
+            previous = previous or {"count": 0, "sum": 0.0}
+            change = {"count": value["count"] - previous["count"], "sum": value["sum"] - previous["sum"]}
+            if change["count"]:
+                changes[series] = change
+        elif value != previous:
+            changes[series] = value - (previous or 0)
+    return changes
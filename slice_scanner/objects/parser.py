@@ -6,11 +6,17 @@ from time import sleep
 import re
 import logging
 import abc
+from ..metrics import scrape_instrumented
+
+FLOAT = re.compile(r"\d+.\d+")
+INT = re.compile(r"\d+")
 
 class Parser(object):
     __metaclass__ = abc.ABCMeta
     web_driver = None
     page_wait = 0.4 # Wait time we use for animations, ajax loading etc
+    id = None
+    phase = None # What we're scraping right now (login, pizzas, sides), for instrumentation
 
     def set_driver(self, web_driver):
         self.web_driver = web_driver
@@ -24,6 +30,11 @@ class Parser(object):
 
     #### DOM ####
 
+    @scrape_instrumented
+    def _get_page(self, url):
+        self.web_driver.get(url)
+
+    @scrape_instrumented
     def _get_css(self, selector):
         try:
             return self.web_driver.find_element_by_css_selector(selector)
@@ -42,6 +53,7 @@ class Parser(object):
         except NoSuchElementException:
             return None
 
+    @scrape_instrumented
     def _wait_for_cl(self, selector, timeout=3):
         try:
             ui.WebDriverWait(self.web_driver, timeout).until(
@@ -50,6 +62,7 @@ class Parser(object):
         except TimeoutException:
             pass
 
+    @scrape_instrumented
     def _wait_for_id(self, selector, timeout=3):
         try:
             ui.WebDriverWait(self.web_driver, timeout).until(
@@ -58,6 +71,7 @@ class Parser(object):
         except TimeoutException:
             pass
 
+    @scrape_instrumented
     def _wait_for_css(self, selector, timeout=3):
         try:
             ui.WebDriverWait(self.web_driver, timeout).until(
@@ -66,6 +80,7 @@ class Parser(object):
         except TimeoutException:
             pass
 
+    @scrape_instrumented
     def _wait_for_css_to_clear(self, selector, timeout=3):
         try:
             ui.WebDriverWait(self.web_driver, timeout).until(
@@ -74,6 +89,7 @@ class Parser(object):
         except TimeoutException:
             pass
 
+    @scrape_instrumented
     def _wait_for_alert(self, timeout=2):
         try:
             ui.WebDriverWait(self.web_driver, timeout).until(EC.alert_is_present())
@@ -81,9 +97,11 @@ class Parser(object):
         except TimeoutException:
             return
 
+    @scrape_instrumented
     def _wait(self):
         sleep(self.page_wait)
 
+    @scrape_instrumented
     def _script(self, script):
         return self.web_driver.execute_script(script)
 
@@ -96,6 +114,7 @@ class Parser(object):
     def _select_dropdown_option(self, dropdown_id, option_index):
         Select(self.web_driver.find_element_by_id(dropdown_id)).select_by_index(option_index)
 
+    @scrape_instrumented
     def _wait_for_alert_to_clear(self, timeout=2):
         try:
             ui.WebDriverWait(self.web_driver, timeout).until(
@@ -104,6 +123,7 @@ class Parser(object):
         except TimeoutException:
             return
 
+    @scrape_instrumented
     def _get_css_str(self, selector):
         timeout = 1
         wait = 0.2
@@ -114,6 +134,7 @@ class Parser(object):
             sleep(wait)
             timeout -= wait
 
+    @scrape_instrumented
     def _get_css_attr(self, selector, attribute):
         timeout = 1
         wait = 0.2
@@ -132,7 +153,7 @@ class Parser(object):
     @staticmethod
     def _get_str_int(string):
         try:
-            return int(re.search(r'\d+', string).group())
+            return int(INT.search(string).group())
         except AttributeError:
             logging.error("Parsing error [%s]" % string, exc_info=True)
             return None
@@ -140,7 +161,7 @@ class Parser(object):
     @staticmethod
     def _get_str_fl(string):
         try:
-            return float(re.findall("\d+.\d+", string)[0])
+            return float(FLOAT.findall(string)[0])
         except IndexError, AttributeError:
             logging.error("Parsing error [%s]" % string, exc_info=True)
             return None
@@ -149,16 +170,3 @@ class Parser(object):
     def _strip_to_ascii(string):
         return ''.join([i if ord(i) < 128 else '' for i in string])
 
-    @staticmethod
-    def _normalise_parsed_data(kwargs):
-
-        def _punify(data):
-            return data.encode("punycode").split("-")[0]
-
-        for key, value in kwargs.iteritems():
-            if key not in ["img"]:
-                if type(value) in [str, unicode]:
-                    kwargs[key] = _punify(value)
-                elif type(value) in [list]:
-                    kwargs[key] = [_punify(item) for item in value]
-        return kwargs
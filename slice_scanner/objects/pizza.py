@@ -1,5 +1,7 @@
 from ..utils import list_to_title_string, float_to_two_places
+from ..scoring import profiles, profile_field, score_pizza
 from hashlib import md5
+from bisect import bisect
 from product import Product
 
 class Pizza(Product):
@@ -77,6 +79,9 @@ class Pizza(Product):
         "Meaty": ["meat"]
     }
 
+    # Diameter bands, in inches, for deciding which pizzas are equivalent across vendors (personal, small etc)
+    diameter_bands = [8, 10.5, 12.5]
+
     def __init__(self, **kwargs):
         super(Pizza, self).__init__(**kwargs)
         self.size = kwargs["size"]
@@ -146,8 +151,22 @@ class Pizza(Product):
         to_hash += self.name
         to_hash += str(self.size)
         to_hash += self.base
+        to_hash += self._store_key() # Same pizza at other stores can be another price
         return md5(to_hash).hexdigest()
 
+    def _group(self):
+        return self.equivalence_group(self.toppings, self.diameter, self.base_style)
+
+    @classmethod
+    def equivalence_group(cls, toppings, diameter, base_style):
+        # Equivalence group. Same toppings, roughly the same size and the same style of base
+        signature = u"%s|%s|%s" % (
+            ",".join(sorted(set(topping.lower() for topping in toppings))),
+            bisect(cls.diameter_bands, diameter),
+            base_style
+        )
+        return md5(signature.encode("utf-8")).hexdigest()
+
     def _description(self, base, toppings):
         return "%s Base with %s." % (
             base.lower().replace("crust", "").replace("base", "").strip().title(),
@@ -189,5 +208,8 @@ class Pizza(Product):
             pizza_dict["cost_per_slice"] = self._cost_per_slice()
             pizza_dict["serves"] = self._serves()
             pizza_dict["score"] = self._score()
+            pizza_dict["group"] = self._group()
+            for profile, weights in profiles.iteritems():
+                pizza_dict[profile_field(profile)] = score_pizza(pizza_dict, weights)
             return pizza_dict
         return None
\ No newline at end of file
@@ -12,6 +12,8 @@ class Product():
         self.description = kwargs["description"] if kwargs.get("description") else kwargs["name"]
         self.img = kwargs.get("img")
         self.quantity = kwargs.get("quantity", 1)
+        self.stores = kwargs.get("stores") # Stores selling it at this price, if the vendor has more than one
+        self.menu = kwargs.get("menu") # Fingerprint of the menu those stores share
         self.stamp = time()
 
     def to_dict(self):
@@ -25,6 +27,9 @@ class Product():
             product_dict["stamp"] = self.stamp
             product_dict["hash"] = self._hash()
             product_dict["url"] = self.url
+            if self.stores:
+                product_dict["stores"] = self.stores
+                product_dict["menu"] = self.menu
             return product_dict
         return None
 
@@ -34,6 +39,11 @@ class Product():
                 return False
         return self.price > 0
 
+    def _store_key(self):
+        # Where the product is sold, for its hash. The store a shared menu was scraped at stands for all its stores,
+        # so the hash holds when prices change. Empty unless the vendor has several stores (then there's a menu)
+        return str(self.stores[0]) if self.menu else ""
+
     @staticmethod
     def _normalise_data(normaliser, data):
 
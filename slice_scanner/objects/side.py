@@ -43,7 +43,7 @@ class Side(Product):
         return valid
 
     def _hash(self):
-        return md5(self.vendor + self.name + str(self.quantity)).hexdigest()
+        return md5(self.vendor + self.name + str(self.quantity) + self._store_key()).hexdigest()
 
     def to_dict(self):
         side_dict = super(Side, self).to_dict()
@@ -1,8 +1,15 @@
 import abc
+import json
+import logging
+from hashlib import md5
 from ..objects.parser import Parser
 from ..objects.pizza import Pizza
 from ..objects.side import Side
 from ..utils import wrapped_execute
+from ..metrics import registry
+from ..pricing import PriceMatrix
+from ..refinery import RawProduct, parse_price
+from ..cadence import identity
 
 class Vendor(Parser):
     __metaclass__ = abc.ABCMeta
@@ -15,13 +22,35 @@ class Vendor(Parser):
     # Slice dict. For converting "large" to 10
     slice_reference = {}
 
-    def __init__(self, outgoing_queue):
+    # Whether a saved login can be restored instead of logging in again. Set where _logged_in can tell if it took
+    reuse_login = False
+
+    # Store _login picks when none are configured, e.g. a store finder option or location id
+    default_store = None
+
+    # Splits a scraped topping description into toppings in the Refinery. A module level function, so a pool can
+    # pickle it. Toppings scraped as lists don't need one
+    split_toppings = None
+
+    def __init__(self, outgoing_queue, sessions=None, infer_prices=False, stores=None):
         self.queue = outgoing_queue # Queue for stuff we've parsed
+        self.produced = 0 # Products from the unit being scraped
+        self.sessions = sessions # SessionStore of saved logins, or None to always log in
+        self.prices = PriceMatrix(self.id) if infer_prices else None # Crust surcharges, or None to click every crust
+        self.stores = stores or [self.default_store] # Each can have its own menu and prices
+        self.store = self.stores[0] # The one we're logged in to
+        self.tags = {} # Store fields of the unit being scraped, for its products
+        self.observed = {} # Identity -> price of what we've scraped, to see how much changes between scrapes
 
     def _new_product(self, product, **kwargs):
-        new_product = wrapped_execute(lambda: product(**self._normalise_parsed_data(kwargs)))
-        if new_product:
-            self.queue.put(new_product)
+        # Fields go as scraped, prices and toppings can be raw strings. The Keeper's Refinery makes the product.
+        # Only records with a name and a price count towards the unit, so broken selectors still fail it
+        kwargs.update(self.tags)
+        self.observed[identity(kwargs)] = kwargs.get("price")
+        price = parse_price(kwargs.get("price"))
+        if kwargs.get("name") and type(price) in [int, long, float] and price > 0:
+            self.produced += 1
+        self.queue.put(RawProduct(product.__name__, self.id, self.phase, kwargs, self.split_toppings))
 
     @staticmethod
     def _normalise_data(normaliser, data):
@@ -58,15 +87,142 @@ class Vendor(Parser):
             diameter=diameter, price=price, base=base, slices=slices, img=img, url=self.site
         )
 
+    def _price_crusts(self, size, crusts, price_of):
+        # [(crust, price)] of every crust at a size. price_of(index) selects a crust and reads the price, and with a
+        # price matrix it's only called for the crusts the matrix can't work out from the others
+        if self.prices is None:
+            return [(crust, price_of(index)) for index, crust in enumerate(crusts)]
+        clicked = dict((index, price_of(index)) for index in self.prices.to_price(size, crusts))
+        prices = self.prices.infer(size, crusts, clicked)
+        if prices is None:
+            for index in range(len(crusts)):
+                if index not in clicked:
+                    clicked[index] = price_of(index)
+            prices = [clicked[index] for index in range(len(crusts))]
+            self.prices.learn(size, crusts, prices)
+        registry.inc("scrape_crust_prices_total", len(clicked), vendor=self.id, source="clicked")
+        registry.inc("scrape_crust_prices_total", len(crusts) - len(clicked), vendor=self.id, source="inferred")
+        return zip(crusts, prices)
+
     def _new_side(self, name, price, img, description=None):
         self._new_product(
             Side, vendor=self.id, name=name, price=price, img=img, description=description, url=self.site
         )
 
+    def spawn(self):
+        # Fresh session for the same vendor, to scrape work units on another browser
+        session = self.__class__(self.queue, self.sessions, stores=self.stores)
+        session.prices, session.observed = self.prices, self.observed # Shared by all of them
+        return session
+
+    def login(self):
+        # Only go through the vendor's login when neither this browser nor a saved session is still logged in
+        self.phase = "login"
+        if self.sessions is None or not self.reuse_login:
+            self._login()
+        elif not self._resume():
+            self._login()
+            self.sessions.save(self.session_key, self._browser_state())
+            self._logged_in_here()
+
+    @property
+    def session_key(self):
+        # Logins are per store
+        return self.id if self.store is None else "%s@%s" % (self.id, self.store)
+
+    def _use_store(self, store):
+        if store != self.store:
+            self.store = store
+            self.login()
+
+    def _menu(self, store):
+        # Fingerprint of the store's menu, or one of its own if the vendor can't tell us what's on it
+        if len(self.stores) == 1:
+            return None
+        text = wrapped_execute(self._menu_text)
+        return md5(text.encode("utf-8")).hexdigest() if text else "store-%s" % store
+
+    def _resume(self):
+        state = self.sessions.load(self.session_key)
+        if state is None:
+            return False
+        warm = self.session_key in getattr(self.web_driver, "logins", ())
+        if not warm:
+            self._restore(state) # Fresh browser, bring the saved login over
+        if self._logged_in(state["url"]):
+            registry.inc("scrape_logins_reused_total", vendor=self.id, source="browser" if warm else "saved")
+            self._logged_in_here()
+            return True
+        logging.info("Session for %s has expired, logging in again", self.id)
+        registry.inc("scrape_logins_expired_total", vendor=self.id)
+        getattr(self.web_driver, "logins", set()).discard(self.session_key)
+        self.sessions.discard(self.session_key)
+        return False
+
+    def _browser_state(self):
+        # Everything a login leaves behind in the browser, for the current site
+        local_storage = self._script("return JSON.stringify(window.localStorage)")
+        return {
+            "url": self.web_driver.current_url,
+            "cookies": self.web_driver.get_cookies(),
+            "local_storage": json.loads(local_storage) if local_storage else {}
+        }
+
+    def _restore(self, state):
+        # Cookies can only be set for the site we're on, so go there first
+        self._get_page(state["url"])
+        for cookie in state["cookies"]:
+            self.web_driver.add_cookie(dict(
+                (key, value) for key, value in cookie.iteritems()
+                if key in ["name", "value", "path", "domain", "secure", "httpOnly", "expiry"]
+            ))
+        for key, value in state["local_storage"].iteritems():
+            self._script("window.localStorage.setItem(%s, %s)" % (json.dumps(key), json.dumps(value)))
+
+    def _logged_in_here(self):
+        getattr(self.web_driver, "logins", set()).add(self.session_key)
+
+    def work_units(self):
+        # Independent (phase, (stores, menu, unit)) pairs. Each can be scraped on any logged in session. Stores that
+        # share a menu are scraped once, at the first of them, and its products list them all
+        units, menus = [], {}
+        for store in self.stores:
+            self._use_store(store)
+            menu = self._menu(store)
+            if menu in menus:
+                menus[menu].append(store)
+                registry.inc("scrape_stores_shared_total", vendor=self.id)
+                continue
+            stores = menus[menu] = [store] # Filled in as we find more stores with the same menu
+            units += [("pizzas", (stores, menu, unit)) for unit in self._pizza_units()]
+            units += [("sides", (stores, menu, unit)) for unit in self._side_units()]
+        return units
+
+    def scrape_unit(self, phase, unit):
+        # Returns how many products the unit gave us
+        stores, menu, unit = unit
+        self._use_store(stores[0])
+        self.tags = {"stores": stores, "menu": menu} if stores[0] is not None else {}
+        self.phase, self.produced = phase, 0
+        if phase == "pizzas":
+            self._get_pizzas(unit)
+        else:
+            self._get_sides(unit)
+        return self.produced
+
     def parse(self):
-        self._login()
-        wrapped_execute(self._get_pizzas)
-        wrapped_execute(self._get_sides)
+        # Scrape everything on this session, returning the units that failed or found nothing
+        self.login()
+        return [
+            (phase, unit) for phase, unit in self.work_units() if not wrapped_execute(self.scrape_unit, phase, unit)
+        ]
+
+    def _pizza_units(self):
+        # Override to split pizzas up by category, size page etc.
+        return [None]
+
+    def _side_units(self):
+        return [None]
 
     #### Implement ####
 
@@ -75,12 +231,20 @@ class Vendor(Parser):
         """ Login to site, set address etc. """
         pass
 
+    def _menu_text(self):
+        """ Everything on the logged in store's menu that differs between stores, names and prices. Optional """
+        return None
+
+    def _logged_in(self, url):
+        """ Whether the browser is still logged in, url is where the last login ended up. Needs reuse_login """
+        return False
+
     @abc.abstractmethod
-    def _get_pizzas(self):
-        """ Get list of Pizzas """
+    def _get_pizzas(self, unit):
+        """ Get list of Pizzas for a unit from _pizza_units """
         pass
 
     @abc.abstractmethod
-    def _get_sides(self):
-        """ Get list of Sides """
+    def _get_sides(self, unit):
+        """ Get list of Sides for a unit from _side_units """
         pass
\ No newline at end of file
@@ -0,0 +1,150 @@
+import logging
+from threading import Lock
+from time import time
+
+from utils import BadArgument, float_to_two_places
+
+class MealOptimiser(object):
+    """
+    Cheapest pizza and sides order from a single vendor that feeds N people. Solved as a covering knapsack over an
+    in memory snapshot of the catalogue, with dominated pizzas pruned and cost tables memoised per vendor
+    """
+    TIME_BUDGET = 0.05 # Seconds, after which we finish greedily rather than optimally
+    MAX_PEOPLE = 100
+    STALE_SECONDS = 60 # Longest a snapshot is kept after products were written live, rather than rebuilt per insert
+
+    def __init__(self, db, slices_per_person):
+        self.db = db
+        self.slices_per_person = slices_per_person
+        self.lock = Lock()
+        self.snapshot = None # Vendor -> pruned pizzas and cheapest side of each type
+        self.built = 0 # When the snapshot was taken
+        self.stale = False # Products written live since
+        self.tables = {} # Vendor -> (cost, choice) per number of slices, optimal so far
+
+    #### Listener ####
+
+    def on_insert(self, collection_name, document):
+        if collection_name in ["pizza", "sides"]:
+            self.stale = True
+
+    def on_reset(self, collection_name):
+        if collection_name in ["pizza", "sides"]:
+            with self.lock:
+                self.snapshot = None
+
+    #### Solve ####
+
+    def optimise(self, people, budget=None, vendor=None, sides=None):
+        try:
+            people = int(people)
+            budget = float(budget) if budget is not None else None
+        except ValueError:
+            raise BadArgument("People must be a whole number and budget a number")
+        if not 0 < people <= self.MAX_PEOPLE:
+            raise BadArgument("People must be between 1 and %s" % self.MAX_PEOPLE)
+
+        with self.lock:
+            snapshot = self._snapshot()
+            start = time() # The time budget is for solving, not for a snapshot rebuild
+            best = None
+            for vendor_id in ([vendor] if vendor else sorted(snapshot)):
+                meal = self._solve(
+                    vendor_id, snapshot.get(vendor_id), people * self.slices_per_person, budget, sides or [],
+                    start + self.TIME_BUDGET
+                )
+                if meal and (best is None or meal["price"] < best["price"]):
+                    best = meal
+
+        if best:
+            best["people"] = people
+            best["elapsed_ms"] = float_to_two_places((time() - start) * 1000)
+        return best
+
+    def _solve(self, vendor_id, menu, slices, budget, side_types, deadline):
+        if not menu or not menu["pizzas"]:
+            return None
+
+        # Sides don't interact with pizzas, so the cheapest of each requested type is optimal
+        chosen_sides = []
+        for side_type in side_types:
+            side_type = side_type.lower()
+            if side_type not in menu["sides"]:
+                return None
+            chosen_sides.append(menu["sides"][side_type])
+        sides_price = sum(side["price"] for side in chosen_sides)
+        if budget is not None and sides_price > budget:
+            return None
+
+        pizzas, optimal = self._cover(vendor_id, menu["pizzas"], slices, deadline)
+        price = float_to_two_places(sides_price + sum(pizza["price"] for pizza in pizzas))
+        if budget is not None and price > budget:
+            return None
+
+        return {
+            "vendor": vendor_id,
+            "price": price,
+            "slices": sum(pizza["slices"] for pizza in pizzas),
+            "pizzas": pizzas,
+            "sides": chosen_sides,
+            "optimal": optimal
+        }
+
+    def _cover(self, vendor_id, pizzas, slices, deadline):
+        # Cheapest multiset of pizzas with at least this many slices. cost[s] = min(price + cost[s - slices])
+        cost, choice = self.tables.setdefault(vendor_id, ([0.0], [None]))
+        optimal = True
+        while len(cost) <= slices:
+            if time() > deadline:
+                optimal = False
+                break
+            needed = len(cost)
+            best = None
+            for index, pizza in enumerate(pizzas):
+                candidate = pizza["price"] + cost[max(0, needed - pizza["slices"])]
+                if best is None or candidate < best[0]:
+                    best = (candidate, index)
+            cost.append(best[0])
+            choice.append(best[1])
+
+        # Out of time, so top up with the best value pizza until the memoised table can take over
+        order = []
+        if not optimal:
+            value = min(pizzas, key=lambda pizza: pizza["price"] / pizza["slices"])
+            while slices >= len(cost):
+                order.append(value)
+                slices -= value["slices"]
+            logging.info("Optimiser ran out of time for %s, topped up greedily" % vendor_id)
+
+        while slices > 0:
+            pizza = pizzas[choice[slices]]
+            order.append(pizza)
+            slices -= pizza["slices"]
+        return order, optimal
+
+    def _snapshot(self):
+        if self.snapshot is None or (self.stale and time() - self.built > self.STALE_SECONDS):
+            self.built, self.stale = time(), False
+            snapshot = {}
+            for pizza in self.db.all("pizza"):
+                if pizza.get("slices") > 0 and pizza.get("price") > 0:
+                    snapshot.setdefault(pizza["vendor"], {"pizzas": [], "sides": {}})["pizzas"].append(pizza)
+            for side in self.db.all("sides"):
+                sides = snapshot.setdefault(side["vendor"], {"pizzas": [], "sides": {}})["sides"]
+                side_type = (side["type"] or "").lower() # Vendors don't agree on case, "Dessert" vs "dessert"
+                if side_type not in sides or side["price"] < sides[side_type]["price"]:
+                    sides[side_type] = side
+            for menu in snapshot.values():
+                menu["pizzas"] = self._prune(menu["pizzas"])
+            self.snapshot = snapshot
+            self.tables = {}
+        return self.snapshot
+
+    @staticmethod
+    def _prune(pizzas):
+        # Drop any pizza beaten by one with at least as many slices for no more money
+        pruned = []
+        for pizza in sorted(pizzas, key=lambda pizza: (-pizza["slices"], pizza["price"])):
+            if not pruned or pizza["price"] < pruned[-1]["price"]:
+                pruned.append(pizza)
+        return pruned
@@ -0,0 +1,81 @@
+import logging
+from threading import Lock
+
+from metrics import registry
+from refinery import parse_price
+
+class PriceMatrix(object):
+    """
+    A vendor's crust surcharges per size, learned from products where every crust was priced. Once a size's table has
+    held for LEARN_SCANS products in a row, only the base crust and one rotating sample crust need clicking, the rest
+    are base price plus surcharge. A sample that disagrees throws the size's table away and the product is priced in
+    full again
+    """
+    LEARN_SCANS = 2
+    TOLERANCE = 0.005
+
+    def __init__(self, vendor_id):
+        self.vendor_id = vendor_id
+        self.lock = Lock() # Shared by every session of the vendor
+        self.tables = {} # Size -> {"base": crust, "surcharges": {crust: surcharge}, "scans": products agreeing}
+        self.rotation = {} # Size -> index of the next crust to sample
+
+    def to_price(self, size, crusts):
+        # Indexes of the crusts that need clicking
+        with self.lock:
+            if len(crusts) < 3 or not self._trusted(size, crusts):
+                return range(len(crusts))
+            sample = 1 + self.rotation.get(size, 0) % (len(crusts) - 1)
+            self.rotation[size] = sample
+            return [0, sample]
+
+    def infer(self, size, crusts, clicked):
+        # Prices of every crust from the clicked ones {index: price}, or None if they aren't enough or don't agree
+        prices = self._floats(clicked)
+        if prices is None or len(prices) == len(crusts):
+            return None
+        with self.lock:
+            if not self._trusted(size, crusts):
+                return None
+            surcharges = self.tables[size]["surcharges"]
+            expected = [prices[0] + surcharges[crust] for crust in crusts]
+            for index, price in prices.iteritems():
+                if abs(expected[index] - price) > self.TOLERANCE:
+                    logging.info(
+                        "%s %s %s priced %s, expected %s. Relearning its surcharges",
+                        self.vendor_id, size, crusts[index], price, expected[index]
+                    )
+                    registry.inc("scrape_price_matrix_misses_total", vendor=self.vendor_id)
+                    del self.tables[size]
+                    return None
+        return [round(price, 2) for price in expected]
+
+    def learn(self, size, crusts, prices):
+        # Every crust of a product priced
+        prices = self._floats(dict(enumerate(prices)))
+        if prices is None or not crusts:
+            return
+        surcharges = dict((crust, prices[index] - prices[0]) for index, crust in enumerate(crusts))
+        with self.lock:
+            table = self.tables.get(size)
+            if table and table["base"] == crusts[0] and all(
+                abs(table["surcharges"][crust] - surcharge) <= self.TOLERANCE
+                for crust, surcharge in surcharges.iteritems() if crust in table["surcharges"]
+            ):
+                table["surcharges"].update(surcharges)
+                table["scans"] += 1
+            else:
+                self.tables[size] = {"base": crusts[0], "surcharges": surcharges, "scans": 1}
+
+    def _trusted(self, size, crusts):
+        table = self.tables.get(size)
+        return bool(table) and table["scans"] >= self.LEARN_SCANS and table["base"] == crusts[0] and all(
+            crust in table["surcharges"] for crust in crusts
+        )
+
+    @staticmethod
+    def _floats(prices):
+        prices = dict((index, parse_price(price)) for index, price in prices.iteritems())
+        if any(type(price) not in [int, long, float] for price in prices.itervalues()):
+            return None # Can't do sums with it, price them all
+        return prices
@@ -0,0 +1,130 @@
+import logging
+import os
+import cPickle as pickle
+from Queue import Queue, Full
+from threading import Lock
+
+from metrics import registry
+
+class ProductQueue(Queue):
+    """
+    Bounded queue between the Collector and the Keeper. Producers block for up to `backpressure` seconds while it's
+    full, then spill to an on disk journal, which is fed back in as the Keeper catches up and replayed on restart.
+    A replayed generation begun by a Collector that died before committing it is dropped, its products are written
+    to the live catalogue, or the Keeper would wait for that commit forever
+    """
+
+    def __init__(self, maxsize, journal=None, backpressure=5):
+        Queue.__init__(self, maxsize)
+        self.journal = journal
+        self.backpressure = backpressure
+        self.journal_lock = Lock()
+        self.spilled = 0 # Products in the journal we haven't read back yet
+        self.orphans = set() # (generation, source) of begin markers replayed without a commit
+        self.high_water = 0
+        if journal:
+            self._replay()
+
+    def put(self, item, block=True, timeout=None):
+        if self.journal and self.spilled:
+            self._spill(item) # Keep behind what's already spilled
+        elif self.journal:
+            try:
+                Queue.put(self, item, True, self.backpressure)
+            except Full:
+                self._spill(item)
+        else:
+            Queue.put(self, item, block, timeout)
+        self._record()
+
+    def get(self, block=True, timeout=None):
+        self._refill()
+        item = Queue.get(self, block, timeout)
+        self._record()
+        return item
+
+    #### Journal ####
+
+    def _spill(self, item):
+        with self.journal_lock:
+            with open(self.journal, "ab") as f:
+                pickle.dump(item, f, pickle.HIGHEST_PROTOCOL)
+            self.spilled += 1
+        registry.inc("product_queue_spilled_total")
+
+    def _refill(self):
+        # Move spilled products back into the queue while there's room
+        if not self.spilled:
+            return
+        with self.journal_lock:
+            with open(self.journal, "rb") as f:
+                offset = self._read_offset()
+                f.seek(offset)
+                while self.spilled:
+                    item = pickle.load(f)
+                    if self._orphaned(item):
+                        logging.warning("Dropping %s, its Collector died before committing it", item)
+                        registry.inc("product_queue_orphans_dropped_total")
+                    else:
+                        try:
+                            Queue.put(self, item, False)
+                        except Full:
+                            break # Producers got there first, read it again next time
+                    offset = f.tell()
+                    self.spilled -= 1
+            if self.spilled:
+                self._write_offset(offset)
+            else:
+                os.remove(self.journal)
+                self._write_offset(0)
+
+    def _replay(self):
+        # Count products left in the journal by a previous run, they'll be fed in as usual
+        if not os.path.exists(self.journal):
+            self._write_offset(0)
+            return
+        begun = set()
+        with open(self.journal, "rb") as f:
+            f.seek(self._read_offset())
+            while True:
+                try:
+                    item = pickle.load(f)
+                except EOFError:
+                    break
+                except Exception:
+                    logging.error("Truncated product journal %s", self.journal, exc_info=True)
+                    break
+                self.spilled += 1
+                if getattr(item, "event", None) == "begin":
+                    begun.add((item.generation, item.source))
+                elif getattr(item, "event", None) == "commit":
+                    begun.discard((item.generation, item.source))
+        self.orphans = begun # Everyone that wrote it is gone, so nothing will commit these now
+        if not self.spilled:
+            os.remove(self.journal)
+            self._write_offset(0)
+        logging.info("Replaying %s products from %s", self.spilled, self.journal)
+
+    def _orphaned(self, item):
+        return getattr(item, "event", None) == "begin" and (item.generation, item.source) in self.orphans
+
+    def _read_offset(self):
+        try:
+            with open(self.journal + ".offset", "r") as f:
+                return int(f.read() or 0)
+        except IOError:
+            return 0
+
+    def _write_offset(self, offset):
+        with open(self.journal + ".offset.tmp", "w") as f:
+            f.write(str(offset))
+        os.rename(self.journal + ".offset.tmp", self.journal + ".offset")
+
+    #### Metrics ####
+
+    def _record(self):
+        depth = self.qsize()
+        self.high_water = max(self.high_water, depth)
+        registry.set("product_queue_depth", depth)
+        registry.set("product_queue_high_water", self.high_water)
+        registry.set("product_queue_journal", self.spilled)
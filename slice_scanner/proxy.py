@@ -0,0 +1,243 @@
+import hashlib
+import httplib
+import json
+import logging
+import os
+import re
+import select
+import socket
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from threading import Thread
+from time import time
+from urlparse import urlsplit
+
+from metrics import registry
+
+# Resource type by file extension, for requests whose Accept header doesn't say
+EXTENSIONS = {
+    "image": ["png", "jpg", "jpeg", "gif", "svg", "webp", "ico", "bmp"],
+    "font": ["woff", "woff2", "ttf", "otf", "eot"],
+    "media": ["mp4", "webm", "mp3", "ogg", "wav"],
+    "script": ["js"],
+    "stylesheet": ["css"]
+}
+STATIC = ["image", "font", "media", "script", "stylesheet"] # Worth caching between cycles
+HOP_BY_HOP = [
+    "connection", "keep-alive", "proxy-connection", "proxy-authorization", "proxy-authenticate", "te", "trailers",
+    "transfer-encoding", "upgrade"
+]
+
+def resource_type(url, accept=""):
+    extension = os.path.splitext(urlsplit(url).path)[1].lstrip(".").lower()
+    for name, extensions in EXTENSIONS.iteritems():
+        if extension in extensions:
+            return name
+    if accept.startswith("image/"):
+        return "image"
+    if accept.startswith("text/css"):
+        return "stylesheet"
+    return "document"
+
+def raw_headers(message):
+    # (name, value) per header line as sent, so repeated headers (Set-Cookie) aren't comma joined into one
+    headers = []
+    for line in message.headers:
+        if line[:1] in " \t" and headers: # Folded continuation of the previous header
+            headers[-1] = (headers[-1][0], headers[-1][1] + " " + line.strip())
+        elif ":" in line:
+            key, value = line.split(":", 1)
+            headers.append((key.strip(), value.strip()))
+    return headers
+
+class AssetCache(object):
+    """
+    Static assets on disk, one body and one metadata file per URL. Kept for as long as the response said, or
+    DEFAULT_SECONDS if it didn't say
+    """
+    DEFAULT_SECONDS = 24 * 60 * 60
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def get(self, url):
+        # (status, headers, body), or None if missing or stale
+        path = self._path(url)
+        try:
+            with open(path + ".json") as f:
+                meta = json.load(f)
+            if meta["expires"] < time():
+                return None
+            with open(path + ".body", "rb") as f:
+                return meta["status"], meta["headers"], f.read()
+        except (IOError, ValueError, KeyError):
+            return None
+
+    def put(self, url, status, headers, body):
+        lifetime = self._lifetime(dict((key.lower(), value) for key, value in headers))
+        if status != 200 or not lifetime:
+            return
+        path = self._path(url)
+        for suffix, data in [(".body", body), (".json", json.dumps({
+            "status": status, "headers": headers, "expires": time() + lifetime
+        }))]:
+            temporary = "%s%s.%s.tmp" % (path, suffix, os.getpid())
+            with open(temporary, "wb") as f:
+                f.write(data)
+            os.rename(temporary, path + suffix)
+
+    def _lifetime(self, headers):
+        cache_control = headers.get("cache-control", "").lower()
+        if any(directive in cache_control for directive in ["no-store", "no-cache", "private"]):
+            return 0
+        max_age = re.search(r"max-age=(\d+)", cache_control)
+        return int(max_age.group(1)) if max_age else self.DEFAULT_SECONDS
+
+    def _path(self, url):
+        return os.path.join(self.directory, hashlib.sha1(url).hexdigest())
+
+class ProxyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.0" # One request per connection, no keep-alive to manage
+    TIMEOUT = 30
+
+    def do_GET(self):
+        self._forward()
+
+    do_HEAD = do_POST = do_PUT = do_DELETE = do_OPTIONS = do_GET
+
+    def do_CONNECT(self):
+        # HTTPS is tunnelled as is, so all we can do is refuse blocked hosts. Nothing inside is type blocked, cached or
+        # counted per request, so its bytes are counted apart as unfiltered
+        proxy, host, port = self.server.proxy, self.path.split(":")[0], int(self.path.split(":")[1])
+        if proxy.blocked(host):
+            proxy.count("blocked")
+            self.send_error(403)
+            return
+        try:
+            upstream = socket.create_connection((host, port), self.TIMEOUT)
+        except socket.error:
+            self.send_error(502)
+            return
+        proxy.count("tunnelled")
+        self.send_response(200, "Connection established")
+        self.end_headers()
+        sockets = [self.connection, upstream]
+        try:
+            while True:
+                readable, writable, failed = select.select(sockets, [], sockets, self.TIMEOUT)
+                if failed or not readable:
+                    break
+                for source in readable:
+                    data = source.recv(65536)
+                    if not data:
+                        return
+                    (upstream if source is self.connection else self.connection).sendall(data)
+                    if source is upstream:
+                        proxy.count_bytes("tunnel", len(data))
+        finally:
+            upstream.close()
+
+    def _forward(self):
+        proxy, url = self.server.proxy, self.path
+        parts = urlsplit(url)
+        kind = resource_type(url, self.headers.get("Accept", ""))
+        if proxy.blocked(parts.hostname, kind):
+            proxy.count("blocked", kind)
+            self.send_error(403)
+            return
+        cacheable = self.command == "GET" and kind in STATIC
+        cached = proxy.cache.get(url) if cacheable and proxy.cache else None
+        if cached:
+            proxy.count("cached", kind)
+            proxy.count_bytes("cache", len(cached[2]))
+            self._respond(*cached)
+            return
+
+        headers = dict((key, value) for key, value in self.headers.items() if key.lower() not in HOP_BY_HOP)
+        length = int(self.headers.get("Content-Length", 0))
+        connection_type = httplib.HTTPSConnection if parts.scheme == "https" else httplib.HTTPConnection
+        try:
+            connection = connection_type(parts.netloc, timeout=self.TIMEOUT)
+            path = parts.path or "/"
+            connection.request(
+                self.command, path + ("?" + parts.query if parts.query else ""),
+                self.rfile.read(length) if length else None, headers
+            )
+            response = connection.getresponse()
+            body = response.read()
+            connection.close()
+        except (socket.error, httplib.HTTPException):
+            logging.debug("Proxy couldn't fetch %s", url, exc_info=True)
+            self.send_error(502)
+            return
+        response_headers = [(key, value) for key, value in raw_headers(response.msg) if key.lower() not in HOP_BY_HOP]
+        proxy.count("fetched", kind)
+        proxy.count_bytes("upstream", len(body))
+        if cacheable and proxy.cache:
+            proxy.cache.put(url, response.status, [
+                (key, value) for key, value in response_headers if key.lower() != "set-cookie"
+            ], body)
+        self._respond(response.status, response_headers, body)
+
+    def _respond(self, status, headers, body):
+        # Status line by hand, send_response would add a second Server and Date to the upstream ones
+        self.wfile.write("%s %d %s\r\n" % (
+            self.protocol_version, status, self.responses.get(status, ("",))[0]
+        ))
+        for key, value in headers:
+            if key.lower() != "content-length":
+                self.send_header(key, value)
+        self.send_header("Content-Length", len(body))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # Every asset would be a line
+
+class ThreadingProxyServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class ScrapeProxy(object):
+    """
+    Local HTTP proxy the Collector's browsers go through. Refuses resource types and domains the parsers don't need,
+    serves static assets from an on disk cache between cycles, and counts requests and bytes against whichever vendor
+    is being scraped. HTTPS vendors are only tunnelled, so for them it can refuse blocked domains and nothing else
+    """
+
+    def __init__(self, cache_dir=None, block_types=(), block_domains=(), port=0):
+        self.cache = AssetCache(cache_dir) if cache_dir else None
+        self.block_types = set(block_types)
+        self.block_domains = [domain.lower() for domain in block_domains]
+        self.vendor = None # Being scraped, for the metrics
+        self.server = ThreadingProxyServer(("127.0.0.1", port), ProxyHandler)
+        self.server.proxy = self
+
+    @property
+    def address(self):
+        return "%s:%s" % self.server.server_address
+
+    def start(self):
+        server_thread = Thread(target=self.server.serve_forever)
+        server_thread.daemon = True
+        server_thread.start()
+        logging.info("Scrape proxy on %s", self.address)
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def blocked(self, host, kind=None):
+        host = (host or "").lower()
+        if kind in self.block_types:
+            return True
+        return any(host == domain or host.endswith("." + domain) for domain in self.block_domains)
+
+    def count(self, outcome, kind="tunnel"):
+        registry.inc("scrape_proxy_requests_total", vendor=self.vendor, outcome=outcome, type=kind)
+
+    def count_bytes(self, source, length):
+        registry.inc("scrape_proxy_bytes_total", length, vendor=self.vendor, source=source)
@@ -0,0 +1,101 @@
+import logging
+import re
+from time import time
+
+from objects.pizza import Pizza
+from objects.side import Side
+from utils import wrapped_execute
+from metrics import registry
+
+PRODUCTS = {"Pizza": Pizza, "Side": Side}
+FLOAT = re.compile(r"\d+.\d+")
+INT = re.compile(r"\d+")
+UNTOUCHED = ["img", "stores", "menu"] # Fields left exactly as scraped
+
+class RawProduct(object):
+    """
+    Strings as a vendor scraped them, on their way to the Keeper. Turned into a product there by refine(), off the
+    scraping thread
+    """
+
+    def __init__(self, product, vendor, phase, fields, split_toppings=None):
+        self.product = product # Name of the product class
+        self.vendor = vendor
+        self.phase = phase
+        self.fields = fields
+        self.split_toppings = split_toppings # The vendor's, for toppings scraped as a description
+
+    def __repr__(self):
+        return "Raw %s from %s: %s" % (self.product, self.vendor, self.fields.get("name"))
+
+#### Cleaning ####
+
+def parse_price(value):
+    # "EUR 12.99", "12.99" or 12.99 -> 12.99, None if there's no number in it
+    if type(value) not in [str, unicode]:
+        return value
+    match = FLOAT.search(value) or INT.search(value)
+    return float(match.group()) if match else None
+
+_punified = {}
+
+def punify(value):
+    # Drop anything that isn't ASCII. Menus repeat the same few strings, so remember them
+    if value not in _punified:
+        _punified[value] = value.encode("punycode").split("-")[0]
+    return _punified[value]
+
+def clean(fields, split_toppings=None):
+    fields = dict(fields)
+    fields["price"] = parse_price(fields.get("price"))
+    if type(fields.get("toppings")) in [str, unicode]:
+        # The vendor's own splitter, or plain commas for a vendor without one
+        fields["toppings"] = split_toppings(fields["toppings"]) if split_toppings else fields["toppings"].split(",")
+    for key, value in fields.iteritems():
+        if key in UNTOUCHED:
+            continue
+        if type(value) in [str, unicode]:
+            fields[key] = punify(value)
+        elif type(value) is list:
+            fields[key] = [punify(item) if type(item) in [str, unicode] else item for item in value]
+    return fields
+
+def refine(raw):
+    # Product from a raw record, or None if it doesn't make one
+    return wrapped_execute(lambda: PRODUCTS[raw.product](**clean(raw.fields, raw.split_toppings)))
+
+#### Stage ####
+
+class Refinery(object):
+    """
+    Refines the raw records in a batch from the product queue, leaving everything else (products, generation markers)
+    where it was. With workers, a batch is spread over a pool of processes
+    """
+
+    def __init__(self, workers=0):
+        self.workers = workers
+        self.pool = None # Started on first use, in the Keeper's thread
+
+    def refine(self, items):
+        positions = [index for index, item in enumerate(items) if type(item) is RawProduct]
+        if not positions:
+            return items
+        started, items = time(), list(items)
+        raw = [items[index] for index in positions]
+        for index, record, product in zip(positions, raw, self._map(raw)):
+            items[index] = product
+            labels = {"vendor": record.vendor, "phase": record.phase, "product": record.product}
+            registry.inc("scrape_products_total" if product else "scrape_product_errors_total", **labels)
+        registry.observe("scrape_refine_batch_seconds", time() - started)
+        return items
+
+    def _map(self, raw):
+        if self.workers and len(raw) > 1:
+            if self.pool is None:
+                from multiprocessing import Pool
+                self.pool = Pool(self.workers)
+            try:
+                return self.pool.map(refine, raw)
+            except Exception:
+                logging.error("Refinery pool failed, refining here", exc_info=True)
+        return [refine(record) for record in raw]
@@ -0,0 +1,18 @@
+import logging
+
+class Relay(object):
+    """
+    Feeds products scraped in other processes into the local product queue
+    """
+
+    def __init__(self, source, destination):
+        self.source = source
+        self.destination = destination
+
+    def run(self):
+        logging.info("Relay Running")
+        while True:
+            try:
+                self.destination.put(self.source.get())
+            except Exception:
+                logging.error("Error relaying product", exc_info=True)
@@ -0,0 +1,67 @@
+import logging
+import time
+from crontab import CronTab
+from breaker import CircuitBreaker, over_budget
+from keeper import PHASE_COLLECTIONS
+
+class Scheduler(object):
+    """
+    Enqueues a job per vendor on the scrape schedule, for distributed workers to pick up
+    """
+    POLL_SECONDS = 30
+    JOB_HISTORY_SECONDS = 7 * 24 * 60 * 60
+
+    def __init__(self, frequency, jobs, vendor_ids, db):
+        self.cron = CronTab(frequency)
+        self.jobs = jobs
+        self.vendor_ids = vendor_ids
+        self.db = db
+        self.cycle = None # Cycle still being scraped
+        self.breakers = dict((vendor_id, CircuitBreaker(vendor_id)) for vendor_id in vendor_ids)
+
+    def run(self):
+        logging.info("Scheduler Running")
+        next_cycle = 0
+        while True:
+            if time.time() >= next_cycle:
+                self._schedule()
+                next_cycle = time.time() + self.cron.next()
+            self._check_cycle()
+            time.sleep(min(self.POLL_SECONDS, max(0, next_cycle - time.time())))
+
+    def _schedule(self):
+        if self.cycle is not None:
+            logging.info("Skipping cycle, %s still scraping", self.cycle)
+            return
+        cycle = int(time.time())
+        self.db.begin_generation(cycle)
+        for vendor_id in self.vendor_ids:
+            if self.jobs.outstanding(vendor_id):
+                logging.info("Skipping %s, still scraping", vendor_id)
+                continue
+            if not self.breakers[vendor_id].allow():
+                logging.warning("Skipping %s, its circuit is open", vendor_id)
+                continue
+            self.jobs.enqueue(vendor_id, cycle=cycle)
+        self.cycle = cycle
+        self.jobs.purge(self.JOB_HISTORY_SECONDS)
+
+    def _check_cycle(self):
+        # Workers write the cycle's generation, it goes live once they're all done
+        if self.cycle is not None and not self.jobs.outstanding(cycle=self.cycle):
+            logging.info("Scrape cycle %s finished", self.cycle)
+            self.db.commit_generation(self.cycle, incomplete=self._record_outcomes(self.cycle))
+            self.cycle = None
+
+    def _record_outcomes(self, cycle):
+        # Failed jobs have used up their attempts. Trip the breakers of broken vendors, and keep the live products
+        # of the units that failed
+        incomplete = []
+        for vendor_id, outcome in self.jobs.summary(cycle).iteritems():
+            failed = outcome["failed"]
+            if None in failed or over_budget(len(failed), outcome["total"] - 1): # Less the vendor job
+                self.breakers[vendor_id].failure()
+            else:
+                self.breakers[vendor_id].success()
+            incomplete += [(vendor_id, PHASE_COLLECTIONS[phase]) for phase in set(failed) if phase in PHASE_COLLECTIONS]
+        return incomplete
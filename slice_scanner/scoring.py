@@ -0,0 +1,60 @@
+from utils import float_to_two_places
+
+# Pizza features a score can be built from, read from a serialised pizza
+features = {
+    "area": lambda pizza: pizza["area"],
+    "diameter": lambda pizza: pizza["diameter"],
+    "price": lambda pizza: pizza["price"],
+    "slices": lambda pizza: pizza["slices"],
+    "serves": lambda pizza: pizza["serves"],
+    "toppings": lambda pizza: len(pizza["toppings"]) + 1, # Count the cheese
+    "area_per_slice": lambda pizza: pizza["area_per_slice"],
+    "cost_per_slice": lambda pizza: pizza["cost_per_slice"],
+    "cost_psi": lambda pizza: pizza["cost_psi"],
+}
+
+# Named scoring profiles. Weights are exponents, so {"area": 1, "price": -1} scores area / price
+profiles = {
+    "value": {"area": 1, "price": -1},
+    "feed_the_family": {"slices": 1, "area_per_slice": 1, "price": -1},
+    "topping_heavy": {"area": 1, "toppings": 2, "price": -1},
+}
+
+def profile_field(profile):
+    # Precomputed, indexed field holding a named profile's score
+    return "score_%s" % profile
+
+def parse_weights(weights):
+    # Validate a custom weight vector, e.g. {"cost_per_slice": -1, "toppings": 0.5}
+    if type(weights) is not dict or not weights:
+        raise ValueError("Score weights must be a non empty object")
+    for feature, weight in weights.iteritems():
+        if feature not in features:
+            raise ValueError("Unknown score feature [%s]" % feature)
+        if type(weight) not in [int, float]:
+            raise ValueError("Invalid weight for [%s]" % feature)
+    return weights
+
+def feature_columns(pizzas, names):
+    # Column per feature, row per pizza
+    return dict((name, [features[name](pizza) for pizza in pizzas]) for name in names)
+
+def score_columns(columns, weights, rows):
+    # Score every row at once, one pass per weighted feature
+    scores = [1.0] * rows
+    for feature, weight in weights.iteritems():
+        scores = [score * _power(value, weight) for score, value in zip(scores, columns[feature])]
+    return [float_to_two_places(score * 10) for score in scores]
+
+def score_pizza(pizza, weights):
+    return score_columns(feature_columns([pizza], weights.keys()), weights, 1)[0]
+
+def rank(pizzas, weights, sort_dir=-1):
+    # Order pizzas by a custom weight vector, returning (score, pizza) pairs
+    scores = score_columns(feature_columns(pizzas, weights.keys()), weights, len(pizzas))
+    return sorted(zip(scores, pizzas), key=lambda scored: scored[0], reverse=sort_dir == -1)
+
+def _power(value, weight):
+    if not value or value <= 0:
+        return 0.0
+    return float(value) ** weight
@@ -0,0 +1,140 @@
+import logging
+import math
+import re
+from bisect import bisect_left, insort
+from collections import defaultdict
+from threading import Lock
+
+TOKEN = re.compile(r"[a-z0-9]+")
+
+def tokenise(text):
+    return TOKEN.findall(text.lower()) if text else []
+
+class SearchIndex(object):
+    """
+    In memory inverted index over product text, kept up to date as the Keeper writes. Ranks with BM25 and
+    completes partially typed words from the sorted vocabulary
+    """
+    FIELDS = ["name", "description", "toppings", "type"]
+    K1 = 1.2
+    B = 0.75
+    MAX_EXPANSIONS = 50 # Vocabulary terms a partial word can expand to
+
+    def __init__(self, db, collection_names):
+        self.db = db
+        self.collection_names = collection_names
+        self.lock = Lock()
+        self.rebuild()
+
+    #### Listener ####
+
+    def on_insert(self, collection_name, document):
+        if collection_name in self.collection_names:
+            with self.lock:
+                self._add(collection_name, document)
+
+    def on_reset(self, collection_name):
+        if collection_name in self.collection_names:
+            self.rebuild(collection_name)
+
+    #### Query ####
+
+    def search(self, collection_name, text, prefix=True):
+        # Product hashes ranked best first. The last word is treated as partially typed when prefix is set
+        words = tokenise(text)
+        if not words:
+            return []
+        with self.lock:
+            terms = [[word] for word in words[:-1]]
+            terms.append(self._expand(words[-1]) if prefix else [words[-1]])
+
+            scores = defaultdict(float)
+            for expansions in terms:
+                for term in expansions:
+                    self._score_term(collection_name, term, scores)
+            return [key[1] for key in sorted(scores, key=scores.get, reverse=True)]
+
+    def complete(self, text, limit=10):
+        # Vocabulary completions for the last word, most common first
+        words = tokenise(text)
+        if not words:
+            return []
+        with self.lock:
+            expansions = self._expand(words[-1])
+            expansions.sort(key=lambda term: len(self.postings[term]), reverse=True)
+            stem = " ".join(words[:-1])
+            return [("%s %s" % (stem, term)).strip() for term in expansions[:limit]]
+
+    #### Internal ####
+
+    def rebuild(self, collection_name=None):
+        collection_names = [collection_name] if collection_name else self.collection_names
+        logging.info("Rebuilding search index for %s" % collection_names)
+        with self.lock:
+            if collection_name is None:
+                self.postings = defaultdict(dict) # Term -> (collection, hash) -> term frequency
+                self.lengths = {} # (collection, hash) -> document length
+                self.terms = {} # (collection, hash) -> terms, so updates can be unwound
+                self.vocabulary = [] # Sorted terms, for prefix completion
+                self.totals = defaultdict(int) # Collection -> total document length
+                self.counts = defaultdict(int) # Collection -> document count
+            else:
+                for key in [key for key in self.lengths if key[0] == collection_name]:
+                    self._discard(key)
+            for name in collection_names:
+                for document in self.db.all(name):
+                    self._add(name, document)
+
+    def _add(self, collection_name, document):
+        key = (collection_name, document["hash"])
+        self._discard(key)
+
+        words = []
+        for field in self.FIELDS:
+            value = document.get(field)
+            for text in (value if type(value) is list else [value]):
+                words.extend(tokenise(text))
+
+        frequencies = defaultdict(int)
+        for word in words:
+            frequencies[word] += 1
+        for term, frequency in frequencies.iteritems():
+            if term not in self.postings:
+                insort(self.vocabulary, term)
+            self.postings[term][key] = frequency
+        self.terms[key] = frequencies.keys()
+        self.lengths[key] = len(words)
+        self.totals[collection_name] += len(words)
+        self.counts[collection_name] += 1
+
+    def _discard(self, key):
+        if key not in self.lengths:
+            return
+        self.totals[key[0]] -= self.lengths.pop(key)
+        self.counts[key[0]] -= 1
+        for term in self.terms.pop(key):
+            del self.postings[term][key]
+            if not self.postings[term]:
+                del self.postings[term]
+                del self.vocabulary[bisect_left(self.vocabulary, term)]
+
+    def _expand(self, partial):
+        start = bisect_left(self.vocabulary, partial)
+        expansions = []
+        for term in self.vocabulary[start:start + self.MAX_EXPANSIONS]:
+            if not term.startswith(partial):
+                break
+            expansions.append(term)
+        return expansions
+
+    def _score_term(self, collection_name, term, scores):
+        postings = [(key, frequency) for key, frequency in self.postings.get(term, {}).iteritems()
+                    if key[0] == collection_name]
+        if not postings:
+            return
+        documents = self.counts[collection_name]
+        average_length = float(self.totals[collection_name]) / documents
+        idf = math.log(1 + (documents - len(postings) + 0.5) / (len(postings) + 0.5))
+        for key, frequency in postings:
+            norm = self.K1 * (1 - self.B + self.B * self.lengths[key] / average_length)
+            scores[key] += idf * frequency * (self.K1 + 1) / (frequency + norm)
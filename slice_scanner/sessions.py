@@ -0,0 +1,53 @@
+import json
+import logging
+import os
+from threading import Lock
+from time import time
+
+class SessionStore(object):
+    """
+    Browser state of each vendor after a login (cookies, local storage and the page we ended up on), saved so a fresh
+    browser can pick up where the last login left off rather than going through the vendor's forms again
+    """
+    MAX_AGE_SECONDS = 12 * 60 * 60 # Older than this and we log in again anyway
+
+    def __init__(self, directory, max_age=MAX_AGE_SECONDS):
+        self.directory = directory
+        self.max_age = max_age
+        self.lock = Lock()
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def save(self, vendor_id, state):
+        state = dict(state, saved=time())
+        path = self._path(vendor_id)
+        with self.lock:
+            with open(path + ".tmp", "w") as f:
+                json.dump(state, f)
+            os.rename(path + ".tmp", path)
+
+    def load(self, vendor_id):
+        # Saved state, without cookies that have since expired, or None if there's nothing recent enough
+        path = self._path(vendor_id)
+        with self.lock:
+            if not os.path.exists(path):
+                return None
+            try:
+                with open(path) as f:
+                    state = json.load(f)
+            except ValueError:
+                logging.error("Unreadable session %s", path, exc_info=True)
+                return None
+        if time() - state.get("saved", 0) > self.max_age:
+            return None
+        state["cookies"] = [cookie for cookie in state.get("cookies", []) if cookie.get("expiry", time()) >= time()]
+        return state if state["cookies"] or state.get("local_storage") else None
+
+    def discard(self, vendor_id):
+        # Restored, but the vendor didn't accept it
+        with self.lock:
+            if os.path.exists(self._path(vendor_id)):
+                os.remove(self._path(vendor_id))
+
+    def _path(self, vendor_id):
+        return os.path.join(self.directory, "%s.json" % vendor_id.lower().replace(" ", "_"))
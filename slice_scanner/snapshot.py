@@ -0,0 +1,243 @@
+import json
+import logging
+import mmap
+import os
+import struct
+from threading import Lock
+from time import time
+
+from utils import strip_dict
+
+MAGIC = "SLICECOL"
+VERSION = 1
+NUMERIC = ["price", "score", "diameter", "slices", "serves", "area", "area_per_slice", "cost_per_slice", "cost_psi"]
+ENCODED = ["vendor", "style", "base_style"] # Dictionary encoded, stored as codes into a list of values
+
+#### File ####
+
+def write_snapshot(path, collection, documents):
+    """
+    Columnar snapshot of a pizza collection: fixed width numeric columns, dictionary encoded strings and offset
+    encoded toppings, behind a JSON header. Written to a temporary file and renamed into place
+    """
+    numeric = dict((name, []) for name in NUMERIC)
+    codes = dict((key, []) for key in ENCODED + ["toppings"])
+    dictionaries = dict((key, {}) for key in ENCODED + ["toppings"])
+    offsets, hashes = [0], []
+    for document in documents:
+        for name in NUMERIC:
+            numeric[name].append(document.get(name))
+        for key in ENCODED:
+            codes[key].append(dictionaries[key].setdefault(document.get(key), len(dictionaries[key])))
+        for topping in document.get("toppings", []):
+            codes["toppings"].append(dictionaries["toppings"].setdefault(topping, len(dictionaries["toppings"])))
+        offsets.append(len(codes["toppings"]))
+        hashes.append(str(document["hash"]))
+
+    blobs = [("hash", "32s", hashes), ("toppings_offsets", "i", offsets)]
+    for key in ENCODED + ["toppings"]:
+        blobs.append((key, "i", codes[key]))
+    for name in NUMERIC:
+        values = numeric[name]
+        if any(type(value) not in [int, long, float] for value in values):
+            continue # Not on every pizza, leave it to Mongo
+        blobs.append((name, "q" if all(type(value) in [int, long] for value in values) else "d", values))
+
+    header = {
+        "collection": collection,
+        "rows": len(hashes),
+        "written": time(),
+        "dictionaries": dict(
+            (key, sorted(dictionary, key=dictionary.get)) for key, dictionary in dictionaries.iteritems()
+        ),
+        "columns": {}
+    }
+    body, offset = [], 0
+    for name, fmt, values in blobs:
+        data = _pad(struct.pack(_format(fmt, len(values)), *values))
+        header["columns"][name] = {"format": fmt, "offset": offset, "count": len(values)}
+        body.append(data)
+        offset += len(data)
+
+    header = _pad(json.dumps(header), " ")
+    temporary = "%s.%s.tmp" % (path, os.getpid())
+    with open(temporary, "wb") as f:
+        f.write(struct.pack("<8sII", MAGIC, VERSION, len(header)))
+        f.write(header)
+        for data in body:
+            f.write(data)
+    os.rename(temporary, path)
+
+def _pad(data, fill="\0"):
+    # Keep every column 8 byte aligned
+    return data + fill * (-len(data) % 8)
+
+def _format(fmt, count):
+    # A run of count values, strings are counted by length so repeat those
+    return "<" + fmt * count if fmt.endswith("s") else "<%s%s" % (count, fmt)
+
+class Column(object):
+    """
+    Fixed width values read straight out of the mapped file, nothing is copied until asked for
+    """
+
+    def __init__(self, buf, fmt, offset, count):
+        self.buf = buf
+        self.fmt = _format(fmt, 1)
+        self.run = _format(fmt, count)
+        self.offset = offset
+        self.count = count
+        self.width = struct.calcsize(self.fmt)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, row):
+        return struct.unpack_from(self.fmt, self.buf, self.offset + row * self.width)[0]
+
+    def values(self):
+        return struct.unpack_from(self.run, self.buf, self.offset)
+
+class Snapshot(object):
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) # Shared with every process mapping it
+        magic, version, header_length = struct.unpack_from("<8sII", self.buf, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a version %s snapshot: %s" % (VERSION, path))
+        header = json.loads(self.buf[16:16 + header_length])
+        self.collection = header["collection"]
+        self.rows = header["rows"]
+        self.dictionaries = header["dictionaries"]
+        self.columns = dict(
+            (name, Column(self.buf, column["format"], 16 + header_length + column["offset"], column["count"]))
+            for name, column in header["columns"].iteritems()
+        )
+
+    def distinct(self, key):
+        if key in self.dictionaries:
+            return [value for value in self.dictionaries[key] if value is not None]
+
+    def range(self, key):
+        if key in NUMERIC and key in self.columns and self.rows:
+            values = self.columns[key].values()
+            return {"max": max(values), "min": min(values)}
+
+    def select(self, query):
+        # Rows matching a product filter, or None if it uses something we can't answer
+        rows = range(self.rows)
+        for key, condition in strip_dict(query).iteritems():
+            operators = sorted(condition) if type(condition) is dict else None
+            if key in ENCODED and operators == ["$in"]:
+                wanted = set(self._codes(key, condition["$in"]))
+                codes = self.columns[key].values()
+                rows = [row for row in rows if codes[row] in wanted]
+            elif key == "toppings" and operators == ["$all"]:
+                wanted = set(self._codes(key, condition["$all"]))
+                if not wanted or len(wanted) < len(set(condition["$all"])):
+                    return [] # Toppings nobody has
+                rows = [row for row in rows if wanted <= set(self._toppings(row))]
+            elif key in self.columns and key in NUMERIC and operators and set(operators) <= set(["$gte", "$lte"]):
+                values = self.columns[key].values()
+                low, high = condition.get("$gte"), condition.get("$lte")
+                rows = [
+                    row for row in rows
+                    if (low is None or values[row] >= low) and (high is None or values[row] <= high)
+                ]
+            else:
+                return None
+        return rows
+
+    def feature_columns(self, rows, names):
+        # Score features of the given rows, in the shape scoring.score_columns takes, or None if one is missing
+        columns = {}
+        for name in names:
+            if name == "toppings":
+                columns[name] = [len(self._toppings(row)) + 1 for row in rows] # Count the cheese
+            elif name in self.columns:
+                values = self.columns[name].values()
+                columns[name] = [values[row] for row in rows]
+            else:
+                return None
+        return columns
+
+    def hash(self, row):
+        return self.columns["hash"][row]
+
+    def _codes(self, key, values):
+        dictionary = self.dictionaries[key]
+        return [dictionary.index(value) for value in values if value in dictionary]
+
+    def _toppings(self, row):
+        offsets = self.columns["toppings_offsets"]
+        return [self.columns["toppings"][index] for index in range(offsets[row], offsets[row + 1])]
+
+#### Listeners ####
+
+class SnapshotWriter(object):
+    """
+    Rewrites the snapshot whenever the collection is reset, e.g. when a scrape generation goes live
+    """
+
+    def __init__(self, db, path, collection_name="pizza"):
+        self.db = db
+        self.path = path
+        self.collection_name = collection_name
+
+    def on_insert(self, collection_name, document):
+        pass
+
+    def on_reset(self, collection_name):
+        if collection_name == self.collection_name:
+            started = time()
+            write_snapshot(
+                self.path, self.db.live_collection(collection_name), self.db.stream(collection_name)
+            )
+            logging.info("Snapshot of %s written to %s in %.3fs", collection_name, self.path, time() - started)
+
+class SnapshotReader(object):
+    """
+    The mapped snapshot, as long as it matches the live generation. Reopened when the generation changes
+    """
+    RETRY_SECONDS = 5 # Between looks for a snapshot of the live generation, it's written after the switch
+
+    def __init__(self, db, path, collection_name="pizza"):
+        self.db = db
+        self.path = path
+        self.collection_name = collection_name
+        self.lock = Lock()
+        self.snapshot = None
+        self.checked = 0
+
+    def on_insert(self, collection_name, document):
+        if collection_name == self.collection_name:
+            with self.lock:
+                self.snapshot, self.checked = None, time() # Out of date until the next generation
+
+    def on_reset(self, collection_name):
+        if collection_name == self.collection_name:
+            with self.lock:
+                self.snapshot, self.checked = None, 0
+
+    def current(self):
+        with self.lock:
+            if self.snapshot is None and time() - self.checked > self.RETRY_SECONDS:
+                self.checked = time()
+                self.snapshot = self._open()
+            return self.snapshot
+
+    def _open(self):
+        if not os.path.exists(self.path):
+            return None
+        try:
+            snapshot = Snapshot(self.path)
+        except Exception:
+            logging.error("Unreadable snapshot %s", self.path, exc_info=True)
+            return None
+        if snapshot.collection != self.db.live_collection(self.collection_name):
+            return None # Not written yet for this generation
+        if snapshot.rows != self.db.count(self.collection_name):
+            return None # Changed outside of a generation, e.g. cleaned
+        logging.info("Snapshot %s of %s mapped, %s rows", self.path, snapshot.collection, snapshot.rows)
+        return snapshot
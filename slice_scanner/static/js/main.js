@@ -1,6 +1,18 @@
 /* Constants */
 var FADE = 500;
 var TASK_DELAY = 800;
+var SITE_INFO = {"vendors": "vendors", "stats": "stats"};
+var PIZZA_INFO = {
+    "bases": "pizza/bases",
+    "toppings": "pizza/toppings",
+    "styles": "pizza/styles",
+    "sizes": "pizza/sizes",
+    "prices": "pizza/prices",
+    "scores": "pizza/scores",
+    "diameters": "pizza/diameters",
+    "slices": "pizza/slices"
+};
+var SIDE_INFO = {"types": "sides/types", "prices": "sides/prices"};
 
 /* Globals */
 var fetch_function = null;
@@ -19,8 +31,6 @@ var count_tmpl, range_filter_group_tmpl, about_tmpl;
 var ajax_loading = false;
 
 $(document).ready(function () {
-    ajax_load("vendors", {}, function(input){vendor_info = input;}, 5000);
-    ajax_load("stats", {}, update_counts);
     page_main = $("#page_main");
     page_title = $("#page_title");
     setInterval(run_tasks, TASK_DELAY);
@@ -41,10 +51,7 @@ function load_about_page(){
 function load_sides_page(){
     ajax_loading = true;
     show_loader($("body"), function(){
-        $.when(
-            ajax_load("sides/types", {}, function(input){side_info["types"] = input;}),
-            ajax_load("sides/prices", {}, function(input){side_info["prices"] = input;})
-        ).done(function(){
+        load_info(SIDE_INFO, side_info, function(){
             draw_product_page(add_side_filters, fetch_sides, false);
             product_total = stats["sides"]; // Total count for current selection
         });
@@ -77,16 +84,7 @@ function fetch_sides_parameters(){
 function load_pizza_page(){
     ajax_loading = true;
     show_loader($("body"), function(){
-        $.when(
-            ajax_load("pizza/bases", {}, function(input){pizza_info["bases"] = input;}),
-            ajax_load("pizza/toppings", {}, function(input){pizza_info["toppings"] = input;}),
-            ajax_load("pizza/styles", {}, function(input){pizza_info["styles"] = input;}),
-            ajax_load("pizza/sizes", {}, function(input){pizza_info["sizes"] = input;}),
-            ajax_load("pizza/prices", {}, function(input){pizza_info["prices"] = input;}),
-            ajax_load("pizza/scores", {}, function(input){pizza_info["scores"] = input;}),
-            ajax_load("pizza/diameters", {}, function(input){pizza_info["diameters"] = input;}),
-            ajax_load("pizza/slices", {}, function(input){pizza_info["slices"] = input;})
-        ).done(function(){
+        load_info(PIZZA_INFO, pizza_info, function(){
             draw_product_page(add_pizza_filters, fetch_pizza, true);
             product_total = stats["pizza"]; // Total count for current selection
         });
@@ -302,6 +300,20 @@ function fetch(endpoint, param_func, template, show_score_option){
     });
 }
 
+function load_info(queries, info, callback){
+    // A page's filter options in one request, with the vendors and counts too until we have them
+    var site = stats["pizza"] == undefined ? SITE_INFO : {};
+    batch_load($.extend({}, site, queries), function(input){
+        for( var name in queries )
+            info[name] = input[name];
+        if( input["vendors"] != undefined )
+            vendor_info = input["vendors"];
+        if( input["stats"] != undefined )
+            update_counts(input["stats"]);
+        callback();
+    });
+}
+
 function refresh_data(){
     fetch_function(0);
 }
@@ -320,6 +332,15 @@ function ajax_load(func, args, callback, timeout){
     });
 }
 
+function batch_load(queries, callback, timeout){
+    // Several API calls in one request, {name: "pizza/toppings", ...} -> callback({name: result, ...})
+    return ajax_load("batch", {"q": JSON.stringify(queries)}, function(input){
+        for( var name in input["errors"] )
+            console.log(name + ": " + input["errors"][name]);
+        callback(input["data"]);
+    }, timeout);
+}
+
 function show_loader(dom, func){
     $("#spinner").remove();
     $(dom).append($(spinner_tmpl()).fadeIn(FADE));
@@ -0,0 +1,241 @@
+import glob
+import logging
+import os
+import signal
+import tempfile
+from collections import defaultdict
+from itertools import count
+from threading import Lock
+
+from metrics import registry
+
+# Command line fragments of browser and driver processes we start, so a reused pid isn't taken for one
+BROWSER_MARKERS = ["chromedriver", "phantomjs", "geckodriver", "--test-type=webdriver", "--enable-automation", "-marionette"]
+PIDFILE = "slice_scanner-browsers-%s.pids" # Browser process trees of the supervisor in the process with that pid
+
+class SupervisedDriver(object):
+    """
+    A WebDriver owned by the DriverSupervisor. Counts page loads, and can have its browser swapped underneath it, so
+    sessions holding it don't need to know when it's been recycled
+    """
+
+    def __init__(self, slot, driver):
+        self.slot = slot
+        self.driver = driver
+        self.pages = 0
+        self.logins = set() # Vendors logged in on this browser
+
+    def get(self, url):
+        self.pages += 1
+        return self.driver.get(url)
+
+    def __getattr__(self, name):
+        return getattr(self.driver, name)
+
+class DriverSupervisor(object):
+    """
+    Starts and stops every browser a Collector uses. Recycles one after max_pages page loads or once its process tree
+    is over max_rss_mb, kills whole process trees rather than trusting quit(), and cleans up orphans left by a crash.
+    The trees are kept in a pidfile, so only browsers a supervisor started are ever taken for its orphans
+    """
+    PROC = "/proc" # Process trees and memory are read from here, so they're Linux only
+
+    def __init__(self, factory, max_pages=200, max_rss_mb=1024, pid_dir=None):
+        self.factory = factory # Starts a raw WebDriver
+        self.max_pages = max_pages
+        self.max_rss = max_rss_mb * 1024 * 1024
+        self.pid_dir = pid_dir or tempfile.gettempdir()
+        self.lock = Lock()
+        self.drivers = {} # Slot -> SupervisedDriver
+        self.trees = {} # Slot -> pids of its browser's process tree when last seen, as in the pidfile
+        self.slots = count(1)
+
+    def start(self):
+        driver = SupervisedDriver(next(self.slots), self.factory())
+        with self.lock:
+            self.drivers[driver.slot] = driver
+        self._record(driver)
+        return driver
+
+    def release(self, driver):
+        with self.lock:
+            self.drivers.pop(driver.slot, None)
+            self.trees.pop(driver.slot, None)
+        self._stop(driver.driver)
+        self._write_pids()
+        for name in ["webdriver_pages", "webdriver_rss_bytes"]:
+            registry.set(name, 0, slot=driver.slot)
+        registry.set("webdriver_count", len(self.drivers))
+
+    def recycle_if_due(self, driver):
+        # Fresh browser in place of one that's done too much or grown too big. True if recycled, it'll need a login
+        rss = self._record(driver)
+        if driver.pages < self.max_pages and (rss is None or rss < self.max_rss):
+            return False
+        logging.info("Recycling browser %s after %s pages at %sMB", driver.slot, driver.pages, (rss or 0) / 1048576)
+        registry.inc("webdriver_recycled_total")
+        self._stop(driver.driver)
+        driver.driver, driver.pages, driver.logins = self.factory(), 0, set()
+        self._record(driver)
+        return True
+
+    def shutdown(self):
+        with self.lock:
+            drivers, self.drivers, self.trees = self.drivers.values(), {}, {}
+        for driver in drivers:
+            self._stop(driver.driver)
+        self._write_pids()
+        self.reap_orphans()
+
+    def reap_orphans(self):
+        # Browser process trees recorded by supervisors whose process has died, e.g. after a crash or a kill
+        if not os.path.isdir(self.PROC):
+            return 0
+        recorded, live = [], set(pid for tree in self.trees.values() for pid in tree)
+        for path in glob.glob(os.path.join(self.pid_dir, PIDFILE % "*")):
+            owner, pids = self._read_pids(path)
+            if owner == os.getpid() or (owner is not None and os.path.isdir(os.path.join(self.PROC, str(owner)))):
+                live.update(pids)
+            else:
+                recorded.extend(pids)
+                self._remove(path)
+        children = self._children()
+        orphans = [
+            pid for pid in set(recorded) - live
+            if self._ours(pid) and any(marker in self._cmdline(pid) for marker in BROWSER_MARKERS)
+        ]
+        killed = 0
+        for pid in orphans:
+            killed += self._kill(self._tree(pid, children))
+        if killed:
+            logging.warning("Killed %s orphaned browser processes", killed)
+            registry.inc("webdriver_orphans_killed_total", killed)
+        return killed
+
+    #### Processes ####
+
+    def _stop(self, raw_driver):
+        # quit(), then make sure the driver and every browser it started are gone
+        pid = self._service_pid(raw_driver)
+        tree = self._tree(pid, self._children()) if pid and os.path.isdir(self.PROC) else []
+        try:
+            raw_driver.quit()
+        except Exception:
+            logging.error("Browser quit failed", exc_info=True)
+        self._kill(tree)
+
+    def _record(self, driver):
+        tree = self._driver_tree(driver.driver)
+        if set(tree) != set(self.trees.get(driver.slot, [])):
+            with self.lock:
+                self.trees[driver.slot] = tree
+            self._write_pids()
+        rss = self._rss(tree)
+        registry.set("webdriver_pages", driver.pages, slot=driver.slot)
+        if rss is not None:
+            registry.set("webdriver_rss_bytes", rss, slot=driver.slot)
+        registry.set("webdriver_count", len(self.drivers))
+        return rss
+
+    def _driver_tree(self, raw_driver):
+        # The driver and its browsers
+        pid = self._service_pid(raw_driver)
+        return self._tree(pid, self._children()) if pid and os.path.isdir(self.PROC) else []
+
+    def _rss(self, tree):
+        # Resident memory of a process tree
+        if not tree:
+            return None
+        page_size, rss = os.sysconf("SC_PAGE_SIZE"), 0
+        for member in tree:
+            try:
+                with open(os.path.join(self.PROC, str(member), "statm")) as f:
+                    rss += int(f.read().split()[1]) * page_size
+            except (IOError, IndexError, ValueError):
+                pass
+        return rss
+
+    @staticmethod
+    def _service_pid(raw_driver):
+        process = getattr(getattr(raw_driver, "service", None), "process", None)
+        return getattr(process, "pid", None)
+
+    def _children(self):
+        # Parent pid -> child pids
+        children = defaultdict(list)
+        for name in os.listdir(self.PROC):
+            if not name.isdigit():
+                continue
+            try:
+                with open(os.path.join(self.PROC, name, "stat")) as f:
+                    parent = int(f.read().rsplit(")", 1)[1].split()[1]) # After "pid (comm) state"
+            except (IOError, IndexError, ValueError):
+                continue
+            children[parent].append(int(name))
+        return children
+
+    @staticmethod
+    def _tree(pid, children):
+        tree, pending = [], [pid]
+        while pending:
+            member = pending.pop()
+            tree.append(member)
+            pending.extend(children.get(member, []))
+        return tree
+
+    def _cmdline(self, pid):
+        try:
+            with open(os.path.join(self.PROC, str(pid), "cmdline")) as f:
+                return f.read().replace("\0", " ")
+        except IOError:
+            return ""
+
+    def _ours(self, pid):
+        try:
+            return os.stat(os.path.join(self.PROC, str(pid))).st_uid == os.getuid()
+        except OSError:
+            return False
+
+    #### Pidfile ####
+
+    def _write_pids(self):
+        path = os.path.join(self.pid_dir, PIDFILE % os.getpid())
+        with self.lock: # Browsers are started and recycled from several threads
+            pids = sorted(set(pid for tree in self.trees.values() for pid in tree))
+            if not pids:
+                self._remove(path)
+                return
+            try:
+                with open(path + ".tmp", "w") as f:
+                    f.write("\n".join(str(pid) for pid in pids))
+                os.rename(path + ".tmp", path)
+            except (IOError, OSError):
+                logging.warning("Couldn't record browser pids in %s", path, exc_info=True)
+
+    @staticmethod
+    def _read_pids(path):
+        # (owner pid, recorded pids) of a pidfile
+        try:
+            owner = int(os.path.basename(path).split("-")[-1].split(".")[0])
+            with open(path) as f:
+                return owner, [int(line) for line in f.read().split()]
+        except (IOError, ValueError):
+            return None, []
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass # Already gone
+
+    @staticmethod
+    def _kill(pids):
+        killed = 0
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGKILL)
+                killed += 1
+            except OSError:
+                pass # Already gone
+        return killed
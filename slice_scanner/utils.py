@@ -1,8 +1,10 @@
-from flask import make_response
 from uuid import uuid5, NAMESPACE_DNS
 from logging.handlers import RotatingFileHandler
 import logging
 import json
+import os
+import time
+from metrics import registry, request_timings
 
 def read_config_file(config_file):
     with open(config_file, "r") as f:
@@ -22,23 +24,38 @@ def wrapped_execute(func, *args, **kwargs):
     try:
         return func(*args, **kwargs)
     except Exception, e:
+        registry.inc("errors_total", call=getattr(func, "__name__", None))
         logging.error("Fatal error calling %s" % str(func), exc_info=True)
 
-def raw_response(response_string):
+def raw_response(response_string, mimetype="text/plain"):
+    from flask import make_response # Only the web role needs Flask
     response = make_response(response_string)
-    response.mimetype = "text/plain"
+    response.mimetype = mimetype
     return response
 
-def json_response(response, count=None, sort=False):
+class BadArgument(ValueError):
+    """ A request argument we can't use, answered with a 400 """
+
+def json_response(response, count=None, sort=False, status=200):
+    from flask import make_response
     if sort and type(response) is list:
         response = sorted(response)
-    if count is not None:
-        response = make_response(json.dumps({"count": count, "data": response}))
-    else:
-        response = make_response(json.dumps(response))
+    with request_timings.timer("serialise"):
+        if count is not None:
+            response = make_response(json.dumps({"count": count, "data": response}))
+        else:
+            response = make_response(json.dumps(response))
     response.mimetype = "application/json"
+    response.status_code = status
     return response
 
+def write_json_report(report_dir, prefix, report):
+    # Timestamped JSON report, e.g. next to the log file
+    path = os.path.join(report_dir, "%s-%s.json" % (prefix, time.strftime("%Y%m%d-%H%M%S")))
+    with open(path, "w") as f:
+        f.write(json.dumps(report, indent=2, sort_keys=True))
+    return path
+
 def setup_logger(log_file, log_level):
     logger = logging.getLogger()
     handler = RotatingFileHandler(log_file, maxBytes=10000000, backupCount=2) # File handler
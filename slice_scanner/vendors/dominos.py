@@ -4,6 +4,8 @@ class Dominos(Vendor):
 
     id = "Dominos Pizza"
     site = "http://www.dominos.ie"
+    reuse_login = True
+    default_store = 7 # Option in the store finder
 
     diameter_reference = {
         "large": 13.5,
@@ -20,13 +22,32 @@ class Dominos(Vendor):
     }
 
     def _login(self):
-        self.web_driver.get(self.site)
-        self._script('$($("#store-finder-search select option").get(7)).prop("selected", "selected").trigger("change")')
+        self._get_page(self.site)
+        self._script(
+            '$($("#store-finder-search select option").get(%s)).prop("selected", "selected").trigger("change")' % self.store
+        )
         self._script('$("#store-finder-search .btn-primary").click()')
         self._wait_for_css(".store-details-row .btn-secondary")
         self._script('$(".store-details-row .btn-secondary").click()')
 
-    def _get_sides(self):
+    def _menu_text(self):
+        self._wait_for_css(".product")
+        return self._script(
+            'return $(".product").map(function(){ return $(this).attr("data-productid") + $(this).text() }).get().join("|")'
+        )
+
+    def _logged_in(self, url):
+        # The menu only lists pizzas once a store's been picked
+        self._return_to_menu()
+        self._wait_for_css("[id='Speciality Pizzas'] .pizza")
+        return self._element_count("[id='Speciality Pizzas'] .pizza") > 0
+
+    def _return_to_menu(self):
+        self._get_page("%s/menu" % self.site)
+        self._wait_for_alert(timeout=0.5)
+        self._wait_for_alert_to_clear(timeout=0.5)
+
+    def _get_sides(self, unit):
 
         def _mark_sides_unparsed():
             self._script('$("#Sides .product").addClass("unparsed")')
@@ -47,8 +68,9 @@ class Dominos(Vendor):
             return self._get_css_attr('#Sides .product.unparsed:first img', 'lazy-src')
 
         def _get_side_price():
-            return self._get_str_fl(self._get_css_str('#Sides .product.unparsed:first .product-price'))
+            return self._get_css_str('#Sides .product.unparsed:first .product-price')
 
+        self._return_to_menu()
         while not _sides_ready():
             self._wait()
 
@@ -64,7 +86,7 @@ class Dominos(Vendor):
             _mark_side_parsed()
             self._wait()
 
-    def _get_pizzas(self):
+    def _pizza_units(self):
 
         def _mark_pizzas_unparsed(identifier):
             self._wait_for_css(identifier)
@@ -80,21 +102,20 @@ class Dominos(Vendor):
             identifier = ".pizza.product[data-productid='%s'] .product-image" % product_id
             return self._script('return $("%s").attr("lazy-src").toString();' % identifier)
 
-        def _get_product_links():
-            product_links = {}
-            while not _all_products_parsed():
-                product_id = _get_next_unparsed_id()
-                product_links[product_id] = _get_product_img(product_id)
-            return product_links
+        _mark_pizzas_unparsed("[id='Speciality Pizzas'] .pizza")
+        _mark_pizzas_unparsed("[id='Gourmet Pizzas'] .pizza")
+
+        product_links = []
+        while not _all_products_parsed():
+            product_id = _get_next_unparsed_id()
+            product_links.append((product_id, _get_product_img(product_id)))
+        return product_links
+
+    def _get_pizzas(self, product_link):
 
         def _follow_product_link(product_id):
             self._script('$(".pizza.product[data-productid=%s] button").click()' % product_id)
 
-        def _return_to_menu():
-            self.web_driver.get("%s/menu" % self.site)
-            self._wait_for_alert(timeout=0.5)
-            self._wait_for_alert_to_clear(timeout=0.5)
-
         def _get_pizza_title():
             self._wait_for_css("h1.pizza-name")
             return self._script('return $("h1.pizza-name").first().text()')
@@ -116,9 +137,11 @@ class Dominos(Vendor):
         def _get_price():
             return self._script('return $(".pizza-price:first").text()')[1:]
 
-        def _crust_count():
+        def _crust_names():
             self._wait_for_css(".carousel-content.product")
-            return self._script('return $(".carousel-content .product").length')
+            return self._script(
+                'return $(".carousel-content .product").map(function(){ return $(this).find("p.product-title").text() }).get()'
+            )
 
         def _choose_crust(index):
             return self._script(
@@ -126,20 +149,20 @@ class Dominos(Vendor):
                 % index
             )
 
-        _mark_pizzas_unparsed("[id='Speciality Pizzas'] .pizza")
-        _mark_pizzas_unparsed("[id='Gourmet Pizzas'] .pizza")
-
-        for product_id, product_img in _get_product_links().iteritems():
-            _follow_product_link(product_id)
-            toppings = _get_pizza_toppings()
-            title = _get_pizza_title()
-            for i in range(_size_count()):
-                size = _choose_size(i)
-                self._wait()
-                for j in range(_crust_count()):
-                    crust = _choose_crust(j)
-                    self._wait()
-                    self._new_pizza(title, toppings, size, _get_price(), crust, product_img)
-                _choose_crust(0)
-
-            _return_to_menu()
+        def _price_crust(index):
+            _choose_crust(index)
+            self._wait()
+            return _get_price()
+
+        product_id, product_img = product_link
+        self._return_to_menu()
+        self._wait_for_css(".pizza.product[data-productid='%s']" % product_id)
+        _follow_product_link(product_id)
+        toppings = _get_pizza_toppings()
+        title = _get_pizza_title()
+        for i in range(_size_count()):
+            size = _choose_size(i)
+            self._wait()
+            for crust, price in self._price_crusts(size, _crust_names(), _price_crust):
+                self._new_pizza(title, toppings, size, price, crust, product_img)
+            _choose_crust(0)
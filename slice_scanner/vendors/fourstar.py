@@ -1,10 +1,16 @@
 from time import sleep
 from slice_scanner.objects.vendor import Vendor
 
+def split_toppings(description):
+    toppings = description.replace("&", ",").replace("\n", "").replace("\t", "").replace("-", "")\
+        .replace("  ", " ").split(",")
+    return [t for t in toppings if t not in ["", " "]]
+
 class FourStar(Vendor):
 
     id = "Four Star Pizza"
     site = "http://www.fourstarpizza.ie"
+    split_toppings = staticmethod(split_toppings)
 
     slice_reference = { # TODO - verify these
         16: 10,
@@ -21,7 +27,7 @@ class FourStar(Vendor):
     def _login(self):
         pass
 
-    def _get_sides(self):
+    def _side_units(self):
 
         def _next_side_type():
             return self._script("""
@@ -31,6 +37,15 @@ class FourStar(Vendor):
         def _unparsed_side_types():
             return self._element_count('.wcGroupsSubGroupList .wcGroupsGroupName') > 0
 
+        self._get_page("https://weborder3.microworks.com/fourstar/Items/Index/1012")
+
+        pages = []
+        while _unparsed_side_types():
+            pages.append(self.complete_url(_next_side_type()))
+        return pages
+
+    def _get_sides(self, page):
+
         def _unparsed_sides():
             return self._element_count('.wcItemsItem:visible') > 0
 
@@ -47,7 +62,7 @@ class FourStar(Vendor):
             return self._get_css_str(".wcItemsItem:visible:first .wcItemsItemDescription")
 
         def _get_price():
-            return self._get_str_fl(self._get_css_str(".wcItemsItem:visible:first .wcItemsItemPrice"))
+            return self._get_css_str(".wcItemsItem:visible:first .wcItemsItemPrice")
 
         def _get_image():
             return self.complete_url(self._get_css_attr(".wcItemsItem:visible:first .wcItemsItemThumb img", "src"))
@@ -55,21 +70,26 @@ class FourStar(Vendor):
         def _chicken_side():
             return 'chicken' in self._get_css_str('.wcGroupsGroup.wcGroupsCurrentGroup .wcGroupsGroupName').lower()
 
-        self.web_driver.get("https://weborder3.microworks.com/fourstar/Items/Index/1012")
+        self._get_page(page)
+        while _unparsed_sides():
+            self._new_side(_get_name(), _get_price(), _get_image(), _get_description())
+            _side_parsed()
 
-        pages = []
-        while _unparsed_side_types():
-            pages.append(self.complete_url(_next_side_type()))
+    def _pizza_units(self):
 
-        for page in pages:
-            self.web_driver.get(page)
-            while _unparsed_sides():
-                self._new_side(_get_name(), _get_price(), _get_image(), _get_description())
-                _side_parsed()
+        def _get_next_pizza_page():
+            return self._script("""
+            return $("a.wcGroupsGroupName:contains(' Pizza'):first").removeClass("wcGroupsGroupName").attr("href")
+            """)
 
-    def _get_pizzas(self):
+        self._get_page("https://weborder3.microworks.com/fourstar/Items/Index/1074")
 
-        self.web_driver.get("https://weborder3.microworks.com/fourstar/Items/Index/1074")
+        pages = []
+        while self._element_count("a.wcGroupsGroupName:contains(' Pizza')") > 0:
+            pages.append(self.complete_url(_get_next_pizza_page()))
+        return pages
+
+    def _get_pizzas(self, page):
 
         def _get_current_size():
             return self._get_str_int(self._script('return $("a.wcGroupsGroupName.wcGroupsCurrentGroup").text()'))
@@ -78,18 +98,11 @@ class FourStar(Vendor):
             return "gluten" in self._script('return $("a.wcGroupsGroupName.wcGroupsCurrentGroup").text()').lower()
 
         def _get_current_toppings():
-            toppings = self._get_css_str("#wiItemDescription").replace("&", ",").replace("\n", "").replace("\t", "")\
-                .replace("-", "").replace("  ", " ").split(",")
-            return [t for t in toppings if t not in ["", " "]]
+            return self._get_css_str("#wiItemDescription")
 
         def _get_current_price():
             self._wait_for_css(".wcItemPrice")
-            return self._get_str_fl(self._script('return $(".wcItemPrice").first().text()'))
-
-        def _get_next_pizza_page():
-            return self._script("""
-            return $("a.wcGroupsGroupName:contains(' Pizza'):first").removeClass("wcGroupsGroupName").attr("href")
-            """)
+            return self._script('return $(".wcItemPrice").first().text()')
 
         def _select_crust_tab():
             self._script("""
@@ -102,36 +115,31 @@ class FourStar(Vendor):
             return $(".wcItemModifierLabel:visible:first").removeClass("wcItemModifierLabel").children("label").text()
             """)
 
-        pages = []
-        while self._element_count("a.wcGroupsGroupName:contains(' Pizza')") > 0:
-            pages.append(self.complete_url(_get_next_pizza_page()))
-
-        for page in pages:
-            self.web_driver.get(page)
-
-            while self._element_count(".wcItemsItemSelectItemButton") > 0:
-                self._wait()
-                self._select_next_by_class("wcItemsItemSelectItemButton")
-                self._wait()
-                self._wait_for_css("#wiItemDescription")
-
-                toppings = _get_current_toppings()
-                size = _get_current_size()
-                self._wait()
-                price = _get_current_price()
-                image = self.complete_url(self._script('return $("#wiItemImage img").attr("src")'))
-                title = self._script('return $("#wiItemName").text()')
-
-                _select_crust_tab()
-                self._wait()
-                self._wait()
-                if _gluten_free():
-                    self._new_pizza(title, toppings, size, price, "Gluten Free", image)
-                else:
-                    while self._element_count(".wcItemModifierLabel:visible") > 0:
-                        self._new_pizza(title, toppings, size, price, _get_next_crust(), image)
-
-                self._script('$(".ui-dialog-titlebar button").first().click()')
-                self._wait()
+        self._get_page(page)
+
+        while self._element_count(".wcItemsItemSelectItemButton") > 0:
+            self._wait()
+            self._select_next_by_class("wcItemsItemSelectItemButton")
+            self._wait()
+            self._wait_for_css("#wiItemDescription")
+
+            toppings = _get_current_toppings()
+            size = _get_current_size()
+            self._wait()
+            price = _get_current_price()
+            image = self.complete_url(self._script('return $("#wiItemImage img").attr("src")'))
+            title = self._script('return $("#wiItemName").text()')
+
+            _select_crust_tab()
+            self._wait()
+            self._wait()
+            if _gluten_free():
+                self._new_pizza(title, toppings, size, price, "Gluten Free", image)
+            else:
+                while self._element_count(".wcItemModifierLabel:visible") > 0:
+                    self._new_pizza(title, toppings, size, price, _get_next_crust(), image)
+
+            self._script('$(".ui-dialog-titlebar button").first().click()')
+            self._wait()
 
 
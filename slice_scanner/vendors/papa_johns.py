@@ -1,10 +1,15 @@
 # coding=utf-8
 from slice_scanner.objects.vendor import Vendor
 
+def split_toppings(description):
+    return description.replace("&", ",").split(",")
+
 class PapaJohns(Vendor):
 
     id = "Papa Johns"
     site = "http://www.papajohns.ie"
+    split_toppings = staticmethod(split_toppings)
+    reuse_login = True
 
     diameter_reference = {
         "small": 10,
@@ -19,7 +24,7 @@ class PapaJohns(Vendor):
     }
 
     def _login(self):
-        self.web_driver.get("https://order.papajohns.ie/")
+        self._get_page("https://order.papajohns.ie/")
         self._wait_for_css("#countyList")
         self._script('$("#countyList ul ul a:first").click()')
         self._wait()
@@ -31,7 +36,13 @@ class PapaJohns(Vendor):
         self._script('$("#OrderSetupSubmit").click()')
         self._wait()
 
-    def _get_sides(self):
+    def _logged_in(self, url):
+        # An expired order goes back to picking a county
+        self._get_page(url)
+        self._wait()
+        return self._element_count("#countyList") == 0 and self._element_count("a:contains('Classics')") > 0
+
+    def _get_sides(self, unit):
 
         def _mark_sides_unparsed():
             return self._script('$(".row").addClass("unparsed")')
@@ -49,7 +60,7 @@ class PapaJohns(Vendor):
             return self._get_css_attr(".row.unparsed:first .product-image img", "src")
 
         def _get_price():
-            return self._get_str_fl(self._get_css_str(".row.unparsed:first .product-price-value").strip())
+            return self._get_css_str(".row.unparsed:first .product-price-value")
 
         def _get_description():
             return self._get_css_str(".row.unparsed:first .product-desc-with-image")
@@ -67,7 +78,10 @@ class PapaJohns(Vendor):
             _mark_side_parsed()
             self._wait()
 
-    def _get_pizzas(self):
+    def _pizza_units(self):
+        return ["Finest", "Classics"]
+
+    def _get_pizzas(self, category):
 
         def _get_ids():
             links = []
@@ -95,56 +109,40 @@ class PapaJohns(Vendor):
             return self._get_css_attr('.product-image img', 'src')
 
         def _get_toppings():
-            return _get_description().replace("&", ",").split(",")
+            return _get_description()
 
         def _get_description():
             self._wait_for_css('.product-desc')
             return self._get_css_str('.product-desc')
 
         def _get_price():
-            return self._get_str_fl(self._get_css_str('#CurrentPrice'))
+            return self._get_css_str('#CurrentPrice')
 
         def _size_count():
             return self._element_count('#OptionGroups_0__Options_0__list option')
 
-        def _mark_crusts_unparsed():
+        def _crust_names():
             return self._script("""
-                $("#OptionGroups_0__Options_0__OptionItems_2__Options_0__list_quantity_div label").addClass("unparsed")
+                return $("#OptionGroups_0__Options_0__OptionItems_2__Options_0__list_quantity_div label")
+                    .map(function(){ return $(this).text() }).get()
             """)
 
-        def _all_crusts_parsed():
-            return self._element_count(".unparsed") == 0
-
-        def _next_crust():
-            return self._script('return $(".unparsed:first").removeClass("unparsed").text()')
+        def _price_crust(index):
+            self._wait()
+            return _get_price()
 
         def _loop_crusts(size):
-            _mark_crusts_unparsed()
-            while not _all_crusts_parsed():
-                _capture(_next_crust(), size)
-
-        def _capture(crust, size):
-            self._wait()
-            self._new_pizza(
-                _get_title(),
-                _get_toppings(),
-                size,
-                _get_price(),
-                crust,
-                _get_image()
-            )
+            title, toppings, image = _get_title(), _get_toppings(), _get_image()
+            for crust, price in self._price_crusts(size, _crust_names(), _price_crust):
+                self._new_pizza(title, toppings, size, price, crust, image)
 
         def _loop_sizes():
             for i in range(1, _size_count()):
                 self._select_dropdown_option("OptionGroups_0__Options_0__list", i)
                 _loop_crusts(["Small", "Medium", "Large"][i-1])
 
-        def _parse_pizza_category(title):
-            _select_pizza_category(title)
-            for pizza_id in _get_ids():
-                _follow_pizza_link(pizza_id)
-                _loop_sizes()
-                _select_pizza_category(title)
-
-        _parse_pizza_category("Finest")
-        _parse_pizza_category("Classics")
+        _select_pizza_category(category)
+        for pizza_id in _get_ids():
+            _follow_pizza_link(pizza_id)
+            _loop_sizes()
+            _select_pizza_category(category)
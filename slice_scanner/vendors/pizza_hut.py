@@ -1,9 +1,15 @@
 from slice_scanner.objects.vendor import Vendor
 
+def split_toppings(description):
+    toppings = description.replace("\n", "").replace("-", "").replace("  ", " ").split(",")
+    return [t for t in toppings if t not in ["", " "]]
+
 class PizzaHut(Vendor):
 
     id = "Pizza Hut"
     site = "http://www.pizzahutdelivery.ie"
+    split_toppings = staticmethod(split_toppings)
+    default_store = 2633 # Location id
 
     diameter_reference = {
         "large": 13.5,
@@ -22,10 +28,16 @@ class PizzaHut(Vendor):
     }
 
     def _login(self):
-        self.web_driver.get("http://www.pizzahutdelivery.ie/order-online.php?location_id=2633&method=delivery")
+        self._get_page("http://www.pizzahutdelivery.ie/order-online.php?location_id=%s&method=delivery" % self.store)
         self._wait()
 
-    def _get_sides(self):
+    def _menu_text(self):
+        return self._script('return $(".m2g-menu-product").map(function(){ return $(this).text() }).get().join("|")')
+
+    def _side_units(self):
+        return ["Classic Sides", "Premium Sides"]
+
+    def _get_sides(self, side_type):
 
         def _select_type(side_type):
             self._wait()
@@ -42,7 +54,7 @@ class PizzaHut(Vendor):
             self._script('$(".m2g-menu-product.unparsed:visible:first").removeClass("unparsed")')
 
         def _get_price():
-            return self._get_str_fl(self._get_css_str('.m2g-menu-product.unparsed:visible:first .m2g-menu-product-price'))
+            return self._get_css_str('.m2g-menu-product.unparsed:visible:first .m2g-menu-product-price')
 
         def _get_name():
             return self._get_css_str('.m2g-menu-product.unparsed:visible:first .m2g-menu-product-name')
@@ -62,14 +74,13 @@ class PizzaHut(Vendor):
                 _parse_next()
                 _mark_parsed()
 
-        def _parse_side_page(title):
-            _select_type(title)
-            _parse_visible()
+        _select_type(side_type)
+        _parse_visible()
 
-        _parse_side_page("Classic Sides")
-        _parse_side_page("Premium Sides")
+    def _pizza_units(self):
+        return ["Personal Pizzas", "Regular Pizzas", "Medium Pizzas", "Large Pizzas"]
 
-    def _get_pizzas(self):
+    def _get_pizzas(self, size):
 
         def _select_size(size):
             self._script('$("a[data-category-name=\'%s\']").click()' % size)
@@ -87,12 +98,10 @@ class PizzaHut(Vendor):
             return self._script('return $(".m2g-menu-product button.unparsed:visible").length') == 0
 
         def _get_price():
-            return self._get_str_fl(self._get_css_str('.m2g-product-editor-price'))
+            return self._get_css_str('.m2g-product-editor-price')
 
         def _get_toppings():
-            toppings = self._get_css_str(".m2g-product-editor-product-description").replace("\n", "").replace("-", "")\
-                .replace("  ", " ").split(",")
-            return [t for t in toppings if t not in ["", " "]]
+            return self._get_css_str(".m2g-product-editor-product-description")
 
         def _get_name():
             return self._get_css_str('.m2g-product-editor-product-name').split("(")[0]
@@ -103,43 +112,29 @@ class PizzaHut(Vendor):
         def _get_image():
             return self._get_css_attr('.m2g-product-editor-product-image', 'src')
 
-        def _mark_bases_unparsed():
-            self._script('$("div:visible[data-modifier-group-name*=\'Base\'] div.m2g-icon--checkbox").addClass("unparsed")')
+        def _base_names():
+            bases = self._script('return $("div:visible[data-modifier-group-name*=\'Base\'] div.m2g-touchable").map(function(){ return $(this).attr("data-modifier-name") }).get()')
+            return [base.split("] ")[1] for base in bases]
 
-        def _all_bases_parsed():
-            return self._script('return $("div:visible[data-modifier-group-name*=\'Base\'] div.m2g-icon--checkbox.unparsed").length') == 0
-
-        def _parse_next_base():
-            self._script('$("div:visible[data-modifier-group-name*=\'Base\'] div.m2g-icon--checkbox.unparsed").first().click().removeClass("unparsed")')
+        def _price_base(index):
+            self._script('$("div:visible[data-modifier-group-name*=\'Base\'] div.m2g-icon--checkbox").eq(%s).click()' % index)
             self._wait()
-            base = self._script('return $("div:visible[data-modifier-group-name*=\'Base\'] div.m2g-touchable[data-selection-state=on]").attr("data-modifier-name")')
-            if not base:
-                base = self._script('return $("div:visible[data-modifier-group-name*=\'Base\'] div.m2g-touchable[data-selection-state=off]").first().attr("data-modifier-name")')
-            return base.split("] ")[1]
+            return _get_price()
 
         def _parse_next():
             self._script('$(".m2g-menu-product button.unparsed:visible").first().click().removeClass("unparsed")')
             self._wait()
 
-            _mark_bases_unparsed()
-
             name = _get_name()
             size = _get_size()
             toppings = _get_toppings()
             image = _get_image()
 
-            while not _all_bases_parsed():
-                base = _parse_next_base()
-                self._new_pizza(name, toppings, size, _get_price(), base, image)
+            for base, price in self._price_crusts(size, _base_names(), _price_base):
+                self._new_pizza(name, toppings, size, price, base, image)
 
             self._script('$("button.m2g-modal-close-button").click()')
             self._wait()
 
-        _select_size("Personal Pizzas")
-        _get_current_pizzas()
-        _select_size("Regular Pizzas")
-        _get_current_pizzas()
-        _select_size("Medium Pizzas")
-        _get_current_pizzas()
-        _select_size("Large Pizzas")
+        _select_size(size)
         _get_current_pizzas()
\ No newline at end of file
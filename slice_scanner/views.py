@@ -1,15 +1,63 @@
-from flask import request
-from slice_scanner.utils import json_response
-from slice_scanner import app
-from slice_scanner import db_wrapper as db
+import json
+import logging
+from flask import Blueprint, current_app, request
+from werkzeug.local import LocalProxy
+from slice_scanner.utils import BadArgument, json_response, raw_response, wrapped_execute
+from slice_scanner.metrics import registry, request_timings
+from slice_scanner.scoring import profiles
 
-@app.route('/')
+api = Blueprint("api", __name__)
+slow_query_log = logging.getLogger("slow_query")
+MAX_BATCH = 32 # Sub-queries in one /batch request
+MAX_LOOKUP = 100 # Hashes in one /lookup request
+MAX_EXPLAINED = 3 # Queries of a slow request explained in the log, a /batch can run dozens
+UNBATCHED = ["api.batch", "api.index", "api.metrics"] # API endpoints that aren't JSON
+
+def _service(name):
+    # Services are handed to the app by create_app
+    return LocalProxy(lambda: current_app.extensions["slice_scanner"][name])
+
+db = _service("db")
+meal_optimiser = _service("meal_optimiser")
+search_index = _service("search_index")
+batch_pool = _service("batch_pool")
+
+### Timing ####
+
+@api.before_app_request
+def start_request_timer():
+    request_timings.start()
+
+@api.after_app_request
+def record_request_timings(response):
+    endpoint, total = (request.endpoint or "unknown").split(".")[-1], request_timings.total()
+    registry.observe("api_request_seconds", total, endpoint=endpoint, stage="total")
+    for stage, seconds in request_timings.stages.iteritems():
+        registry.observe("api_request_seconds", seconds, endpoint=endpoint, stage=stage)
+
+    if total > current_app.config["SLOW_REQUEST_SECONDS"] and current_app.config["SLOW_REQUEST_LOG"] and (
+        slow_query_log.isEnabledFor(logging.WARNING)
+    ):
+        slow_query_log.warning(
+            "Slow request: %s %.1fms stages=%s plans=%s",
+            request.full_path,
+            total * 1000,
+            request_timings.stages,
+            [wrapped_execute(db.explain, *query) for query in request_timings.queries[:MAX_EXPLAINED]]
+        )
+    return response
+
+@api.errorhandler(BadArgument)
+def bad_argument(error):
+    return json_response({"error": str(error)}, status=400)
+
+@api.route('/')
 def index():
-    return app.send_static_file('index.html')
+    return current_app.send_static_file('index.html')
 
 ### Pizza API ####
 
-@app.route('/pizza')
+@api.route('/pizza')
 def pizza():
     data, count = db.get_pizza(
         toppings=request.args.get("toppings"),
@@ -17,54 +65,62 @@ def pizza():
         base_style=request.args.get("base_style"),
         diameter=request.args.get("diameter", []),
         vendor=request.args.get("vendor"),
+        store=request.args.get("store"),
         slices=request.args.get("slices", []),
         price=request.args.get("price", []),
         score=request.args.get("score", []),
         sort_by=request.args.get("sort_by"),
         sort_dir=request.args.get("sort_dir"),
+        score_profile=request.args.get("score_profile"),
+        collapse=request.args.get("collapse"),
         page=request.args.get("page"),
     )
     return json_response(data, count=count)
 
-@app.route('/pizza/toppings')
+@api.route('/pizza/profiles')
+def pizza_profiles():
+    return json_response(profiles)
+
+@api.route('/pizza/toppings')
 def pizza_toppings():
     return json_response(db.distinct("pizza", "toppings"), sort=True)
 
-@app.route('/pizza/diameters')
+@api.route('/pizza/diameters')
 def pizza_diameters():
     return json_response(db.range("pizza", "diameter"))
 
-@app.route('/pizza/styles')
+@api.route('/pizza/styles')
 def pizza_styles():
     return json_response(db.distinct("pizza", "style"), sort=True)
 
-@app.route('/pizza/slices')
+@api.route('/pizza/slices')
 def pizza_slices():
     return json_response(db.range("pizza", "slices"))
 
-@app.route('/pizza/bases')
+@api.route('/pizza/bases')
 def pizza_bases():
     return json_response(db.distinct("pizza", "base_style"), sort=True)
 
-@app.route('/pizza/sizes')
+@api.route('/pizza/sizes')
 def pizza_sizes():
     return json_response(db.range("pizza", "size"))
 
-@app.route('/pizza/prices')
+@api.route('/pizza/prices')
 def pizza_prices():
     return json_response(db.range("pizza", "price"))
 
-@app.route('/pizza/scores')
+@api.route('/pizza/scores')
 def pizza_scores():
     return json_response(db.range("pizza", "score"))
 
 ### Side API ####
 
-@app.route('/sides')
+@api.route('/sides')
 def sides():
     data, count = db.get_sides(
         type=request.args.get("type"),
         vendor=request.args.get("vendor", []),
+        store=request.args.get("store"),
         price=request.args.get("price", []),
         sort_by=request.args.get("sort_by"),
         sort_dir=request.args.get("sort_dir"),
@@ -72,23 +128,85 @@ def sides():
     )
     return json_response(data, count=count)
 
-@app.route('/sides/types')
+@api.route('/sides/types')
 def sides_types():
     return json_response(db.distinct("sides", "type"), sort=True)
 
-@app.route('/sides/prices')
+@api.route('/sides/prices')
 def sides_prices():
     return json_response(db.range("sides", "price"))
 
+### Lookup API ####
+
+@api.route('/lookup')
+def lookup():
+    collection = "sides" if request.args.get("collection") == "sides" else "pizza"
+    try:
+        hashes = json.loads(request.args.get("hashes", "[]"))
+    except ValueError:
+        hashes = None
+    if type(hashes) is not list or any(type(product_hash) not in [str, unicode] for product_hash in hashes):
+        raise BadArgument("hashes must be a JSON list of product hashes")
+    data, count = db.lookup(collection, hashes[:MAX_LOOKUP])
+    return json_response(data, count=count)
+
+### Search API ####
+
+@api.route('/search')
+def search():
+    collection = "sides" if request.args.get("collection") == "sides" else "pizza"
+    hits = search_index.search(collection, request.args.get("q", ""))
+    data, count = db.get_hits(
+        collection,
+        hits,
+        toppings=request.args.get("toppings"),
+        style=request.args.get("style"),
+        base_style=request.args.get("base_style"),
+        type=request.args.get("type"),
+        vendor=request.args.get("vendor"),
+        store=request.args.get("store"),
+        diameter=request.args.get("diameter"),
+        slices=request.args.get("slices"),
+        price=request.args.get("price"),
+        score=request.args.get("score"),
+        page=request.args.get("page")
+    )
+    return json_response(data, count=count)
+
+@api.route('/search/complete')
+def search_complete():
+    return json_response(search_index.complete(request.args.get("q", "")))
+
+### Optimiser API ####
+
+@api.route('/optimise')
+def optimise():
+    try:
+        sides = json.loads(request.args.get("sides") or "null")
+    except ValueError:
+        sides = False
+    if sides is not None and (type(sides) is not list or any(type(side) not in [str, unicode] for side in sides)):
+        raise BadArgument("Sides must be a JSON list of side types")
+    return json_response(meal_optimiser.optimise(
+        request.args.get("people", 1),
+        budget=request.args.get("budget"),
+        vendor=request.args.get("vendor"),
+        sides=sides
+    ))
+
 ### Vendor API ####
 
-@app.route('/vendors')
+@api.route('/vendors')
 def vendors():
     return json_response(db.distinct("pizza", "vendor"), sort=True)
 
+@api.route('/stores')
+def stores():
+    return json_response(db.distinct("pizza", "stores"), sort=True)
+
 ### Stats API ####
 
-@app.route('/stats')
+@api.route('/stats')
 def stats():
     return json_response({
         "pizza": db.count("pizza"),
@@ -97,4 +215,60 @@ def stats():
         "drinks": db.count("drinks"),
         "combos": db.count("combos"),
         "vendors": len(db.distinct("pizza", "vendor"))
-    })
\ No newline at end of file
+    })
+
+### Batch API ####
+
+@api.route('/batch')
+def batch():
+    # Several API calls in one request, q={name: "pizza/toppings", name: "pizza?page=0", ...}. They're run
+    # concurrently, and the combined document has each one's result under its name in data, or its error in errors
+    try:
+        queries = json.loads(request.args.get("q", "{}"))
+    except ValueError:
+        queries = None
+    if type(queries) is not dict:
+        raise BadArgument("q must be a JSON object of name to query")
+    if len(queries) > MAX_BATCH:
+        raise BadArgument("At most %d queries in a batch" % MAX_BATCH)
+    app = current_app._get_current_object()
+    names = sorted(queries)
+    results = batch_pool.map(lambda name: _subquery(app, queries[name]), names)
+
+    data, errors = [], {}
+    for name, (body, error, stages, plans) in zip(names, results):
+        if error:
+            errors[name] = error
+        else:
+            data.append("%s: %s" % (json.dumps(name), body))
+        for stage, seconds in stages.iteritems():
+            request_timings.stages[stage] = request_timings.stages.get(stage, 0.0) + seconds
+        request_timings.queries += plans
+    registry.inc("api_batch_queries_total", len(names))
+    return raw_response(
+        '{"data": {%s}, "errors": %s}' % (", ".join(data), json.dumps(errors)), mimetype="application/json"
+    )
+
+def _subquery(app, path):
+    # (JSON body, error, timings, queries) of an API call, run through the app's routing on this pool thread
+    if type(path) not in [str, unicode]:
+        return None, "Not a query: %s" % json.dumps(path), {}, []
+    path, _, query_string = path.partition("?")
+    with app.test_request_context("/" + path.lstrip("/"), query_string=query_string):
+        request_timings.start()
+        if request.routing_exception is not None or request.blueprint != "api" or request.endpoint in UNBATCHED:
+            return None, "No such query: %s" % path, {}, []
+        try:
+            response = app.view_functions[request.endpoint](**request.view_args)
+        except BadArgument as e:
+            return None, "%s: %s" % (path, e), request_timings.stages, request_timings.queries
+        except Exception as e:
+            logging.error("Batched query %s failed", path, exc_info=True)
+            return None, "%s failed: %s" % (path, e), request_timings.stages, request_timings.queries
+        return response.get_data(), None, request_timings.stages, request_timings.queries
+
+### Metrics API ####
+
+@api.route('/metrics')
+def metrics():
+    return raw_response(registry.render())
@@ -0,0 +1,26 @@
+from multiprocessing.pool import ThreadPool
+from flask import Flask
+from views import api
+
+def create_app(cfg, db_wrapper, meal_optimiser, search_index):
+    # Application factory, the views reach the services through the app
+    app = Flask("slice_scanner", static_url_path='')
+    app.config["SLOW_REQUEST_SECONDS"] = cfg["web_server"].get("slow_query_ms", 500) / 1000.0
+    app.config["SLOW_REQUEST_LOG"] = cfg["logging"].get("enabled", False) # Explains are extra queries, only if kept
+    app.extensions["slice_scanner"] = {
+        "db": db_wrapper,
+        "meal_optimiser": meal_optimiser,
+        "search_index": search_index,
+        "batch_pool": ThreadPool(cfg["web_server"].get("batch_workers", 4)) # Runs the sub-queries of /batch
+    }
+    app.register_blueprint(api)
+    return app
+
+def serve(app, host, port):
+    # Run with Tornado
+    from tornado.wsgi import WSGIContainer
+    from tornado.httpserver import HTTPServer
+    from tornado.ioloop import IOLoop
+    http_server = HTTPServer(WSGIContainer(app))
+    http_server.listen(port, address=host)
+    IOLoop.instance().start()
@@ -0,0 +1,52 @@
+import logging
+import os
+import socket
+import traceback
+from threading import Thread, Event
+from time import sleep
+
+from metrics import registry
+
+class Worker(object):
+    """
+    Claims jobs from a JobQueue and runs them through a handler, heartbeating to keep the lease while they run
+    """
+    POLL_SECONDS = 5
+
+    def __init__(self, jobs, handler, worker_id=None):
+        self.jobs = jobs
+        self.handler = handler # Called with each claimed job
+        self.id = worker_id or "%s:%s" % (socket.gethostname(), os.getpid())
+
+    def run(self):
+        logging.info("Worker %s Running", self.id)
+        while True:
+            if not self.work_once():
+                sleep(self.POLL_SECONDS)
+
+    def work_once(self):
+        job = self.jobs.claim(self.id)
+        if job is None:
+            return False
+
+        finished = Event()
+        heartbeat = Thread(target=self._heartbeat, args=(job, finished))
+        heartbeat.daemon = True
+        heartbeat.start()
+        try:
+            self.handler(job)
+            self.jobs.complete(job, self.id)
+            registry.inc("jobs_completed_total", vendor=job["vendor"])
+        except Exception:
+            logging.error("Job %s failed", job["_id"], exc_info=True)
+            self.jobs.fail(job, self.id, traceback.format_exc())
+            registry.inc("jobs_failed_total", vendor=job["vendor"])
+        finally:
+            finished.set()
+        return True
+
+    def _heartbeat(self, job, finished):
+        while not finished.wait(self.jobs.LEASE_SECONDS / 3.0):
+            if not self.jobs.heartbeat(job, self.id):
+                logging.warning("Worker %s lost the lease on job %s", self.id, job["_id"])
+                return